@@ -0,0 +1,224 @@
+# Control d'admissió de l'ingesta de lectures (POST /lectures/ i POST /lectures/batch)
+#
+# Un sensor que envia lectures sense parar no pot deixar sense base de dades la resta.
+# Abans de fer cap feina l'ingesta passa per:
+#  - un token bucket per sensor, amb la taxa i la ràfega segons sensors.estat;
+#  - un token bucket global del worker;
+#  - la cua del buffer d'ingesta: per sobre de ADMISSIO_CUA es rebutja de seguida en
+#    lloc d'esperar que s'alliberi;
+#  - ADMISSIO_ESCRIPTORS lots en curs com a màxim, i sempre ADMISSIO_RESERVA connexions
+#    del pool lliures: les consultes de l'app (/plantes/, /humitat/...) no en tenen
+#    límit i són les últimes a quedar-se sense connexió.
+# El que no passa es rebutja amb LimitIngesta (429 amb Retry-After). Els límits són per
+# worker: amb N workers el global real és N vegades ADMISSIO_GLOBAL.
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import referencia
+from client import POOL_SIZE
+from client_async import pool_async_stats
+from ingesta import buffer_ingesta, sensor_id_item
+from metriques import lectures_rebutjades
+
+
+def _llegir_estats(text):
+    # "Inactiu=0.05/5,Manteniment=0/0": lectures per segon i ràfega per estat
+    estats = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        estat, _, limit = part.partition("=")
+        taxa, _, rafega = limit.partition("/")
+        estats[estat.strip()] = (float(taxa), float(rafega or taxa))
+    return estats
+
+
+ADMISSIO_SENSOR = float(os.environ.get("ECOSENSE_ADMISSIO_SENSOR", "1"))
+ADMISSIO_SENSOR_RAFEGA = float(os.environ.get("ECOSENSE_ADMISSIO_SENSOR_RAFEGA", "120"))
+ADMISSIO_ESTATS = _llegir_estats(os.environ.get("ECOSENSE_ADMISSIO_ESTATS", "Inactiu=0.05/5"))
+ADMISSIO_GLOBAL = float(os.environ.get("ECOSENSE_ADMISSIO_GLOBAL", "5000"))
+ADMISSIO_GLOBAL_RAFEGA = float(os.environ.get("ECOSENSE_ADMISSIO_GLOBAL_RAFEGA", "20000"))
+ADMISSIO_CUA = float(os.environ.get("ECOSENSE_ADMISSIO_CUA", "0.8"))
+ADMISSIO_ESCRIPTORS = int(os.environ.get("ECOSENSE_ADMISSIO_ESCRIPTORS", str(max(1, POOL_SIZE // 2))))
+ADMISSIO_RESERVA = int(os.environ.get("ECOSENSE_ADMISSIO_RESERVA", "2"))
+ADMISSIO_MAX_SENSORS = 100000
+# Retry-After quan esperar no servirà (taxa 0) o no se sap quant (cua, escriptors)
+ADMISSIO_REINTENT_MAX = 60
+
+
+class LimitIngesta(Exception):
+    def __init__(self, missatge, reintent):
+        super().__init__(missatge)
+        self.reintent = reintent
+
+
+def _reintent(segons):
+    return max(1, min(ADMISSIO_REINTENT_MAX, math.ceil(segons)))
+
+
+class Cub:
+    __slots__ = ("taxa", "rafega", "tokens", "actualitzat")
+
+    def __init__(self, taxa, rafega, ara):
+        self.taxa = taxa
+        self.rafega = rafega
+        self.tokens = rafega
+        self.actualitzat = ara
+
+    def omplir(self, ara):
+        self.tokens = min(self.rafega, self.tokens + (ara - self.actualitzat) * self.taxa)
+        self.actualitzat = ara
+
+    def espera(self, n):
+        # Segons fins que hi haurà n tokens (després d'omplir)
+        if self.tokens >= n:
+            return 0.0
+        if self.taxa <= 0 or n > self.rafega:
+            return float(ADMISSIO_REINTENT_MAX)
+        return (n - self.tokens) / self.taxa
+
+
+class Admissio:
+    def __init__(self):
+        self._global = Cub(ADMISSIO_GLOBAL, ADMISSIO_GLOBAL_RAFEGA, time.monotonic())
+        # LRU: un sensor que fa estona que no envia té el cub ple, descartar-lo no canvia res
+        self._sensors = OrderedDict()
+        self._escriptors = 0
+
+        self._admeses = 0
+        self._rebutjades = {"sensor": 0, "global": 0, "cua": 0, "escriptors": 0, "reserva": 0}
+        self._rebutjades_estat = {}
+
+    def _cub(self, sensor_id, estat, ara):
+        taxa, rafega = ADMISSIO_ESTATS.get(estat, (ADMISSIO_SENSOR, ADMISSIO_SENSOR_RAFEGA))
+        cub = self._sensors.get(sensor_id)
+        if cub is None:
+            cub = self._sensors[sensor_id] = Cub(taxa, rafega, ara)
+            if len(self._sensors) > ADMISSIO_MAX_SENSORS:
+                self._sensors.popitem(last=False)
+        else:
+            self._sensors.move_to_end(sensor_id)
+            cub.omplir(ara)
+            # L'estat del sensor pot haver canviat
+            cub.taxa, cub.rafega = taxa, rafega
+            cub.tokens = min(cub.tokens, rafega)
+        return cub
+
+    def _comptar(self, motiu, n, estat=None):
+        self._rebutjades[motiu] += n
+        if motiu == "sensor":
+            self._rebutjades_estat[estat] = self._rebutjades_estat.get(estat, 0) + n
+        lectures_rebutjades.labels(motiu, str(estat) if motiu == "sensor" else "").inc(n)
+
+    def _rebutjar(self, motiu, n, missatge, segons, estat=None):
+        self._comptar(motiu, n, estat)
+        raise LimitIngesta(missatge, _reintent(segons))
+
+    def _comprovar_pool(self):
+        estat = pool_async_stats()
+        if "maxsize" in estat and estat["maxsize"] - estat["in_use"] <= ADMISSIO_RESERVA:
+            return False
+        return True
+
+    async def _estats(self, sensor_ids):
+        per_id = await referencia.sensors.per_id()
+        return {sensor_id: per_id[sensor_id].estat if sensor_id in per_id else None for sensor_id in sensor_ids}
+
+    async def admetre(self, sensor_id):
+        # POST /lectures/: una lectura cap al buffer d'ingesta
+        estat = (await self._estats([sensor_id]))[sensor_id]
+        ara = time.monotonic()
+        if buffer_ingesta.ocupacio() >= ADMISSIO_CUA:
+            self._rebutjar("cua", 1, "El buffer d'ingesta està gairebé ple", buffer_ingesta.interval_flush)
+        cub = self._cub(sensor_id, estat, ara)
+        if (segons := cub.espera(1)) > 0:
+            self._rebutjar("sensor", 1, f"Massa lectures del sensor {sensor_id}", segons, estat)
+        self._global.omplir(ara)
+        if (segons := self._global.espera(1)) > 0:
+            self._rebutjar("global", 1, "Massa lectures", segons)
+        cub.tokens -= 1
+        self._global.tokens -= 1
+        self._admeses += 1
+
+    async def admetre_lot(self, items):
+        # POST /lectures/batch, abans de tocar la base de dades. Torna els índexs de les
+        # lectures dels sensors que passen del seu límit (validar_lectures les rebutja una a
+        # una, com les invàlides) i quantes n'han entrat. Si no n'entra cap, o el global no
+        # arriba, el lot sencer.
+        if not items:
+            return set(), 0
+        sensor_ids = [sensor_id_item(item) for item in items]
+        estats = await self._estats({s for s in sensor_ids if s is not None})
+        ara = time.monotonic()
+        disponibles, rebutjades, limitades = {}, {}, set()
+        for index, sensor_id in enumerate(sensor_ids):
+            if sensor_id is None:
+                continue
+            if sensor_id not in disponibles:
+                disponibles[sensor_id] = self._cub(sensor_id, estats[sensor_id], ara).tokens
+            if disponibles[sensor_id] >= 1:
+                disponibles[sensor_id] -= 1
+            else:
+                rebutjades[sensor_id] = rebutjades.get(sensor_id, 0) + 1
+                limitades.add(index)
+
+        # Les que no tenen sensor_id vàlid no es desaran: no compten per al global ni l'escriptor
+        admeses = sum(1 for sensor_id in sensor_ids if sensor_id is not None) - len(limitades)
+        # Abans de cobrar tokens: un lot que escriptor() rebutjaria no es desa
+        if admeses:
+            self._comprovar_escriptors(admeses)
+        self._global.omplir(ara)
+        if (segons := self._global.espera(admeses)) > 0:
+            self._rebutjar("global", admeses, "Massa lectures", segons)
+        for sensor_id, n in rebutjades.items():
+            self._comptar("sensor", n, estats[sensor_id])
+        if not admeses and limitades:
+            segons = min(self._sensors[s].espera(1) for s in rebutjades)
+            raise LimitIngesta("Massa lectures dels sensors del lot", _reintent(segons))
+
+        for sensor_id, tokens in disponibles.items():
+            self._sensors[sensor_id].tokens = tokens
+        self._global.tokens -= admeses
+        self._admeses += admeses
+        return limitades, admeses
+
+    def _comprovar_escriptors(self, n):
+        if self._escriptors >= ADMISSIO_ESCRIPTORS:
+            self._rebutjar("escriptors", n, "Massa lots d'ingesta en curs", 1)
+        if not self._comprovar_pool():
+            self._rebutjar("reserva", n, "Les connexions lliures queden per a les consultes", 1)
+
+    @asynccontextmanager
+    async def escriptor(self, n):
+        # Lots (de n lectures) desats alhora: sense cua, si no hi ha lloc es rebutja de seguida.
+        # admetre_lot ja ho ha comprovat i entre totes dues no hi ha cap await.
+        self._comprovar_escriptors(n)
+        self._escriptors += 1
+        try:
+            yield
+        finally:
+            self._escriptors -= 1
+
+    def stats(self, per_estat=True) -> dict:
+        # Sense per_estat per a /metrics: els estats no són noms de mètrica vàlids
+        # (hi són com a etiqueta de ecosense_ingesta_rebutjades_total)
+        return {
+            "admeses": self._admeses,
+            "rebutjades": dict(self._rebutjades),
+            **({"rebutjades_per_estat": {str(e): n for e, n in self._rebutjades_estat.items()}} if per_estat else {}),
+            "sensors": len(self._sensors),
+            "global_tokens": self._global.tokens,
+            "escriptors_en_curs": self._escriptors,
+            "limits": {
+                "sensor": [ADMISSIO_SENSOR, ADMISSIO_SENSOR_RAFEGA],
+                "estats": {estat: list(limit) for estat, limit in ADMISSIO_ESTATS.items()},
+                "global": [ADMISSIO_GLOBAL, ADMISSIO_GLOBAL_RAFEGA],
+                "cua": ADMISSIO_CUA,
+                "escriptors": ADMISSIO_ESCRIPTORS,
+                "reserva": ADMISSIO_RESERVA,
+            },
+        }
+
+
+admissio = Admissio()
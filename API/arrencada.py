@@ -0,0 +1,93 @@
+# Escalfament en arrencar i estat de preparació (GET /ready)
+#
+# El lifespan fa primer el que no depèn de la base de dades (processos de bcrypt, variants
+# de les imatges, buffers) i després engega l'escalfament en segon pla: fitxers estàtics,
+# pool de connexions, migracions de l'esquema, connexions, dades de referència i últimes
+# lectures. Fins que acaba, /ready torna 503 i el balancejador no envia trànsit al worker.
+# Les fases van en ordre: si una falla (p. ex. la base de dades encara no respon), ella i
+# les que la segueixen es tornen a provar cada ARRENCADA_REINTENT segons.
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+
+# Sempre a stderr (uvicorn no configura els loggers de l'aplicació)
+logger = logging.getLogger("ecosense.arrencada")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_handler = logging.StreamHandler()
+_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+logger.addHandler(_handler)
+
+ARRENCADA_REINTENT = 5
+
+# main.py importa aquest mòdul primer: el temps d'arrencada inclou importar l'API
+_INICI = time.monotonic()
+
+
+class Arrencada:
+    def __init__(self):
+        self.preparat = False
+        self.fases = {}
+        self.errors = {}
+        self.segons = None
+        self._tasca = None
+
+    @contextmanager
+    def mesurar(self, nom):
+        inici = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.fases[nom] = time.perf_counter() - inici
+
+    async def _fase(self, nom, funcio):
+        try:
+            with self.mesurar(nom):
+                await funcio()
+        except Exception as err:
+            self.errors[nom] = str(err)
+            logger.warning("Escalfament: la fase %s ha fallat: %s", nom, err)
+            return False
+        self.errors.pop(nom, None)
+        return True
+
+    async def _escalfar(self, fases):
+        # Les següents poden dependre de la que ha fallat (l'esquema del pool, etc.)
+        pendents = list(fases)
+        while True:
+            while pendents and await self._fase(*pendents[0]):
+                pendents.pop(0)
+            if not pendents:
+                break
+            await asyncio.sleep(ARRENCADA_REINTENT)
+        self.segons = time.monotonic() - _INICI
+        self.preparat = True
+        logger.info("Arrencada en %.2f s (%s)", self.segons,
+                    ", ".join(f"{nom} {segons * 1000:.0f} ms" for nom, segons in self.fases.items()))
+
+    def escalfar(self, fases):
+        # fases: [(nom, funció async)], s'executen en ordre i cadascuna un cop ha acabat l'anterior
+        self._tasca = asyncio.create_task(self._escalfar(fases))
+
+    async def aturar(self):
+        # En aturar-se el worker deixa de rebre trànsit nou
+        self.preparat = False
+        if self._tasca is not None:
+            self._tasca.cancel()
+            try:
+                await self._tasca
+            except asyncio.CancelledError:
+                pass
+            self._tasca = None
+
+    def stats(self) -> dict:
+        return {
+            "preparat": self.preparat,
+            "segons": self.segons if self.segons is not None else time.monotonic() - _INICI,
+            "fases_ms": {nom: segons * 1000 for nom, segons in self.fases.items()},
+            "errors": dict(self.errors),
+        }
+
+
+arrencada = Arrencada()
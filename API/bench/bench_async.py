@@ -0,0 +1,88 @@
+# Benchmark: throughput amb peticions concurrents, endpoints sync (threadpool) vs async
+#
+#   cd API && python bench/bench_async.py --peticions 2000 --concurrencia 200
+#
+# Necessita la base de dades configurada (variables ECOSENSE_DB_*).
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI
+
+from client import db_client
+from client_async import obrir_pool, tancar_pool
+import main
+
+# Versió sync equivalent als endpoints de main.py abans de passar-los a async
+app_sync = FastAPI()
+
+def _fetchall(query, params=()):
+    with db_client() as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+@app_sync.get("/usuaris/")
+def listar_usuaris():
+    return _fetchall("SELECT id, nom, cognom, email FROM usuaris")
+
+@app_sync.get("/sensors/")
+def get_sensors():
+    return _fetchall("SELECT * FROM sensors")
+
+@app_sync.get("/plantes/")
+def listar_plantes():
+    return _fetchall("SELECT * FROM planta")
+
+@app_sync.get("/lectures/")
+def listar_lectures(limit: int = 100):
+    return _fetchall("SELECT * FROM humitat_sol ORDER BY timestamp DESC LIMIT %s", (limit,))
+
+RUTES = ["/usuaris/", "/sensors/", "/plantes/", "/lectures/?limit=100"]
+
+
+async def executar(app, peticions, concurrencia):
+    transport = httpx.ASGITransport(app=app)
+    semafor = asyncio.Semaphore(concurrencia)
+    errors = 0
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        async def una(i):
+            nonlocal errors
+            async with semafor:
+                r = await http.get(RUTES[i % len(RUTES)])
+                if r.status_code != 200:
+                    errors += 1
+
+        inici = time.perf_counter()
+        await asyncio.gather(*(una(i) for i in range(peticions)))
+        durada = time.perf_counter() - inici
+
+    return {"peticions": peticions, "errors": errors, "segons": durada, "req_s": peticions / durada}
+
+
+async def principal(args):
+    await obrir_pool()
+    try:
+        for nom, app in (("sync", app_sync), ("async", main.app)):
+            await executar(app, min(100, args.peticions), args.concurrencia)  # escalfament
+            r = await executar(app, args.peticions, args.concurrencia)
+            print(f"{nom:6} {r['req_s']:9.1f} req/s  ({r['peticions']} peticions, "
+                  f"{r['errors']} errors, {r['segons']:.2f}s)")
+    finally:
+        await tancar_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peticions", type=int, default=2000)
+    parser.add_argument("--concurrencia", type=int, default=200)
+    asyncio.run(principal(parser.parse_args()))
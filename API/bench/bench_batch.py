@@ -0,0 +1,102 @@
+# Benchmark: files/s inserides a humitat_sol, INSERT d'una fila per petició vs POST /lectures/batch
+#
+#   cd API && python bench/bench_batch.py --files 20000 --mida-batch 5000
+#
+# Les lectures s'insereixen amb timestamps de l'any 2000 i s'esborren en acabar.
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Es mesura el camí d'inserció, no el control d'admissió (admissio.py)
+for variable in ("ECOSENSE_ADMISSIO_SENSOR", "ECOSENSE_ADMISSIO_SENSOR_RAFEGA",
+                 "ECOSENSE_ADMISSIO_GLOBAL", "ECOSENSE_ADMISSIO_GLOBAL_RAFEGA"):
+    os.environ.setdefault(variable, "1e9")
+
+import aiomysql
+import httpx
+
+from client_async import db_client_async, obrir_pool, tancar_pool
+import main
+import repositori
+
+INICI_BENCH = datetime(2000, 1, 1)
+
+
+def lectures(sensor_id, n, desplacament=0):
+    return [
+        {"sensor_id": sensor_id, "valor": float(i % 100),
+         "timestamp": (INICI_BENCH + timedelta(seconds=desplacament + i)).isoformat()}
+        for i in range(n)
+    ]
+
+
+async def primer_sensor():
+    async with db_client_async() as db:
+        async with db.cursor(aiomysql.Cursor) as cursor:
+            await cursor.execute("SELECT sensor_id FROM sensors ORDER BY sensor_id LIMIT 1")
+            fila = await cursor.fetchone()
+    if not fila:
+        sys.exit("Cal almenys un sensor a la base de dades")
+    return fila[0]
+
+
+async def netejar(sensor_id):
+    # POST /lectures/batch també escriu les franges de humitat_rollup (rollups.py)
+    fi = INICI_BENCH + timedelta(days=3650)
+    async with db_client_async() as db:
+        async with db.cursor(aiomysql.Cursor) as cursor:
+            await cursor.execute(
+                "DELETE FROM humitat_sol WHERE sensor_id = %s AND timestamp < %s",
+                (sensor_id, fi),
+            )
+            await cursor.execute(
+                "DELETE FROM humitat_rollup WHERE sensor_id = %s AND inici < %s",
+                (sensor_id, fi),
+            )
+        await db.commit()
+
+
+async def una_fila_per_insert(sensor_id, n):
+    inici = time.perf_counter()
+    async with db_client_async() as db:
+        async with db.cursor(aiomysql.Cursor) as cursor:
+            for l in lectures(sensor_id, n):
+                await cursor.execute(repositori.INSERIR_LECTURA.sql, (l["sensor_id"], l["valor"], l["timestamp"]))
+                await db.commit()
+    return n / (time.perf_counter() - inici)
+
+
+async def endpoint_batch(sensor_id, n, mida_batch):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        inici = time.perf_counter()
+        for desplacament in range(0, n, mida_batch):
+            r = await http.post("/lectures/batch", json=lectures(sensor_id, min(mida_batch, n - desplacament), desplacament))
+            r.raise_for_status()
+        return n / (time.perf_counter() - inici)
+
+
+async def principal(args):
+    await obrir_pool()
+    try:
+        sensor_id = await primer_sensor()
+        una = await una_fila_per_insert(sensor_id, args.files_simples)
+        await netejar(sensor_id)
+        batch = await endpoint_batch(sensor_id, args.files, args.mida_batch)
+        await netejar(sensor_id)
+        print(f"una fila per INSERT: {una:10.1f} files/s")
+        print(f"/lectures/batch:     {batch:10.1f} files/s  (x{batch / una:.1f})")
+    finally:
+        await tancar_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--files-simples", type=int, default=2000)
+    parser.add_argument("--mida-batch", type=int, default=5000)
+    asyncio.run(principal(parser.parse_args()))
@@ -0,0 +1,89 @@
+# Benchmark: latència de lectures durant un pic de logins, bcrypt al threadpool vs pool de processos
+#
+#   cd API && python bench/bench_contrasenyes.py --logins 400 --lectures 2000
+#
+# No necessita base de dades: els endpoints simulen un login (verificació bcrypt) i una
+# lectura lleugera servida per un handler sync, com StaticFiles o qualsevol codi bloquejant.
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+
+from contrasenyes import aturar_contrasenyes, iniciar_contrasenyes, verificar_contrasenya
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+HASH = pwd_context.hash("contrasenya")
+
+app = FastAPI()
+
+
+@app.post("/login-threadpool")
+async def login_threadpool():
+    return {"success": await run_in_threadpool(pwd_context.verify, "contrasenya", HASH)}
+
+
+@app.post("/login-processos")
+async def login_processos():
+    return {"success": await verificar_contrasenya("contrasenya", HASH)}
+
+
+@app.get("/lectura")
+def lectura():
+    return {"valor": 42.0}
+
+
+def percentil(valors, p):
+    return statistics.quantiles(valors, n=100)[p - 1] * 1000
+
+
+async def executar(http, ruta_login, logins, lectures):
+    latencies = []
+
+    async def login():
+        await http.post(ruta_login)
+
+    async def llegir():
+        inici = time.perf_counter()
+        await http.get("/lectura")
+        latencies.append(time.perf_counter() - inici)
+
+    async def lectures_repartides():
+        for _ in range(lectures):
+            asyncio.ensure_future(llegir())
+            await asyncio.sleep(0.001)
+
+    inici = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)), lectures_repartides())
+    while len(latencies) < lectures:
+        await asyncio.sleep(0.01)
+    durada = time.perf_counter() - inici
+    return latencies, durada
+
+
+async def principal(args):
+    iniciar_contrasenyes()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            for nom, ruta in (("threadpool", "/login-threadpool"), ("processos", "/login-processos")):
+                latencies, durada = await executar(http, ruta, args.logins, args.lectures)
+                print(f"{nom:10} lectures p50={percentil(latencies, 50):7.1f}ms p95={percentil(latencies, 95):7.1f}ms "
+                      f"p99={percentil(latencies, 99):7.1f}ms  logins {args.logins / durada:6.1f}/s")
+    finally:
+        aturar_contrasenyes()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=400)
+    parser.add_argument("--lectures", type=int, default=2000)
+    asyncio.run(principal(parser.parse_args()))
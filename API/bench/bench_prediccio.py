@@ -0,0 +1,83 @@
+# Micro-benchmark: previsió de reg amb un bucle Python per sensor vs l'ajust vectoritzat
+#
+#   cd API && python bench/bench_prediccio.py --sensors 50 200 1000
+#
+# No necessita base de dades: les lectures (72 h, una cada 10 minuts) es generen amb la
+# mateixa forma que torna QUERY_LECTURES.
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prediccio import PREDICCIO_HORES, PREDICCIO_MIN_LECTURES, PREDICCIO_SALT, prediccions
+
+LLINDAR = 30.0
+
+
+def lectures(n_sensors, rng):
+    files = []
+    for sensor_id in range(1, n_sensors + 1):
+        valor, ritme = rng.uniform(50, 90), rng.uniform(0.2, 2)
+        for segons in range(0, int(PREDICCIO_HORES * 3600), 600):
+            valor -= ritme / 6 + rng.gauss(0, 0.3)
+            if valor < 25 and rng.random() < 0.05:
+                valor = rng.uniform(70, 90)
+            files.append((sensor_id, segons, valor))
+    return files
+
+
+def per_sensor(sensor_ids, files, desde, ara):
+    # El mateix càlcul, sensor a sensor i fila a fila
+    hores_ara = (ara - desde).total_seconds() / 3600
+    resultat = {}
+    for sensor_id in sensor_ids:
+        tram = []
+        anterior = None
+        for s, segons, valor in files:
+            if s != sensor_id:
+                continue
+            if anterior is not None and valor - anterior > PREDICCIO_SALT:
+                tram = []
+            tram.append((segons / 3600, valor))
+            anterior = valor
+        n = len(tram)
+        st = sum(t for t, _ in tram)
+        sv = sum(v for _, v in tram)
+        stt = sum(t * t for t, _ in tram)
+        stv = sum(t * v for t, v in tram)
+        denominador = n * stt - st * st
+        if n < PREDICCIO_MIN_LECTURES or denominador <= 0:
+            resultat[sensor_id] = None
+            continue
+        pendent = (n * stv - st * sv) / denominador
+        actual = (sv - pendent * st) / n + pendent * hores_ara
+        resultat[sensor_id] = ara + timedelta(hours=max(actual - LLINDAR, 0) / -pendent) if pendent < 0 else None
+    return resultat
+
+
+def mesurar(funcio, repeticions):
+    inici = time.perf_counter()
+    for _ in range(repeticions):
+        funcio()
+    return (time.perf_counter() - inici) / repeticions * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sensors", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--repeticions", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    ara = datetime(2024, 6, 1, 12)
+    desde = ara - timedelta(hours=PREDICCIO_HORES)
+    for n in args.sensors:
+        files = lectures(n, rng)
+        ids = tuple(range(1, n + 1))
+        bucle = mesurar(lambda: per_sensor(ids, files, desde, ara), args.repeticions)
+        vectoritzat = mesurar(lambda: prediccions(ids, files, desde, ara, LLINDAR), args.repeticions)
+        print(f"{n:5} sensors, {len(files):8} lectures: bucle {bucle:9.1f} ms  vectoritzat {vectoritzat:8.1f} ms  (x{bucle / vectoritzat:.0f})")
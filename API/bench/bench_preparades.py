@@ -0,0 +1,92 @@
+# Benchmark: temps per consulta del repositori amb SQL de text vs sentències preparades
+#
+#   cd API && python bench/bench_preparades.py --iteracions 5000
+#
+# Fa servir les sentències de repositori.py amb paràmetres reals de la base de dades
+# (el primer usuari, sensor i planta). Només fa lectures. Per a cada mode mostra també
+# els comptadors del servidor (Com_stmt_prepare, Com_stmt_execute i Com_select) de la
+# connexió: amb preparades, un sol PREPARE i després només EXECUTE.
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import preparades
+import repositori
+from client import DB_BACKEND
+from client_async import db_client_async, obrir_pool, tancar_pool
+
+COMPTADORS = ("Com_stmt_prepare", "Com_stmt_execute", "Com_select")
+
+
+async def parametres():
+    async with db_client_async() as db:
+        usuari = await repositori.consultar_sql(db, "SELECT id, email FROM usuaris ORDER BY id LIMIT 1")
+        planta = await repositori.consultar_sql(db, "SELECT id, sensor_id FROM planta ORDER BY id LIMIT 1")
+    if not usuari or not planta:
+        sys.exit("Cal almenys un usuari i una planta a la base de dades")
+    (usuari_id, email), (planta_id, sensor_id) = usuari[0], planta[0]
+    return [
+        (repositori.USUARI_PER_ID, (usuari_id,)),
+        (repositori.USUARI_PER_EMAIL, (email,)),
+        (repositori.SENSOR_PER_ID, (sensor_id,)),
+        (repositori.PLANTA_PER_ID, (planta_id,)),
+        (repositori.PLANTA_COMPLETA, (planta_id,)),
+        (repositori.PLANTES_DASHBOARD, (usuari_id,)),
+        (repositori.LECTURES_RECENTS, (sensor_id, 10)),
+    ]
+
+
+async def comptadors(db):
+    files = await repositori.consultar_sql(
+        db, f"SHOW SESSION STATUS WHERE Variable_name IN ({', '.join(['%s'] * len(COMPTADORS))})", COMPTADORS)
+    return {nom: int(valor) for nom, valor in files}
+
+
+async def mesurar(sentencia, params, iteracions):
+    temps = []
+    async with db_client_async() as db:
+        # Escalfa (i al mode preparat, prepara la sentència en aquesta connexió) fora de la mesura
+        await repositori.consultar(db, sentencia, params)
+        abans = await comptadors(db)
+        for _ in range(iteracions):
+            inici = time.perf_counter()
+            await repositori.consultar(db, sentencia, params)
+            temps.append(time.perf_counter() - inici)
+        despres = await comptadors(db)
+    # SHOW STATUS també compta com a Com_select (un cop)
+    servidor = {nom: despres[nom] - abans[nom] for nom in COMPTADORS}
+    servidor["Com_select"] -= 1
+    return statistics.median(temps) * 1e6, statistics.mean(temps) * 1e6, servidor
+
+
+async def principal(args):
+    if DB_BACKEND != "mysql":
+        sys.exit("Les sentències preparades només són per a MySQL")
+    await obrir_pool()
+    try:
+        casos = await parametres()
+        print(f"{'sentència':20} {'text p50':>10} {'prep p50':>10} {'text mitj':>10} {'prep mitj':>10}  (µs)")
+        for sentencia, params in casos:
+            preparades.SENTENCIES_PREPARADES = False
+            text_p50, text_mitja, text_servidor = await mesurar(sentencia, params, args.iteracions)
+            preparades.SENTENCIES_PREPARADES = True
+            prep_p50, prep_mitja, prep_servidor = await mesurar(sentencia, params, args.iteracions)
+            print(f"{sentencia.nom:20} {text_p50:10.1f} {prep_p50:10.1f} "
+                  f"{text_mitja:10.1f} {prep_mitja:10.1f}  ({(text_mitja - prep_mitja) / text_mitja:+.0%})")
+            if args.servidor:
+                print(f"{'':20} text: {text_servidor}  prep: {prep_servidor}")
+    finally:
+        await tancar_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iteracions", type=int, default=5000)
+    parser.add_argument("--servidor", action="store_true", help="mostra els comptadors Com_* del servidor")
+    args = parser.parse_args()
+    asyncio.run(principal(args))
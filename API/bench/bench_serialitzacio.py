@@ -0,0 +1,69 @@
+# Micro-benchmark: serialització de llistes de lectures, response_model + json vs RespostaRapida (orjson)
+#
+#   cd API && python bench/bench_serialitzacio.py
+#
+# No necessita base de dades: les files es generen amb els mateixos tipus que torna aiomysql.
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI
+
+from main import Lectura
+from serialitzacio import RespostaRapida
+
+app = FastAPI()
+FILES = {}
+
+
+@app.get("/actual/{n}", response_model=List[Lectura])
+async def actual(n: int):
+    return FILES[n]
+
+
+@app.get("/rapid/{n}")
+async def rapid(n: int):
+    return RespostaRapida(FILES[n])
+
+
+def generar(n):
+    inici = datetime(2024, 1, 1)
+    return [
+        {"id": i, "sensor_id": i % 50, "valor": 40.0 + (i % 600) / 10, "timestamp": inici + timedelta(seconds=30 * i)}
+        for i in range(n)
+    ]
+
+
+async def mesurar(http, ruta, repeticions):
+    temps = []
+    for _ in range(repeticions):
+        inici = time.perf_counter()
+        r = await http.get(ruta)
+        temps.append(time.perf_counter() - inici)
+        r.raise_for_status()
+    return min(temps) * 1000, len(r.content)
+
+
+async def principal(args):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for n in args.files:
+            FILES[n] = generar(n)
+            repeticions = max(3, 50_000 // n)
+            actual_ms, mida_a = await mesurar(http, f"/actual/{n}", repeticions)
+            rapid_ms, mida_r = await mesurar(http, f"/rapid/{n}", repeticions)
+            print(f"{n:7} files  actual {actual_ms:9.2f}ms  rapid {rapid_ms:8.2f}ms  x{actual_ms / rapid_ms:5.1f}  "
+                  f"({mida_a} / {mida_r} bytes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    asyncio.run(principal(parser.parse_args()))
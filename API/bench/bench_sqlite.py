@@ -0,0 +1,188 @@
+# Benchmark: MySQL vs SQLite (WAL) en els camins de lectura i d'ingesta de l'API
+#
+#   cd API && python bench/bench_sqlite.py --durada 10 --concurrencia 16
+#   cd API && python bench/bench_sqlite.py --backends sqlite --sqlite-path /tmp/bench.db
+#
+# Cada backend s'executa en un procés a part (ECOSENSE_DB_BACKEND es llegeix en importar).
+# MySQL fa servir la base de dades configurada amb ECOSENSE_DB_* (p. ex. la que crea
+# `carrega.py seed`); el fitxer SQLite s'omple la primera vegada amb dades sintètiques
+# de la mateixa forma. Per a cada backend es mesura:
+#  - lectura: dashboard d'un usuari i últimes 100 lectures d'un sensor, en paral·lel;
+#  - ingesta: desar_lectures (INSERT + agregats en una transacció) amb lots de --lot;
+#  - mixt: les mateixes lectures mentre l'ingesta escriu.
+# Les lectures del benchmark van a l'any 2000 i s'esborren en acabar.
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+DIR_API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIR_API)
+
+import repositori
+from client_async import db_client_async, preparar_esquema, tancar_pool
+from ingesta import desar_lectures
+
+ZONES = ["Balcó", "Cuina", "Menjador", "Habitació", "Terrassa", "Hort"]
+ESPECIES = ["girasol", "orquidea", "sansevieria", "tomatera"]
+INICI_BENCH = datetime(2000, 1, 1)
+
+QUERY_LECTURES_SENSOR = (
+    "SELECT id, sensor_id, valor, timestamp FROM humitat_sol WHERE sensor_id = %s "
+    "ORDER BY timestamp DESC, id DESC LIMIT 100"
+)
+
+
+async def sembrar(db, usuaris, lectures, llavor):
+    # Mateixa forma que carrega.py seed: plantes per usuari exponencials, una lectura cada 10 minuts
+    rng = random.Random(llavor)
+    cursor = await db.cursor()
+    try:
+        await cursor.executemany("INSERT INTO usuaris (nom, cognom, email, contrasenya) VALUES (%s, %s, %s, %s)", [
+            (f"Usuari{i}", f"Bench{i}", f"usuari{i}@bench.ecosense", "-") for i in range(1, usuaris + 1)
+        ])
+        sensors, plantes = [], []
+        for usuari_id in range(1, usuaris + 1):
+            for _ in range(max(1, int(rng.expovariate(1 / 3)))):
+                sensors.append((len(sensors) + 1, "Actiu", usuari_id))
+                plantes.append((rng.choice(ESPECIES), rng.choice(ZONES), len(sensors), usuari_id))
+        await cursor.executemany("INSERT INTO sensors (sensor_id, estat, usuari_id) VALUES (%s, %s, %s)", sensors)
+        await cursor.executemany("INSERT INTO planta (nom, ubicacio, sensor_id, usuari_id) VALUES (%s, %s, %s, %s)", plantes)
+        per_sensor = max(1, lectures // len(sensors))
+        ara = datetime.now().replace(microsecond=0)
+        for sensor_id, _, _ in sensors:
+            await cursor.executemany("INSERT INTO humitat_sol (sensor_id, valor, timestamp) VALUES (%s, %s, %s)", [
+                (sensor_id, round(rng.uniform(20, 90), 1), ara - timedelta(minutes=10 * (per_sensor - i)))
+                for i in range(per_sensor)
+            ])
+        await db.commit()
+    finally:
+        await cursor.close()
+
+
+def resum(temps, durada, unitats=None):
+    temps = sorted(temps)
+    if not temps:
+        return {"ops_s": 0.0, "p50_ms": 0.0, "p99_ms": 0.0}
+    resultat = {
+        "ops_s": len(temps) / durada,
+        "p50_ms": statistics.median(temps) * 1000,
+        "p99_ms": temps[min(len(temps) - 1, int(len(temps) * 0.99))] * 1000,
+    }
+    if unitats is not None:
+        resultat["lectures_s"] = unitats / durada
+    return resultat
+
+
+async def lector(usuaris, sensors, fins, temps, rng):
+    while time.monotonic() < fins:
+        inici = time.perf_counter()
+        async with db_client_async() as db:
+            if rng.random() < 0.5:
+                await repositori.consultar(db, repositori.PLANTES_DASHBOARD, (rng.choice(usuaris),))
+            else:
+                await repositori.consultar_sql(db, QUERY_LECTURES_SENSOR, (rng.choice(sensors),))
+        temps.append(time.perf_counter() - inici)
+
+
+async def escriptor(sensors, lot, fins, temps, comptador, rng):
+    while time.monotonic() < fins:
+        base = comptador[0]
+        comptador[0] += lot
+        files = [(rng.choice(sensors), float(i % 100), INICI_BENCH + timedelta(seconds=base + i)) for i in range(lot)]
+        inici = time.perf_counter()
+        async with db_client_async() as db:
+            await desar_lectures(db, files)
+        temps.append(time.perf_counter() - inici)
+
+
+async def executar_backend(args):
+    await preparar_esquema()
+    try:
+        async with db_client_async() as db:
+            if not await repositori.consultar_sql(db, "SELECT sensor_id FROM sensors LIMIT 1"):
+                if os.environ["ECOSENSE_DB_BACKEND"] != "sqlite":
+                    sys.exit("La base de dades MySQL és buida: omple-la abans amb `python bench/carrega.py seed`")
+                await sembrar(db, args.usuaris, args.lectures, args.llavor)
+            usuaris = [f[0] for f in await repositori.consultar_sql(db, "SELECT DISTINCT usuari_id FROM planta")]
+            sensors = [f[0] for f in await repositori.consultar_sql(db, "SELECT sensor_id FROM sensors")]
+
+        rng = random.Random(args.llavor)
+        resultats = {}
+
+        temps = []
+        fins = time.monotonic() + args.durada
+        await asyncio.gather(*[lector(usuaris, sensors, fins, temps, rng) for _ in range(args.concurrencia)])
+        resultats["lectura"] = resum(temps, args.durada)
+
+        temps, comptador = [], [0]
+        fins = time.monotonic() + args.durada
+        await asyncio.gather(*[escriptor(sensors, args.lot, fins, temps, comptador, rng)
+                               for _ in range(args.escriptors)])
+        resultats["ingesta"] = resum(temps, args.durada, len(temps) * args.lot)
+
+        temps_lectura, temps_escriptura = [], []
+        fins = time.monotonic() + args.durada
+        await asyncio.gather(
+            *[lector(usuaris, sensors, fins, temps_lectura, rng) for _ in range(args.concurrencia)],
+            *[escriptor(sensors, args.lot, fins, temps_escriptura, comptador, rng) for _ in range(args.escriptors)],
+        )
+        resultats["mixt_lectura"] = resum(temps_lectura, args.durada)
+        resultats["mixt_ingesta"] = resum(temps_escriptura, args.durada, len(temps_escriptura) * args.lot)
+
+        async with db_client_async() as db:
+            cursor = await db.cursor()
+            await cursor.execute("DELETE FROM humitat_sol WHERE timestamp < %s", (datetime(2001, 1, 1),))
+            await cursor.execute("DELETE FROM humitat_rollup WHERE inici < %s", (datetime(2001, 1, 1),))
+            await db.commit()
+            await cursor.close()
+        return resultats
+    finally:
+        await tancar_pool()
+
+
+def comparar(args):
+    resultats = {}
+    for backend in args.backends:
+        entorn = dict(os.environ, ECOSENSE_DB_BACKEND=backend, ECOSENSE_SQLITE_PATH=args.sqlite_path)
+        ordre = [sys.executable, os.path.abspath(__file__), "--intern", *sys.argv[1:]]
+        proces = subprocess.run(ordre, cwd=DIR_API, env=entorn, capture_output=True, text=True)
+        if proces.returncode != 0:
+            print(f"{backend}: {proces.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+            continue
+        resultats[backend] = json.loads(proces.stdout.strip().splitlines()[-1])
+
+    print(f"{'':14}" + "".join(f"{b + ' ' + c:>18}" for b in resultats for c in ("ops/s", "p50/p99 ms")))
+    for cas in ("lectura", "ingesta", "mixt_lectura", "mixt_ingesta"):
+        fila = f"{cas:14}"
+        for backend in resultats:
+            r = resultats[backend][cas]
+            ops = f"{r['ops_s']:.0f}" + (f" ({r['lectures_s']:.0f} l/s)" if "lectures_s" in r else "")
+            fila += f"{ops:>18}{r['p50_ms']:>10.2f}/{r['p99_ms']:<7.2f}"
+        print(fila)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", choices=["mysql", "sqlite"], default=["mysql", "sqlite"])
+    parser.add_argument("--sqlite-path", default=os.path.join(DIR_API, "bench", "ecosense_bench.db"))
+    parser.add_argument("--durada", type=float, default=10, help="segons per cas")
+    parser.add_argument("--concurrencia", type=int, default=16, help="lectors en paral·lel")
+    parser.add_argument("--escriptors", type=int, default=4, help="ingestes en paral·lel")
+    parser.add_argument("--lot", type=int, default=100, help="lectures per desar_lectures")
+    parser.add_argument("--usuaris", type=int, default=500, help="només per omplir el fitxer SQLite")
+    parser.add_argument("--lectures", type=int, default=500000, help="només per omplir el fitxer SQLite")
+    parser.add_argument("--llavor", type=int, default=42)
+    parser.add_argument("--intern", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.intern:
+        print(json.dumps(asyncio.run(executar_backend(args))))
+    else:
+        comparar(args)
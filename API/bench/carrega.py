@@ -0,0 +1,374 @@
+# Proves de càrrega reproduïbles de l'API
+#
+#   cd API
+#   python bench/carrega.py seed --usuaris 1000 --lectures 2000000      # crea i omple ecosense_bench
+#   python bench/carrega.py run --durada 60 --sortida resultats/abans.json
+#   python bench/carrega.py compare resultats/abans.json resultats/despres.json
+#
+# `seed` crea una base de dades a part (per defecte `ecosense_bench`) al MySQL local
+# indicat amb ECOSENSE_DB_HOST/USER/PASSWORD, amb l'esquema base, les migracions i una
+# flota sintètica generada amb una llavor fixa. `run` arrenca l'API amb uvicorn contra
+# aquesta base de dades (o fa servir --url) i hi llença trànsit mixt: l'app mòbil
+# consultant, pics de login i sensors enviant lectures.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+DIR_API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIR_API)
+
+CONTRASENYA = "contrasenya-bench"
+ZONES = ["Balcó", "Cuina", "Menjador", "Habitació", "Terrassa", "Hort"]
+ESPECIES = ["girasol", "orquidea", "sansevieria", "tomatera"]
+
+ESQUEMA_BASE = [
+    """
+    CREATE TABLE usuaris (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        nom VARCHAR(100) NOT NULL,
+        cognom VARCHAR(100) NOT NULL,
+        email VARCHAR(255) NOT NULL,
+        contrasenya VARCHAR(255) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE sensors (
+        sensor_id INT PRIMARY KEY,
+        estat VARCHAR(20) NOT NULL DEFAULT 'Actiu',
+        usuari_id INT NULL,
+        FOREIGN KEY (usuari_id) REFERENCES usuaris(id)
+    )
+    """,
+    """
+    CREATE TABLE planta (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        nom VARCHAR(100) NOT NULL,
+        ubicacio VARCHAR(100) NOT NULL,
+        sensor_id INT NOT NULL,
+        usuari_id INT NULL,
+        imagen_url VARCHAR(255) NULL,
+        FOREIGN KEY (sensor_id) REFERENCES sensors(sensor_id) ON DELETE CASCADE,
+        FOREIGN KEY (usuari_id) REFERENCES usuaris(id)
+    )
+    """,
+    """
+    CREATE TABLE humitat_sol (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        sensor_id INT NOT NULL,
+        valor FLOAT NOT NULL,
+        timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (sensor_id) REFERENCES sensors(sensor_id) ON DELETE CASCADE
+    )
+    """,
+]
+
+
+# --- seed --------------------------------------------------------------------
+
+def _inserir(cursor, db, query, files, lot=10000):
+    for i in range(0, len(files), lot):
+        cursor.executemany(query, files[i:i + lot])
+        db.commit()
+
+
+def seed(args):
+    import mysql.connector
+    from passlib.context import CryptContext
+
+    import client
+
+    rng = random.Random(args.llavor)
+    config = dict(client.DB_CONFIG)
+    if config.pop("database") == args.db:
+        sys.exit(f"`{args.db}` és la base de dades de l'API: seed l'esborraria. Fes servir --db amb un altre nom.")
+    db = mysql.connector.connect(**config)
+    cursor = db.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{args.db}`")
+    cursor.execute(f"CREATE DATABASE `{args.db}` CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci")
+    cursor.execute(f"USE `{args.db}`")
+    for ddl in ESQUEMA_BASE:
+        cursor.execute(ddl)
+
+    hash_contrasenya = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(CONTRASENYA)
+    _inserir(cursor, db, "INSERT INTO usuaris (nom, cognom, email, contrasenya) VALUES (%s, %s, %s, %s)", [
+        (f"Usuari{i}", f"Bench{i}", f"usuari{i}@bench.ecosense", hash_contrasenya)
+        for i in range(1, args.usuaris + 1)
+    ])
+
+    sensors, plantes = [], []
+    sensor_id = 0
+    for usuari_id in range(1, args.usuaris + 1):
+        for _ in range(max(1, int(rng.expovariate(1 / args.plantes_per_usuari)))):
+            sensor_id += 1
+            estat = "Actiu" if rng.random() < 0.95 else "Inactiu"
+            sensors.append((sensor_id, estat, usuari_id))
+            plantes.append((rng.choice(ESPECIES), rng.choice(ZONES), sensor_id, usuari_id))
+    _inserir(cursor, db, "INSERT INTO sensors (sensor_id, estat, usuari_id) VALUES (%s, %s, %s)", sensors)
+    _inserir(cursor, db, "INSERT INTO planta (nom, ubicacio, sensor_id, usuari_id) VALUES (%s, %s, %s, %s)", plantes)
+
+    # Lectures repartides entre tots els sensors, cada 10 minuts cap enrere des d'ara
+    per_sensor = max(1, args.lectures // len(sensors))
+    ara = datetime.now().replace(microsecond=0)
+    fet = 0
+    lot = []
+    for sid, _, _ in sensors:
+        valor = rng.uniform(30, 90)
+        for i in range(per_sensor):
+            valor = min(100.0, max(0.0, valor + rng.uniform(-1.5, 1.0)))
+            lot.append((sid, round(valor, 1), ara - timedelta(minutes=10 * (per_sensor - i))))
+        if len(lot) >= 50000:
+            _inserir(cursor, db, "INSERT INTO humitat_sol (sensor_id, valor, timestamp) VALUES (%s, %s, %s)", lot)
+            fet += len(lot)
+            lot = []
+            print(f"  {fet}/{per_sensor * len(sensors)} lectures", flush=True)
+    _inserir(cursor, db, "INSERT INTO humitat_sol (sensor_id, valor, timestamp) VALUES (%s, %s, %s)", lot)
+    cursor.close()
+    db.close()
+
+    # Migracions (índexs i taules de l'API) sobre la base de dades nova
+    os.environ["ECOSENSE_DB_NAME"] = args.db
+    subprocess.run([sys.executable, "migracions.py", "migrate"], cwd=DIR_API, check=True)
+    subprocess.run([sys.executable, "rollups.py", "backfill", "--desde",
+                    (ara - timedelta(minutes=10 * per_sensor)).date().isoformat()], cwd=DIR_API, check=True,
+                   stdout=subprocess.DEVNULL)
+    print(f"{args.usuaris} usuaris, {len(sensors)} sensors i plantes, {per_sensor * len(sensors)} lectures a `{args.db}`")
+
+
+# --- run ---------------------------------------------------------------------
+
+class Mesures:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def afegir(self, nom, segons, ok):
+        self.latencies.setdefault(nom, []).append(segons)
+        if not ok:
+            self.errors[nom] = self.errors.get(nom, 0) + 1
+
+    def resum(self, durada):
+        resultat = {}
+        for nom, valors in sorted(self.latencies.items()):
+            valors = sorted(valors)
+
+            def p(q):
+                return valors[min(len(valors) - 1, int(q * len(valors)))] * 1000
+
+            resultat[nom] = {
+                "peticions": len(valors),
+                "errors": self.errors.get(nom, 0),
+                "req_s": len(valors) / durada,
+                "p50_ms": p(0.50),
+                "p95_ms": p(0.95),
+                "p99_ms": p(0.99),
+                "max_ms": valors[-1] * 1000,
+            }
+        return resultat
+
+
+async def _peticio(http, mesures, nom, metode, url, **kwargs):
+    inici = time.perf_counter()
+    try:
+        r = await http.request(metode, url, **kwargs)
+        ok = r.status_code < 400 or r.status_code == 404
+    except Exception:
+        r, ok = None, False
+    mesures.afegir(nom, time.perf_counter() - inici, ok)
+    return r
+
+
+async def client_app(http, mesures, args, rng, final):
+    # Una pantalla oberta de l'app: dashboard, humitat de cada planta i historial d'una
+    while time.monotonic() < final:
+        usuari_id = rng.randint(1, args.usuaris)
+        r = await _peticio(http, mesures, "GET /usuaris/{id}/dashboard", "GET", f"/usuaris/{usuari_id}/dashboard")
+        sensors = []
+        if r is not None and r.status_code == 200:
+            sensors = [p["sensor_id"] for z in r.json()["zones"] for p in z["plantas"]]
+        await _peticio(http, mesures, "GET /plantes/por-zones", "GET", f"/plantes/por-zones?usuari_id={usuari_id}")
+        for sensor_id in sensors[:3]:
+            await _peticio(http, mesures, "GET /humitat/{sensor_id}", "GET", f"/humitat/{sensor_id}")
+        if sensors:
+            await _peticio(http, mesures, "GET /lectures/", "GET", f"/lectures/?sensor_id={sensors[0]}&limit=50")
+        await _peticio(http, mesures, "GET /plantes/", "GET", "/plantes/?mida=thumb")
+        await asyncio.sleep(rng.expovariate(1 / args.interval_app))
+
+
+async def rafegues_login(http, mesures, args, rng, final):
+    while time.monotonic() < final:
+        await asyncio.gather(*(
+            _peticio(http, mesures, "POST /usuaris/login", "POST", "/usuaris/login",
+                     json={"email": f"usuari{rng.randint(1, args.usuaris)}@bench.ecosense", "contrasenya": CONTRASENYA})
+            for _ in range(args.logins_rafega)
+        ))
+        await asyncio.sleep(args.interval_logins)
+
+
+async def sensor(http, mesures, args, rng, final, sensor_id):
+    while time.monotonic() < final:
+        await _peticio(http, mesures, "POST /lectures/", "POST", "/lectures/",
+                       json={"sensor_id": sensor_id, "valor": round(rng.uniform(20, 90), 1)})
+        await asyncio.sleep(rng.expovariate(1 / args.interval_ingesta))
+
+
+async def passarela(http, mesures, args, rng, final, sensors):
+    while time.monotonic() < final:
+        lot = [{"sensor_id": rng.choice(sensors), "valor": round(rng.uniform(20, 90), 1)} for _ in range(args.mida_batch)]
+        await _peticio(http, mesures, "POST /lectures/batch", "POST", "/lectures/batch", json=lot)
+        await asyncio.sleep(args.interval_batch)
+
+
+async def _esperar_api(http, segons=60):
+    # /ready i no /: / respon abans que acabi l'escalfament (arrencada.py)
+    limit = time.monotonic() + segons
+    while time.monotonic() < limit:
+        try:
+            if (await http.get("/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("L'API no ha arrencat")
+
+
+async def executar(args):
+    import httpx
+
+    rng = random.Random(args.llavor)
+    limits = httpx.Limits(max_connections=args.connexions, max_keepalive_connections=args.connexions)
+    async with httpx.AsyncClient(base_url=args.url, timeout=30, limits=limits) as http:
+        await _esperar_api(http)
+        sensors = sorted(s["sensor_id"] for s in (await http.get("/sensors/")).json())
+        sensors_ingesta = [rng.choice(sensors) for _ in range(args.sensors_ingesta)] if sensors else []
+
+        for fase, durada in (("escalfament", args.escalfament), ("mesura", args.durada)):
+            mesures = Mesures()
+            final = time.monotonic() + durada
+            tasques = [client_app(http, mesures, args, random.Random(rng.random()), final) for _ in range(args.clients_app)]
+            tasques.append(rafegues_login(http, mesures, args, random.Random(rng.random()), final))
+            tasques += [sensor(http, mesures, args, random.Random(rng.random()), final, s) for s in sensors_ingesta]
+            tasques += [passarela(http, mesures, args, random.Random(rng.random()), final, sensors_ingesta or [1])
+                        for _ in range(args.passareles)]
+            inici = time.perf_counter()
+            await asyncio.gather(*tasques)
+            print(f"{fase}: {time.perf_counter() - inici:.1f}s", flush=True)
+        return mesures.resum(args.durada)
+
+
+def _commit_git():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DIR_API, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    proces = None
+    if args.url is None:
+        args.url = f"http://127.0.0.1:{args.port}"
+        entorn = dict(os.environ, ECOSENSE_DB_NAME=args.db)
+        proces = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--workers", str(args.workers),
+             "--log-level", "warning"],
+            cwd=DIR_API, env=entorn,
+        )
+    try:
+        resultats = asyncio.run(executar(args))
+    finally:
+        if proces is not None:
+            proces.terminate()
+            proces.wait(timeout=30)
+
+    informe = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_git(),
+        "maquina": {"python": platform.python_version(), "cpus": os.cpu_count(), "sistema": platform.platform()},
+        "config": {k: v for k, v in vars(args).items() if k != "funcio"},
+        "endpoints": resultats,
+    }
+    _imprimir(resultats)
+    if args.sortida:
+        os.makedirs(os.path.dirname(os.path.abspath(args.sortida)), exist_ok=True)
+        with open(args.sortida, "w") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"Resultats desats a {args.sortida}")
+
+
+def _imprimir(resultats):
+    print(f"{'endpoint':32} {'req':>7} {'err':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for nom, r in resultats.items():
+        print(f"{nom:32} {r['peticions']:7} {r['errors']:5} {r['req_s']:8.1f} "
+              f"{r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f}")
+
+
+# --- compare -----------------------------------------------------------------
+
+def compare(args):
+    with open(args.abans) as f:
+        abans = json.load(f)
+    with open(args.despres) as f:
+        despres = json.load(f)
+    print(f"{abans.get('commit')} ({abans['data']})  ->  {despres.get('commit')} ({despres['data']})")
+    print(f"{'endpoint':32} {'req/s':>17} {'p95 ms':>19} {'p99 ms':>19}")
+    for nom in sorted(set(abans["endpoints"]) | set(despres["endpoints"])):
+        a, d = abans["endpoints"].get(nom), despres["endpoints"].get(nom)
+        if not a or not d:
+            print(f"{nom:32} {'només a ' + ('abans' if a else 'després'):>17}")
+            continue
+
+        def canvi(clau):
+            return f"{a[clau]:7.1f}>{d[clau]:7.1f}{(d[clau] / a[clau] - 1) * 100 if a[clau] else 0:+4.0f}%"
+
+        print(f"{nom:32} {canvi('req_s'):>17} {canvi('p95_ms'):>19} {canvi('p99_ms'):>19}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Proves de càrrega de l'API d'Ecosense")
+    sub = parser.add_subparsers(dest="ordre", required=True)
+
+    def comuns(p):
+        p.add_argument("--db", default="ecosense_bench")
+        p.add_argument("--llavor", type=int, default=42)
+        p.add_argument("--usuaris", type=int, default=1000)
+        p.add_argument("--plantes-per-usuari", type=int, default=5)
+
+    p = sub.add_parser("seed", help="Crea la base de dades de proves amb una flota sintètica")
+    comuns(p)
+    p.add_argument("--lectures", type=int, default=2_000_000)
+    p.set_defaults(funcio=seed)
+
+    p = sub.add_parser("run", help="Llença trànsit mixt contra l'API i mesura latències")
+    comuns(p)
+    p.add_argument("--url", help="API ja arrencada; si no s'indica, s'arrenca amb uvicorn")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--durada", type=float, default=60)
+    p.add_argument("--escalfament", type=float, default=10)
+    p.add_argument("--connexions", type=int, default=200)
+    p.add_argument("--clients-app", type=int, default=50)
+    p.add_argument("--interval-app", type=float, default=2.0)
+    p.add_argument("--logins-rafega", type=int, default=20)
+    p.add_argument("--interval-logins", type=float, default=10.0)
+    p.add_argument("--sensors-ingesta", type=int, default=200)
+    p.add_argument("--interval-ingesta", type=float, default=5.0)
+    p.add_argument("--passareles", type=int, default=2)
+    p.add_argument("--mida-batch", type=int, default=500)
+    p.add_argument("--interval-batch", type=float, default=5.0)
+    p.add_argument("--sortida", help="Fitxer JSON on desar els resultats")
+    p.set_defaults(funcio=run)
+
+    p = sub.add_parser("compare", help="Compara dos fitxers de resultats")
+    p.add_argument("abans")
+    p.add_argument("despres")
+    p.set_defaults(funcio=compare)
+
+    args = parser.parse_args()
+    args.funcio(args)
@@ -0,0 +1,172 @@
+# Prova de coherència entre workers: escriptures en un worker, lectures a tots
+#
+#   cd API && python bench/coherencia.py --workers 4
+#   cd API && python bench/coherencia.py --backend mysql --workers 8 --limit 3
+#
+# Arrenca l'API amb uvicorn --workers N (per defecte amb un fitxer SQLite temporal) i
+# espera que tots els workers responguin 200 a /ready. Cada consulta obre una connexió
+# nova, que queda lligada a un worker: /estat/coherencia diu quin (pid) i el recurs es
+# demana per la mateixa connexió. Després de cada escriptura (crear, modificar i eliminar
+# sensors i plantes, desar lectures) es mira fins que tots els workers tornen les dades
+# noves, i GET /sensors/ i GET /plantes/ amb el mateix ETag. Mostra fins quan algun
+# worker ha tornat dades antigues i surt amb error si passa de --limit segons.
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+DIR_API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SENSOR_ID = 990001
+
+
+def consultar(url, cami):
+    with httpx.Client(base_url=url, timeout=10) as http:
+        pid = http.get("/estat/coherencia").json()["pid"]
+        resposta = http.get(cami)
+    cos = resposta.json() if resposta.headers.get("content-type", "").startswith("application/json") else None
+    return pid, resposta.status_code, resposta.headers.get("etag"), cos
+
+
+def esperar_workers(url, workers, segons=60):
+    limit = time.monotonic() + segons
+    preparats = set()
+    while time.monotonic() < limit:
+        try:
+            pid, estat, _, _ = consultar(url, "/ready")
+            if estat == 200:
+                preparats.add(pid)
+        except httpx.HTTPError:
+            pass
+        if len(preparats) >= workers:
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"Només {len(preparats)} de {workers} workers preparats")
+
+
+def convergir(url, workers, cami, condicio, segons):
+    # Consultes en paral·lel fins que l'última resposta de cada worker compleix la condició
+    # (amb el mateix ETag a tots). Torna l'últim moment en què un worker encara tornava les
+    # dades antigues i quan s'ha vist que tots coincideixen, en segons des de l'escriptura.
+    inici = time.monotonic()
+    darreres, obsolet = {}, 0.0
+    with ThreadPoolExecutor(max_workers=2 * workers) as executor:
+        while time.monotonic() - inici < segons:
+            for pid, estat, etag, cos in executor.map(lambda _: consultar(url, cami), range(2 * workers)):
+                ara = time.monotonic() - inici
+                ok = condicio(estat, cos)
+                darreres[pid] = (ok, etag)
+                if not ok:
+                    obsolet = ara
+            if len(darreres) >= workers and all(ok for ok, _ in darreres.values()):
+                if len({etag for _, etag in darreres.values()}) == 1:
+                    return obsolet, time.monotonic() - inici
+    return None, None
+
+
+def conte_sensor(estat_sensor):
+    def condicio(estat, cos):
+        return estat == 200 and any(s["sensor_id"] == SENSOR_ID and s["estat"] == estat_sensor for s in cos)
+    return condicio
+
+
+def sense_sensor(estat, cos):
+    return estat == 200 and all(s["sensor_id"] != SENSOR_ID for s in cos)
+
+
+def conte_planta(nom):
+    def condicio(estat, cos):
+        return estat == 200 and any(p["sensor_id"] == SENSOR_ID and p["nom"] == nom for p in cos)
+    return condicio
+
+
+def sense_planta(estat, cos):
+    return estat == 200 and all(p["sensor_id"] != SENSOR_ID for p in cos)
+
+
+def humitat(valor):
+    def condicio(estat, cos):
+        return estat == 200 and cos["valor"] == valor
+    return condicio
+
+
+def executar(args):
+    http = httpx.Client(base_url=args.url, timeout=30)
+    http.delete(f"/sensors/{SENSOR_ID}")
+
+    def comprovar(nom, cami, condicio):
+        obsolet, vist = convergir(args.url, args.workers, cami, condicio, args.limit * 3)
+        if obsolet is None:
+            print(f"{nom:20} no convergeix", flush=True)
+        else:
+            print(f"{nom:20} obsolet fins a {obsolet * 1000:5.0f} ms, tots iguals als {vist * 1000:5.0f} ms", flush=True)
+        return obsolet
+
+    resultats = {}
+    http.post("/sensors/", json={"sensor_id": SENSOR_ID, "estat": "Actiu"}).raise_for_status()
+    resultats["crear sensor"] = comprovar("crear sensor", "/sensors/", conte_sensor("Actiu"))
+    resultats["humitat buida"] = comprovar("humitat buida", f"/humitat/{SENSOR_ID}", humitat(None))
+
+    http.put(f"/sensors/{SENSOR_ID}", json={"sensor_id": SENSOR_ID, "estat": "Inactiu"}).raise_for_status()
+    resultats["modificar sensor"] = comprovar("modificar sensor", "/sensors/", conte_sensor("Inactiu"))
+
+    planta = http.post("/plantes/", json={"nom": "coherencia", "ubicacio": "Bench", "sensor_id": SENSOR_ID})
+    planta.raise_for_status()
+    planta_id = planta.json()["id"]
+    resultats["crear planta"] = comprovar("crear planta", "/plantes/", conte_planta("coherencia"))
+
+    http.put(f"/plantes/{planta_id}", json={"nom": "coherencia2"}).raise_for_status()
+    resultats["modificar planta"] = comprovar("modificar planta", "/plantes/", conte_planta("coherencia2"))
+
+    for i in range(1, args.rondes + 1):
+        valor = 40.0 + i
+        http.post("/lectures/batch", json=[{"sensor_id": SENSOR_ID, "valor": valor}]).raise_for_status()
+        resultats[f"lectura {i}"] = comprovar(f"lectura {i}", f"/humitat/{SENSOR_ID}", humitat(valor))
+
+    http.delete(f"/plantes/{planta_id}").raise_for_status()
+    resultats["eliminar planta"] = comprovar("eliminar planta", "/plantes/", sense_planta)
+
+    http.delete(f"/sensors/{SENSOR_ID}").raise_for_status()
+    resultats["eliminar sensor"] = comprovar("eliminar sensor", "/sensors/", sense_sensor)
+    resultats["humitat eliminat"] = comprovar("humitat eliminat", f"/humitat/{SENSOR_ID}",
+                                              lambda estat, cos: estat == 404)
+    http.close()
+
+    fallen = [nom for nom, segons in resultats.items() if segons is None or segons > args.limit]
+    maxim = max((s for s in resultats.values() if s is not None), default=0)
+    print(f"{args.workers} workers, dades obsoletes com a màxim {maxim * 1000:.0f} ms (límit {args.limit * 1000:.0f} ms)")
+    if fallen:
+        sys.exit(f"Sense coherència dins del límit: {', '.join(fallen)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--backend", choices=["mysql", "sqlite"], default="sqlite")
+    parser.add_argument("--interval", type=float, default=0.5, help="ECOSENSE_COHERENCIA_INTERVAL dels workers")
+    parser.add_argument("--limit", type=float, default=2.0, help="segons màxims amb dades antigues en algun worker")
+    parser.add_argument("--rondes", type=int, default=3, help="lectures desades una a una")
+    args = parser.parse_args()
+    args.url = f"http://127.0.0.1:{args.port}"
+
+    with tempfile.TemporaryDirectory() as directori:
+        entorn = dict(os.environ, ECOSENSE_DB_BACKEND=args.backend,
+                      ECOSENSE_COHERENCIA_INTERVAL=str(args.interval))
+        if args.backend == "sqlite":
+            entorn.setdefault("ECOSENSE_SQLITE_PATH", os.path.join(directori, "coherencia.db"))
+        proces = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--workers", str(args.workers),
+             "--log-level", "warning"],
+            cwd=DIR_API, env=entorn,
+        )
+        try:
+            esperar_workers(args.url, args.workers)
+            executar(args)
+        finally:
+            proces.terminate()
+            proces.wait(timeout=30)
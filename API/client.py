@@ -1,25 +1,207 @@
-# Coneccio a la base de dades 
-import mysql.connector 
+# Coneccio a la base de dades
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+
+from metriques import registrar_espera
+
+# mysql (per defecte) o sqlite (vegeu client_sqlite.py)
+DB_BACKEND = os.environ.get("ECOSENSE_DB_BACKEND", "mysql")
+if DB_BACKEND not in ("mysql", "sqlite"):
+    raise ValueError(f"ECOSENSE_DB_BACKEND ha de ser mysql o sqlite, no {DB_BACKEND!r}")
+
+DB_CONFIG = {
+    "database": os.environ.get("ECOSENSE_DB_NAME", "ecosense"),
+    #"user": "root",
+    "user": os.environ.get("ECOSENSE_DB_USER", "asix"),
+    "password": os.environ.get("ECOSENSE_DB_PASSWORD", "1234"),
+    #"host": "localhost",
+    "host": os.environ.get("ECOSENSE_DB_HOST", "10.0.2.85"),
+    "port": os.environ.get("ECOSENSE_DB_PORT", "3306"),
+    "collation": "utf8mb4_general_ci",
+}
+
+POOL_SIZE = int(os.environ.get("ECOSENSE_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.environ.get("ECOSENSE_POOL_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.environ.get("ECOSENSE_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = float(os.environ.get("ECOSENSE_POOL_RECYCLE", "3600"))
+POOL_PRE_PING = os.environ.get("ECOSENSE_POOL_PRE_PING", "1") != "0"
+
+
+class PoolExhaurit(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW, timeout=POOL_TIMEOUT,
+                 recycle=POOL_RECYCLE, pre_ping=POOL_PRE_PING, **connect_args):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.connect_args = connect_args or DB_CONFIG
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._creades = {}
+        self._total = 0
+        self._in_use = 0
+        self._esperant = 0
+
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._invalidated = 0
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self.connect_args)
+        self._creades[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        self._creades.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        inici = time.monotonic()
+        limit = inici + self.timeout
+        conn = None
+        with self._cond:
+            self._esperant += 1
+            try:
+                while True:
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._total < self.size + self.max_overflow:
+                        self._total += 1
+                        break
+                    restant = limit - time.monotonic()
+                    if restant <= 0:
+                        self._timeouts += 1
+                        raise PoolExhaurit(
+                            f"No hi ha connexions lliures després de {self.timeout}s "
+                            f"({self._total} obertes)"
+                        )
+                    self._cond.wait(restant)
+                self._in_use += 1
+            finally:
+                self._esperant -= 1
+
+        try:
+            conn = self._checkout(conn)
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        espera = time.monotonic() - inici
+        registrar_espera("sync", espera)
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += espera
+            self._wait_max = max(self._wait_max, espera)
+        return conn
+
+    def _checkout(self, conn):
+        # Connexió nova: encara no n'hi ha cap d'inactiva
+        if conn is None:
+            return self._connect()
+
+        # Reciclatge per edat
+        if self.recycle >= 0 and time.monotonic() - self._creades.get(id(conn), 0) > self.recycle:
+            self._recycled += 1
+            self._discard(conn)
+            return self._connect()
+
+        # Health-check abans de lliurar-la (is_connected fa un ping)
+        if self.pre_ping and not conn.is_connected():
+            self._invalidated += 1
+            self._discard(conn)
+            return self._connect()
+
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except mysql.connector.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            # Les connexions d'overflow es tanquen quan el pool ja està ple
+            if discard or len(self._idle) >= self.size:
+                self._total -= 1
+                if discard:
+                    self._invalidated += 1
+                self._discard(conn)
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except mysql.connector.errors.OperationalError:
+            discard = True
+            raise
+        except BaseException:
+            try:
+                conn.rollback()
+            except mysql.connector.Error:
+                discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "total": self._total,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._esperant,
+                "checkouts": self._checkouts,
+                "wait_avg_ms": (self._wait_total / self._checkouts * 1000) if self._checkouts else 0.0,
+                "wait_max_ms": self._wait_max * 1000,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "invalidated": self._invalidated,
+            }
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                self._total -= 1
+                self._discard(self._idle.pop())
+
+
+pool = ConnectionPool()
+
 
 def db_client():
-    try:
-        dbname = "ecosense"
-        #user = "root"
-        user = "asix"
-        password = "1234"
-        #host = "localhost"
-        host = "10.0.2.85"
-        port = "3306"
-        collation = "utf8mb4_general_ci"
-        
-        return mysql.connector.connect(
-            host = host,
-            port = port,
-            user = user,
-            password = password,
-            database = dbname,
-            collation = collation
-        ) 
-            
-    except Exception as e:
-            return {"status": -1, "message": f"Error de connexió:{e}" }
\ No newline at end of file
+    return pool.connection()
+
+
+def pool_stats() -> dict:
+    return pool.stats()
@@ -0,0 +1,144 @@
+# Coneccio asíncrona a la base de dades (aiomysql, o SQLite amb ECOSENSE_DB_BACKEND=sqlite)
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import aiomysql
+
+from client import DB_BACKEND, DB_CONFIG, POOL_SIZE, POOL_MAX_OVERFLOW, POOL_TIMEOUT, POOL_RECYCLE, POOL_PRE_PING, PoolExhaurit
+from client_sqlite import base_sqlite
+from metriques import ConnexioMesurada, registrar_espera
+from migracions import migrar
+
+# Només es fa ping a les connexions que fa més d'aquests segons que no s'han fet servir
+PING_INACTIVA = 10
+
+_pool = None
+_lock = asyncio.Lock()
+_invalidades = 0
+
+
+async def obrir_pool():
+    global _pool
+    if DB_BACKEND == "sqlite":
+        return await base_sqlite.obrir()
+    async with _lock:
+        if _pool is None:
+            _pool = await aiomysql.create_pool(
+                host=DB_CONFIG["host"],
+                port=int(DB_CONFIG["port"]),
+                user=DB_CONFIG["user"],
+                password=DB_CONFIG["password"],
+                db=DB_CONFIG["database"],
+                charset="utf8mb4",
+                init_command=f"SET NAMES utf8mb4 COLLATE {DB_CONFIG['collation']}",
+                minsize=POOL_SIZE,
+                maxsize=POOL_SIZE + POOL_MAX_OVERFLOW,
+                pool_recycle=int(POOL_RECYCLE),
+                autocommit=False,
+            )
+    return _pool
+
+
+async def tancar_pool():
+    global _pool
+    if DB_BACKEND == "sqlite":
+        await base_sqlite.tancar()
+        return
+    async with _lock:
+        if _pool is not None:
+            _pool.close()
+            await _pool.wait_closed()
+            _pool = None
+
+
+@asynccontextmanager
+async def db_client_async():
+    if DB_BACKEND == "sqlite":
+        async with base_sqlite.connexio() as conn:
+            yield ConnexioMesurada(conn)
+        return
+    pool = _pool or await obrir_pool()
+    inici = time.perf_counter()
+    try:
+        conn = await asyncio.wait_for(_agafar(pool), timeout=POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolExhaurit(f"No hi ha connexions lliures després de {POOL_TIMEOUT}s")
+    finally:
+        registrar_espera("async", time.perf_counter() - inici)
+    try:
+        yield ConnexioMesurada(conn)
+    except BaseException:
+        try:
+            await conn.rollback()
+        except Exception:
+            conn.close()
+        raise
+    else:
+        # Un SELECT amb autocommit=False deixa la transacció oberta, i aiomysql tanca en
+        # lloc de reutilitzar les connexions que la tornen amb una transacció oberta
+        if conn.get_transaction_status():
+            try:
+                await conn.rollback()
+            except Exception:
+                conn.close()
+    finally:
+        pool.release(conn)
+
+
+async def _agafar(pool):
+    # aiomysql ja descarta les inactives més de pool_recycle segons i les tancades pel
+    # servidor; aquí el health-check (ECOSENSE_POOL_PRE_PING) com el pool síncron
+    global _invalidades
+    while True:
+        conn = await pool.acquire()
+        if not POOL_PRE_PING or conn.closed or asyncio.get_running_loop().time() - conn.last_usage < PING_INACTIVA:
+            return conn
+        try:
+            await conn.ping(reconnect=False)
+            return conn
+        except Exception:
+            # Tancada: el pool la descarta i n'obre una de nova
+            _invalidades += 1
+            conn.close()
+            pool.release(conn)
+
+
+async def _ping():
+    async with db_client_async() as db:
+        cursor = await db.cursor()
+        try:
+            await cursor.execute("SELECT 1")
+            await cursor.fetchall()
+        finally:
+            await cursor.close()
+
+
+async def escalfar_pool():
+    # Fa servir alhora totes les connexions que es mantenen obertes (i els lectors de SQLite)
+    n = base_sqlite.n_lectors if DB_BACKEND == "sqlite" else POOL_SIZE
+    await asyncio.gather(*[_ping() for _ in range(n)])
+
+
+async def preparar_esquema():
+    # MySQL: migracions pendents; SQLite: l'esquema sencer (CREATE ... IF NOT EXISTS)
+    if DB_BACKEND == "sqlite":
+        await base_sqlite.crear_esquema()
+    else:
+        await asyncio.to_thread(migrar)
+
+
+def pool_async_stats() -> dict:
+    if DB_BACKEND == "sqlite":
+        return base_sqlite.stats()
+    if _pool is None:
+        return {"obert": False}
+    return {
+        "obert": True,
+        "minsize": _pool.minsize,
+        "maxsize": _pool.maxsize,
+        "total": _pool.size,
+        "idle": _pool.freesize,
+        "in_use": _pool.size - _pool.freesize,
+        "invalidades": _invalidades,
+    }
@@ -0,0 +1,471 @@
+# Base de dades SQLite local (mode WAL) amb la mateixa interfície que aiomysql
+#
+# Amb ECOSENSE_DB_BACKEND=sqlite l'API fa servir el fitxer ECOSENSE_SQLITE_PATH en lloc
+# del MySQL remot (gateways sense MySQL i CI). sqlite3 és síncron: cada connexió té el
+# seu propi fil i els endpoints l'esperen amb await, com amb aiomysql.
+#  - Un sol escriptor: les transaccions d'escriptura fan cua (FIFO) i s'executen totes
+#    al mateix fil i la mateixa connexió.
+#  - ECOSENSE_SQLITE_LECTORS connexions només de lectura que, en WAL, llegeixen alhora
+#    entre elles i mentre l'escriptor escriu.
+# Una connexió de db_client_async llegeix amb un lector fins a la primera sentència que
+# no és de lectura; des d'aquí i fins al commit o rollback tot va per l'escriptor.
+#
+# Els mòduls escriuen SQL de MySQL: es tradueixen els marcadors i les poques construccions
+# pròpies de MySQL que fan servir els endpoints (ON DUPLICATE KEY UPDATE, LEAST/GREATEST,
+# TIMESTAMPDIFF). Els errors es tornen com a excepcions de pymysql.
+import asyncio
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from functools import lru_cache
+
+import aiomysql
+import pymysql
+
+from client import POOL_TIMEOUT, PoolExhaurit
+from metriques import CursorMesurat, registrar_consulta, registrar_espera
+
+SQLITE_PATH = os.environ.get("ECOSENSE_SQLITE_PATH", "ecosense.db")
+SQLITE_LECTORS = int(os.environ.get("ECOSENSE_SQLITE_LECTORS", "4"))
+SQLITE_CACHE_MB = int(os.environ.get("ECOSENSE_SQLITE_CACHE_MB", "64"))
+SQLITE_MMAP_MB = int(os.environ.get("ECOSENSE_SQLITE_MMAP_MB", "256"))
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+PRAGMES = [
+    # synchronous=NORMAL en WAL: no es corromp mai; un tall de corrent pot perdre les
+    # últimes transaccions, no les anteriors a l'últim checkpoint
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size = -{SQLITE_CACHE_MB * 1024}",
+    f"PRAGMA mmap_size = {SQLITE_MMAP_MB * 1024 * 1024}",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA foreign_keys = ON",
+]
+PRAGMES_ESCRIPTOR = [
+    "PRAGMA journal_mode = WAL",
+    # Després de cada checkpoint el fitxer -wal es retalla fins a 64 MB
+    f"PRAGMA journal_size_limit = {64 * 1024 * 1024}",
+]
+
+# Equivalent de l'esquema de MySQL (taules base + migracions de migracions.py)
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS usuaris (
+    id INTEGER PRIMARY KEY,
+    nom VARCHAR(100) NOT NULL,
+    cognom VARCHAR(100) NOT NULL,
+    email VARCHAR(255) NOT NULL,
+    contrasenya VARCHAR(255) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sensors (
+    sensor_id INTEGER PRIMARY KEY,
+    estat VARCHAR(20) NOT NULL DEFAULT 'Actiu',
+    usuari_id INTEGER NULL REFERENCES usuaris(id)
+);
+CREATE TABLE IF NOT EXISTS planta (
+    id INTEGER PRIMARY KEY,
+    nom VARCHAR(100) NOT NULL,
+    ubicacio VARCHAR(100) NOT NULL,
+    sensor_id INTEGER NOT NULL REFERENCES sensors(sensor_id) ON DELETE CASCADE,
+    usuari_id INTEGER NULL REFERENCES usuaris(id),
+    imagen_url VARCHAR(255) NULL
+);
+CREATE TABLE IF NOT EXISTS humitat_sol (
+    id INTEGER PRIMARY KEY,
+    sensor_id INTEGER NOT NULL REFERENCES sensors(sensor_id) ON DELETE CASCADE,
+    valor FLOAT NOT NULL,
+    timestamp DATETIME NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+CREATE TABLE IF NOT EXISTS humitat_rollup (
+    sensor_id INTEGER NOT NULL,
+    bucket CHAR(2) NOT NULL,
+    inici DATETIME NOT NULL,
+    n INTEGER NOT NULL,
+    suma DOUBLE NOT NULL,
+    minim DOUBLE NOT NULL,
+    maxim DOUBLE NOT NULL,
+    PRIMARY KEY (sensor_id, bucket, inici)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS canvis_versio (
+    recurs VARCHAR(20) PRIMARY KEY,
+    versio BIGINT NOT NULL,
+    modificat DOUBLE NOT NULL
+);
+INSERT OR IGNORE INTO canvis_versio (recurs, versio, modificat) VALUES
+    ('usuaris', 0, strftime('%s', 'now')), ('sensors', 0, strftime('%s', 'now')), ('plantes', 0, strftime('%s', 'now'));
+CREATE INDEX IF NOT EXISTS idx_humitat_sensor_ts ON humitat_sol (sensor_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_humitat_ts ON humitat_sol (timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_planta_usuari_zona ON planta (usuari_id, ubicacio, nom);
+CREATE INDEX IF NOT EXISTS idx_planta_sensor ON planta (sensor_id);
+CREATE INDEX IF NOT EXISTS idx_usuaris_email ON usuaris (email);
+CREATE INDEX IF NOT EXISTS idx_sensors_usuari ON sensors (usuari_id);
+"""
+
+# Les dates es guarden com a text ISO ("2024-06-01 12:00:00"), que s'ordena igual que
+# les dates; les columnes DATETIME es tornen com a datetime, com fa MySQL
+sqlite3.register_adapter(datetime, lambda ts: ts.isoformat(" "))
+sqlite3.register_adapter(date, lambda dia: dia.isoformat())
+sqlite3.register_converter("DATETIME", lambda valor: datetime.fromisoformat(valor.decode()))
+
+_VALUES = re.compile(r"\bVALUES\((\w+)\)", re.IGNORECASE)
+_TIMESTAMPDIFF = re.compile(r"\bTIMESTAMPDIFF\(\s*SECOND\s*,\s*([^,()]+?)\s*,\s*([^,()]+?)\s*\)", re.IGNORECASE)
+_LEAST = re.compile(r"\bLEAST\(", re.IGNORECASE)
+_GREATEST = re.compile(r"\bGREATEST\(", re.IGNORECASE)
+_ON_DUPLICATE = re.compile(r"\bON DUPLICATE KEY UPDATE\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def traduir(sql):
+    # SQL de MySQL -> SQLite (només el que fan servir els endpoints)
+    sql = sql.replace("%s", "?")
+    sql = _TIMESTAMPDIFF.sub(r"CAST(ROUND((julianday(\2) - julianday(\1)) * 86400) AS INTEGER)", sql)
+    sql = _LEAST.sub("MIN(", sql)
+    sql = _GREATEST.sub("MAX(", sql)
+    if _ON_DUPLICATE.search(sql):
+        # UPSERT sense columnes de conflicte: qualsevol clau única (SQLite >= 3.35)
+        sql = _ON_DUPLICATE.sub("ON CONFLICT DO UPDATE SET", sql)
+        sql = _VALUES.sub(r"excluded.\1", sql)
+    return sql
+
+
+def _es_lectura(sql):
+    return sql.lstrip()[:6].upper() in ("SELECT", "WITH")
+
+
+def _error(err):
+    codi = getattr(err, "sqlite_errorcode", 0)
+    if isinstance(err, sqlite3.IntegrityError):
+        return pymysql.err.IntegrityError(codi, str(err))
+    if isinstance(err, sqlite3.OperationalError):
+        return pymysql.err.OperationalError(codi, str(err))
+    if isinstance(err, sqlite3.ProgrammingError):
+        return pymysql.err.ProgrammingError(codi, str(err))
+    return pymysql.err.DatabaseError(codi, str(err))
+
+
+class _Fil:
+    # Connexió sqlite3 i el fil on s'executa tot el que la fa servir
+    def __init__(self, path, pragmes, nom):
+        self.connexio = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES,
+                                        isolation_level=None, check_same_thread=False)
+        for pragma in pragmes:
+            self.connexio.execute(pragma)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=nom)
+
+    async def fer(self, funcio, *args):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, funcio, *args)
+        except sqlite3.Error as err:
+            raise _error(err) from err
+
+    def tancar(self):
+        self._executor.shutdown(wait=True)
+        self.connexio.close()
+
+
+def _executar(connexio, sql, params, streaming):
+    cursor = connexio.execute(sql, params)
+    if streaming:
+        return cursor, None
+    files = cursor.fetchall()
+    cursor.close()
+    return cursor, files
+
+
+def _executar_molts(connexio, sql, params):
+    cursor = connexio.executemany(sql, params)
+    cursor.close()
+    primer_id = None
+    if cursor.rowcount > 0 and sql.lstrip()[:6].upper() == "INSERT":
+        # Com MySQL amb un INSERT multi-fila: l'id de la primera fila (amb un sol
+        # escriptor els ids d'un executemany són consecutius)
+        primer_id = connexio.execute("SELECT last_insert_rowid()").fetchone()[0] - cursor.rowcount + 1
+    return cursor.rowcount, primer_id
+
+
+class CursorSqlite:
+    def __init__(self, conn, classe):
+        self._conn = conn
+        self._mesurar = issubclass(classe, CursorMesurat)
+        self._diccionari = issubclass(classe, aiomysql.cursors._DictCursorMixin)
+        # Com SSCursor: les files es llegeixen a lots, sense portar-les totes a memòria
+        self._streaming = issubclass(classe, aiomysql.SSCursor)
+        self._fil = None
+        self._cursor = None
+        self._files = []
+        self._posicio = 0
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _convertir(self, files):
+        if not self._diccionari:
+            return files
+        noms = [columna[0] for columna in self.description]
+        return [dict(zip(noms, fila)) for fila in files]
+
+    def _mesurat(self, sql, inici):
+        if self._mesurar:
+            registrar_consulta(sql, time.perf_counter() - inici)
+
+    async def execute(self, query, args=None):
+        await self.close()
+        sql = traduir(query)
+        self._fil = await self._conn._fil(_es_lectura(sql))
+        inici = time.perf_counter()
+        try:
+            cursor, files = await self._fil.fer(_executar, self._fil.connexio, sql, args or (), self._streaming)
+        finally:
+            self._mesurat(query, inici)
+        self.description = cursor.description
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+        if self._streaming:
+            self._cursor = cursor
+            self._conn._oberts.add(self)
+        else:
+            self._files, self._posicio = self._convertir(files), 0
+        return self.rowcount
+
+    async def executemany(self, query, args):
+        await self.close()
+        sql = traduir(query)
+        self._fil = await self._conn._fil(_es_lectura(sql))
+        inici = time.perf_counter()
+        try:
+            self.rowcount, self.lastrowid = await self._fil.fer(_executar_molts, self._fil.connexio, sql, list(args))
+        finally:
+            self._mesurat(query, inici)
+        self.description = None
+        self._files, self._posicio = [], 0
+        return self.rowcount
+
+    async def fetchmany(self, size=None):
+        size = size or 1
+        if self._cursor is not None:
+            return self._convertir(await self._fil.fer(self._cursor.fetchmany, size))
+        files = self._files[self._posicio:self._posicio + size]
+        self._posicio += len(files)
+        return files
+
+    async def fetchone(self):
+        files = await self.fetchmany(1)
+        return files[0] if files else None
+
+    async def fetchall(self):
+        if self._cursor is not None:
+            return self._convertir(await self._fil.fer(self._cursor.fetchall))
+        files = self._files[self._posicio:]
+        self._posicio = len(self._files)
+        return files
+
+    async def nextset(self):
+        return None
+
+    async def close(self):
+        if self._cursor is not None:
+            cursor, self._cursor = self._cursor, None
+            self._conn._oberts.discard(self)
+            await self._fil.fer(cursor.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class _CursorPendent:
+    # Com el de aiomysql: `await db.cursor()` o `async with db.cursor() as cursor`
+    __slots__ = ("_cursor",)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __await__(self):
+        yield from ()
+        return self._cursor
+
+    async def __aenter__(self):
+        return self._cursor
+
+    async def __aexit__(self, *exc):
+        await self._cursor.close()
+
+
+class ConnexioSqlite:
+    def __init__(self, base):
+        self._base = base
+        self._lector = None
+        self._escriptor = False
+        self._oberts = set()
+
+    def cursor(self, *classes):
+        return _CursorPendent(CursorSqlite(self, classes[0] if classes else aiomysql.Cursor))
+
+    async def _fil(self, lectura):
+        if self._escriptor:
+            return self._base._escriptor
+        if lectura:
+            if self._lector is None:
+                self._lector = await self._base._agafar_lector()
+            return self._lector
+        await self._base._torn_escriptor()
+        self._escriptor = True
+        try:
+            await self._base._escriptor.fer(self._base._escriptor.connexio.execute, "BEGIN IMMEDIATE")
+        except BaseException:
+            self._escriptor = False
+            self._base._deixar_escriptor()
+            raise
+        return self._base._escriptor
+
+    async def _acabar(self, sql):
+        if not self._escriptor:
+            return
+        try:
+            await self._base._escriptor.fer(self._base._escriptor.connexio.execute, sql)
+        finally:
+            self._escriptor = False
+            self._base._deixar_escriptor()
+
+    async def commit(self):
+        await self._acabar("COMMIT")
+
+    async def rollback(self):
+        await self._acabar("ROLLBACK")
+
+    def close(self):
+        # Les sentències a mig llegir es tanquen en tornar la connexió
+        pass
+
+    async def alliberar(self):
+        for cursor in list(self._oberts):
+            try:
+                await cursor.close()
+            except Exception:
+                pass
+        if self._escriptor:
+            # Sense commit, com a MySQL: la transacció es descarta
+            await self._acabar("ROLLBACK")
+        if self._lector is not None:
+            self._base._deixar_lector(self._lector)
+            self._lector = None
+
+
+class BaseDadesSqlite:
+    def __init__(self, path=SQLITE_PATH, lectors=SQLITE_LECTORS, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.n_lectors = lectors
+        self.timeout = timeout
+        self._escriptor = None
+        self._lectors = None
+        self._lliures = None
+        # asyncio.Lock desperta els que esperen per ordre d'arribada: és la cua d'escriptura
+        self._lock_escriptor = asyncio.Lock()
+        self._lock_obrir = asyncio.Lock()
+
+        self._transaccions = 0
+        self._esperant_escriptor = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._timeouts = 0
+
+    @property
+    def oberta(self):
+        return self._escriptor is not None
+
+    async def obrir(self):
+        async with self._lock_obrir:
+            if self._escriptor is not None:
+                return self
+            # L'escriptor primer: posa el fitxer en mode WAL abans que obrin els lectors
+            self._escriptor = _Fil(self.path, PRAGMES_ESCRIPTOR + PRAGMES, "ecosense-sqlite-escriptor")
+            self._lectors = [
+                _Fil(self.path, PRAGMES + ["PRAGMA query_only = ON"], f"ecosense-sqlite-lector{i}")
+                for i in range(self.n_lectors)
+            ]
+            self._lliures = asyncio.Queue()
+            for lector in self._lectors:
+                self._lliures.put_nowait(lector)
+        return self
+
+    async def crear_esquema(self):
+        await self.obrir()
+        await self._escriptor.fer(self._escriptor.connexio.executescript, ESQUEMA)
+
+    async def tancar(self):
+        async with self._lock_obrir:
+            if self._escriptor is None:
+                return
+            escriptor, lectors = self._escriptor, self._lectors
+            self._escriptor = self._lectors = self._lliures = None
+            # Estadístiques per al planificador de consultes (recomanat en tancar)
+            await escriptor.fer(escriptor.connexio.execute, "PRAGMA optimize")
+            for fil in [*lectors, escriptor]:
+                await asyncio.to_thread(fil.tancar)
+
+    async def _agafar_lector(self):
+        inici = time.perf_counter()
+        try:
+            return await asyncio.wait_for(self._lliures.get(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise PoolExhaurit(f"No hi ha cap lector SQLite lliure després de {self.timeout}s")
+        finally:
+            registrar_espera("sqlite_lector", time.perf_counter() - inici)
+
+    def _deixar_lector(self, lector):
+        if self._lliures is not None:
+            self._lliures.put_nowait(lector)
+
+    async def _torn_escriptor(self):
+        inici = time.perf_counter()
+        self._esperant_escriptor += 1
+        try:
+            await asyncio.wait_for(self._lock_escriptor.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise PoolExhaurit(f"L'escriptor SQLite continua ocupat després de {self.timeout}s")
+        finally:
+            self._esperant_escriptor -= 1
+            espera = time.perf_counter() - inici
+            registrar_espera("sqlite_escriptor", espera)
+        self._transaccions += 1
+        self._espera_total += espera
+        self._espera_max = max(self._espera_max, espera)
+
+    def _deixar_escriptor(self):
+        self._lock_escriptor.release()
+
+    @asynccontextmanager
+    async def connexio(self):
+        if self._escriptor is None:
+            await self.obrir()
+        conn = ConnexioSqlite(self)
+        try:
+            yield conn
+        finally:
+            await conn.alliberar()
+
+    def stats(self) -> dict:
+        if self._escriptor is None:
+            return {"obert": False, "backend": "sqlite"}
+        return {
+            "obert": True,
+            "backend": "sqlite",
+            "lectors": self.n_lectors,
+            "lectors_lliures": self._lliures.qsize(),
+            "escriptor_ocupat": self._lock_escriptor.locked(),
+            "esperant_escriptor": self._esperant_escriptor,
+            "transaccions_escriptura": self._transaccions,
+            "espera_escriptor_avg_ms": (self._espera_total / self._transaccions * 1000) if self._transaccions else 0.0,
+            "espera_escriptor_max_ms": self._espera_max * 1000,
+            "timeouts": self._timeouts,
+        }
+
+
+base_sqlite = BaseDadesSqlite()
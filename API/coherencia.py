@@ -0,0 +1,189 @@
+# Coherència entre workers sense broker extern
+#
+# Cada worker (uvicorn --workers N) té les seves memòries: dades de referència, ETags,
+# últimes lectures, previsions i subscriptors en directe. Les escriptures d'un worker
+# ho marquen a la base de dades, i els altres ho llegeixen cada COHERENCIA_INTERVAL segons:
+#  - canvis_versio: versions.confirmar l'incrementa a la mateixa transacció de l'escriptura;
+#    en canviar, referencia.py torna a carregar, els ETags coincideixen entre workers i
+#    les últimes lectures dels sensors eliminats es descarten;
+#  - humitat_sol: les lectures amb id més gran que l'última vista que no ha desat aquest
+#    worker s'afegeixen a recents i a les estadístiques, invaliden previsions i es
+#    publiquen en directe.
+# Un id que se salta pot ser d'una transacció encara oberta (MySQL reparteix els
+# AUTO_INCREMENT abans del commit): es torna a mirar fins a COHERENCIA_FORAT segons.
+# Així tots els workers tenen les mateixes estadístiques i alertes (i cada un les escriu
+# al seu log).
+import asyncio
+import logging
+import os
+import time
+
+import referencia
+import repositori
+import versions
+from client_async import db_client_async
+from directe import directe
+from estadistiques import avaluador
+from lectures_recents import recents
+from prediccio import memoria_prediccions
+
+logger = logging.getLogger("ecosense.coherencia")
+
+COHERENCIA_INTERVAL = float(os.environ.get("ECOSENSE_COHERENCIA_INTERVAL", "1.0"))
+COHERENCIA_LOT = 5000
+COHERENCIA_FORAT = 10.0
+COHERENCIA_FORATS_MAX = 100
+
+
+class Coherencia:
+    def __init__(self, interval=COHERENCIA_INTERVAL):
+        self.interval = interval
+        self._ultim_id = None
+        # [inici, fi]: ids desats per aquest worker, es registren abans del commit
+        self._propies = []
+        # [inici, fi, expira]: ids saltats que encara poden aparèixer
+        self._forats = []
+        self._lock = asyncio.Lock()
+        self._tasca = None
+
+        self._sondejos = 0
+        self._versions_canviades = 0
+        self._lectures_externes = 0
+        self._lectures_propies = 0
+        self._forats_tancats = 0
+        self._forats_expirats = 0
+        self._errors = 0
+        self._ultim_error = None
+        self._ultim_sondeig = 0.0
+
+    def propies(self, primer_id, n):
+        # ingesta.desar_lectures: el lot primer_id .. primer_id + n - 1 ja és en aquest worker
+        if primer_id and n:
+            self._propies.append((primer_id, primer_id + n - 1))
+
+    def _es_propia(self, lectura_id):
+        return any(inici <= lectura_id <= fi for inici, fi in self._propies)
+
+    def _saltats(self, desde, fins, ara):
+        # Ids entre desde i fins (exclosos) que no s'han vist: forats, llevat dels propis
+        inici = desde + 1
+        for propi_inici, propi_fi in sorted(self._propies):
+            if propi_fi < inici or propi_inici >= fins:
+                continue
+            if propi_inici > inici:
+                self._forats.append([inici, propi_inici - 1, ara + COHERENCIA_FORAT])
+            inici = max(inici, propi_fi + 1)
+        if inici < fins:
+            self._forats.append([inici, fins - 1, ara + COHERENCIA_FORAT])
+        if len(self._forats) > COHERENCIA_FORATS_MAX:
+            self._forats_expirats += len(self._forats) - COHERENCIA_FORATS_MAX
+            del self._forats[:-COHERENCIA_FORATS_MAX]
+
+    def _aplicar(self, files):
+        externes = []
+        for lectura_id, sensor_id, valor, ts in files:
+            if self._es_propia(lectura_id):
+                self._lectures_propies += 1
+            else:
+                externes.append((sensor_id, valor, ts))
+        if externes:
+            recents.registrar(externes)
+            avaluador.registrar(externes)
+            memoria_prediccions.invalidar(externes)
+            directe.publicar(externes)
+            self._lectures_externes += len(externes)
+
+    async def _noves_lectures(self, db):
+        ara = time.monotonic()
+        if self._ultim_id is None:
+            # Primer sondeig: el que ja hi havia ho carrega escalfar_recents
+            files = await repositori.consultar(db, repositori.ULTIM_ID_LECTURA)
+            self._ultim_id = files[0][0] or 0
+            return
+
+        # Forats: els que han aparegut s'apliquen, la resta es manté fins que expira
+        forats = []
+        for inici, fi, expira in self._forats:
+            files = await repositori.consultar(db, repositori.LECTURES_FORAT, (inici, fi))
+            self._aplicar(files)
+            vistos = sorted(fila[0] for fila in files)
+            self._forats_tancats += len(vistos)
+            for lectura_id in vistos + [fi + 1]:
+                if lectura_id > inici and expira > ara:
+                    forats.append([inici, lectura_id - 1, expira])
+                inici = lectura_id + 1
+            if expira <= ara:
+                self._forats_expirats += 1
+        self._forats = forats
+
+        while True:
+            files = await repositori.consultar(db, repositori.LECTURES_NOVES, (self._ultim_id, COHERENCIA_LOT))
+            anterior = self._ultim_id
+            for fila in files:
+                if fila[0] > anterior + 1:
+                    self._saltats(anterior, fila[0], ara)
+                anterior = fila[0]
+            self._aplicar(files)
+            if files:
+                self._ultim_id = files[-1][0]
+            if len(files) < COHERENCIA_LOT:
+                break
+        # Un lot propi es pot haver saltat abans de registrar-lo: es guarda mentre hi hagi forats
+        vist = min([self._ultim_id] + [inici - 1 for inici, _, _ in self._forats])
+        self._propies = [(inici, fi) for inici, fi in self._propies if fi > vist]
+
+    async def sondejar(self):
+        async with self._lock:
+            inici = time.perf_counter()
+            async with db_client_async() as db:
+                canviats = versions.sincronitzar(await repositori.consultar(db, repositori.VERSIONS))
+                await self._noves_lectures(db)
+            if "sensors" in canviats:
+                recents.conservar(await referencia.sensors.per_id())
+            self._versions_canviades += len(canviats)
+            self._sondejos += 1
+            self._ultim_sondeig = time.perf_counter() - inici
+
+    async def _bucle(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sondejar()
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self._errors += 1
+                self._ultim_error = str(err)
+                logger.warning("Coherència: el sondeig ha fallat: %s", err)
+
+    def iniciar(self):
+        if self._tasca is None:
+            self._tasca = asyncio.create_task(self._bucle())
+
+    async def aturar(self):
+        if self._tasca is not None:
+            self._tasca.cancel()
+            try:
+                await self._tasca
+            except asyncio.CancelledError:
+                pass
+            self._tasca = None
+
+    def stats(self) -> dict:
+        return {
+            "interval_s": self.interval,
+            "sondejos": self._sondejos,
+            "ultim_sondeig_ms": self._ultim_sondeig * 1000,
+            "versions_canviades": self._versions_canviades,
+            "lectures_externes": self._lectures_externes,
+            "lectures_propies": self._lectures_propies,
+            "ultim_id": self._ultim_id,
+            "forats_oberts": len(self._forats),
+            "forats_tancats": self._forats_tancats,
+            "forats_expirats": self._forats_expirats,
+            "errors": self._errors,
+            "ultim_error": self._ultim_error,
+        }
+
+
+coherencia = Coherencia()
@@ -0,0 +1,101 @@
+# Hash i verificació de contrasenyes (bcrypt) en un pool de processos propi
+#
+# bcrypt és car en CPU: fer-lo als threads de les peticions fa que un pic de logins
+# deixi sense workers la resta d'endpoints. Aquí té els seus processos, un límit de
+# feines simultànies i un temps màxim d'espera a la cua.
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+PWD_PROCESSOS = int(os.environ.get("ECOSENSE_PWD_PROCESSOS", str(max(1, (os.cpu_count() or 2) // 2))))
+PWD_CONCURRENCIA = int(os.environ.get("ECOSENSE_PWD_CONCURRENCIA", str(PWD_PROCESSOS * 4)))
+PWD_TIMEOUT = float(os.environ.get("ECOSENSE_PWD_TIMEOUT", "5"))
+
+_pwd_context = None
+_executor = None
+_semafor = None
+_arrencant = []
+
+_en_curs = 0
+_completades = 0
+_rebutjades = 0
+
+
+class ContrasenyesOcupat(Exception):
+    pass
+
+
+def _init_proces():
+    global _pwd_context
+    _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    # El backend de bcrypt es carrega ara i no amb el primer login
+    _pwd_context.handler().get_backend()
+
+
+def _verify(contrasenya, hash):
+    return _pwd_context.verify(contrasenya, hash)
+
+
+def _hash(contrasenya):
+    return _pwd_context.hash(contrasenya)
+
+
+def iniciar_contrasenyes():
+    global _executor, _semafor
+    _executor = ProcessPoolExecutor(max_workers=PWD_PROCESSOS, initializer=_init_proces)
+    _semafor = asyncio.Semaphore(PWD_CONCURRENCIA)
+    # Arrenca els processos ara i no amb el primer login
+    _arrencant[:] = [_executor.submit(_init_proces) for _ in range(PWD_PROCESSOS)]
+
+
+async def escalfar_contrasenyes():
+    # Espera que els processos hagin arrencat i carregat bcrypt
+    await asyncio.gather(*(asyncio.wrap_future(futur) for futur in _arrencant))
+    _arrencant.clear()
+
+
+def aturar_contrasenyes():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+async def _executar(funcio, *args):
+    global _en_curs, _completades, _rebutjades
+    if _executor is None:
+        raise ContrasenyesOcupat("El pool de contrasenyes no està actiu")
+    try:
+        await asyncio.wait_for(_semafor.acquire(), timeout=PWD_TIMEOUT)
+    except asyncio.TimeoutError:
+        _rebutjades += 1
+        raise ContrasenyesOcupat("Massa peticions d'autenticació, torna-ho a provar")
+    _en_curs += 1
+    try:
+        resultat = await asyncio.get_running_loop().run_in_executor(_executor, funcio, *args)
+    finally:
+        _en_curs -= 1
+        _semafor.release()
+    _completades += 1
+    return resultat
+
+
+async def verificar_contrasenya(contrasenya, hash):
+    # Llença ValueError si `hash` no és un hash reconegut (contrasenyes antigues en pla)
+    return await _executar(_verify, contrasenya, hash)
+
+
+async def hash_contrasenya(contrasenya):
+    return await _executar(_hash, contrasenya)
+
+
+def contrasenyes_stats() -> dict:
+    return {
+        "processos": PWD_PROCESSOS,
+        "concurrencia": PWD_CONCURRENCIA,
+        "en_curs": _en_curs,
+        "completades": _completades,
+        "rebutjades": _rebutjades,
+    }
@@ -0,0 +1,180 @@
+# Lectures en directe per sensor (GET /sensors/{id}/live amb SSE i WebSocket)
+#
+# Pub/sub dins del procés: desar_lectures publica cada lectura desada i es reparteix
+# a tots els subscriptors del sensor. Cada subscriptor té una cua curta; si el client
+# no la buida prou de pressa es descarten les lectures més antigues (a la pantalla només
+# importa l'última). Cada connexió té, a més de la cua, una tasca que n'espera el
+# tancament: amb SSE la de Starlette (StreamingResponse escolta la desconnexió mentre
+# el generador envia) i amb WebSocket la d'esperar_tancament.
+# La subscripció es fa dins del generador SSE i de servir_websocket, que la cancel·len en
+# acabar: si el client marxa abans que comenci la resposta no queda cap subscriptor.
+import asyncio
+import os
+
+import orjson
+
+DIRECTE_CUA = int(os.environ.get("ECOSENSE_DIRECTE_CUA", "16"))
+DIRECTE_MAX = int(os.environ.get("ECOSENSE_DIRECTE_MAX", "10000"))
+DIRECTE_HEARTBEAT = float(os.environ.get("ECOSENSE_DIRECTE_HEARTBEAT", "15"))
+
+# Marca de final de la subscripció (aturada de l'API)
+FINAL = None
+
+
+class MassaSubscriptors(Exception):
+    pass
+
+
+def missatge_lectura(sensor_id, valor, timestamp):
+    return orjson.dumps({"sensor_id": sensor_id, "valor": float(valor), "timestamp": timestamp}).decode()
+
+
+class Subscripcio:
+    __slots__ = ("sensor_id", "_cua", "_pubsub")
+
+    def __init__(self, pubsub, sensor_id, mida_cua):
+        self.sensor_id = sensor_id
+        self._cua = asyncio.Queue(mida_cua)
+        self._pubsub = pubsub
+
+    def posar(self, missatge):
+        if self._cua.full():
+            self._cua.get_nowait()
+            self._pubsub._perdudes += 1
+        self._cua.put_nowait(missatge)
+
+    def tancar(self):
+        # FINAL passa davant de les lectures pendents
+        while not self._cua.empty():
+            self._cua.get_nowait()
+        self._cua.put_nowait(FINAL)
+
+    async def seguent(self, timeout):
+        # El missatge següent, o "" si passa `timeout` sense cap (per enviar el heartbeat)
+        try:
+            return await asyncio.wait_for(self._cua.get(), timeout)
+        except asyncio.TimeoutError:
+            return ""
+
+
+class PubSub:
+    def __init__(self, mida_cua=DIRECTE_CUA, max_subscriptors=DIRECTE_MAX):
+        self.mida_cua = mida_cua
+        self.max_subscriptors = max_subscriptors
+        self._subscriptors = {}
+        self._total = 0
+        self._publicades = 0
+        self._entregades = 0
+        self._perdudes = 0
+        self._rebutjades = 0
+
+    def comprovar(self):
+        # Abans de respondre (503 o codi 1013); subscriure ho torna a mirar
+        if self._total >= self.max_subscriptors:
+            self._rebutjades += 1
+            raise MassaSubscriptors(f"Massa connexions en directe ({self.max_subscriptors})")
+
+    def subscriure(self, sensor_id):
+        self.comprovar()
+        subscripcio = Subscripcio(self, sensor_id, self.mida_cua)
+        self._subscriptors.setdefault(sensor_id, set()).add(subscripcio)
+        self._total += 1
+        return subscripcio
+
+    def cancellar(self, subscripcio):
+        subscriptors = self._subscriptors.get(subscripcio.sensor_id)
+        if subscriptors is not None and subscripcio in subscriptors:
+            subscriptors.discard(subscripcio)
+            self._total -= 1
+            if not subscriptors:
+                del self._subscriptors[subscripcio.sensor_id]
+
+    def publicar(self, files):
+        # files: (sensor_id, valor, timestamp) acabades de desar. El JSON es fa un sol cop per lectura.
+        if not self._subscriptors:
+            return
+        for sensor_id, valor, timestamp in files:
+            subscriptors = self._subscriptors.get(sensor_id)
+            if not subscriptors:
+                continue
+            missatge = missatge_lectura(sensor_id, valor, timestamp)
+            self._publicades += 1
+            for subscripcio in subscriptors:
+                subscripcio.posar(missatge)
+            self._entregades += len(subscriptors)
+
+    def tancar_tots(self):
+        for subscriptors in self._subscriptors.values():
+            for subscripcio in subscriptors:
+                subscripcio.tancar()
+
+    def stats(self) -> dict:
+        return {
+            "subscriptors": self._total,
+            "sensors": len(self._subscriptors),
+            "max_subscriptors": self.max_subscriptors,
+            "publicades": self._publicades,
+            "entregades": self._entregades,
+            "perdudes": self._perdudes,
+            "rebutjades": self._rebutjades,
+        }
+
+
+directe = PubSub()
+
+
+async def events_sse(sensor_id, inicial=None):
+    # Generador per StreamingResponse; Starlette el cancel·la quan el client es desconnecta
+    try:
+        subscripcio = directe.subscriure(sensor_id)
+    except MassaSubscriptors:
+        # S'ha omplert després de comprovar(): el client ho torna a provar d'aquí a retry
+        yield "retry: 5000\n\n"
+        return
+    try:
+        yield "retry: 5000\n\n"
+        if inicial is not None:
+            yield f"event: lectura\ndata: {inicial}\n\n"
+        while True:
+            missatge = await subscripcio.seguent(DIRECTE_HEARTBEAT)
+            if missatge is FINAL:
+                return
+            if missatge:
+                yield f"event: lectura\ndata: {missatge}\n\n"
+            else:
+                yield ": ping\n\n"
+    finally:
+        directe.cancellar(subscripcio)
+
+
+async def servir_websocket(websocket, sensor_id, inicial=None):
+    # El client no envia res; llegir en paral·lel només serveix per saber quan tanca.
+    # El keepalive el fa uvicorn amb pings del protocol WebSocket.
+    try:
+        subscripcio = directe.subscriure(sensor_id)
+    except MassaSubscriptors:
+        await websocket.close(code=1013)
+        return
+
+    async def esperar_tancament():
+        try:
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            subscripcio.tancar()
+
+    lector = asyncio.create_task(esperar_tancament())
+    try:
+        if inicial is not None:
+            await websocket.send_text(inicial)
+        while True:
+            missatge = await subscripcio.seguent(None)
+            if missatge is FINAL:
+                break
+            await websocket.send_text(missatge)
+        if not lector.done():
+            # Aturada de l'API
+            await websocket.close(code=1001)
+    finally:
+        lector.cancel()
+        directe.cancellar(subscripcio)
@@ -0,0 +1,181 @@
+# Estadístiques per sensor calculades a mesura que arriben les lectures, i alertes
+#
+# Per cada sensor es guarda una finestra de les últimes ECOSENSE_ESTAT_FINESTRA lectures
+# amb la suma i dues cues monòtones (mínim i màxim): afegir una lectura i consultar la
+# mitjana, el mínim, el màxim o la velocitat de canvi és O(1) (amortitzat), sense
+# consultar mai l'historial de humitat_sol. Només hi ha els sensors que han enviat
+# alguna lectura des que ha arrencat el procés.
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger("ecosense.alertes")
+
+ESTAT_FINESTRA = int(os.environ.get("ECOSENSE_ESTAT_FINESTRA", "12"))
+# Mitjana de humitat per sota de la qual la planta necessita aigua, i marge per tornar a avisar
+ALERTA_HUMITAT_MIN = float(os.environ.get("ECOSENSE_ALERTA_HUMITAT_MIN", "30"))
+ALERTA_HISTERESI = float(os.environ.get("ECOSENSE_ALERTA_HISTERESI", "5"))
+# Segons sense rebre cap lectura per considerar el sensor silenciós
+ALERTA_SILENCI = float(os.environ.get("ECOSENSE_ALERTA_SILENCI", "3600"))
+ALERTES_MAX = int(os.environ.get("ECOSENSE_ALERTES_MAX", "1000"))
+ALERTES_INTERVAL = 60
+
+NECESSITA_AIGUA = "necessita_aigua"
+SENSOR_SILENCIOS = "sensor_silencios"
+
+
+class EstatSensor:
+    __slots__ = ("finestra", "suma", "minims", "maxims", "ultima_arribada", "necessita_aigua", "silencios")
+
+    def __init__(self, mida):
+        self.finestra = deque(maxlen=mida)
+        self.suma = 0.0
+        # (índex, valor) candidats a mínim / màxim de la finestra
+        self.minims = deque()
+        self.maxims = deque()
+        self.ultima_arribada = 0.0
+        self.necessita_aigua = False
+        self.silencios = False
+
+    def afegir(self, ts, valor, index):
+        if len(self.finestra) == self.finestra.maxlen:
+            self.suma -= self.finestra[0][1]
+        self.finestra.append((ts, valor))
+        self.suma += valor
+
+        while self.minims and self.minims[-1][1] >= valor:
+            self.minims.pop()
+        self.minims.append((index, valor))
+        while self.maxims and self.maxims[-1][1] <= valor:
+            self.maxims.pop()
+        self.maxims.append((index, valor))
+        # Surten de la finestra els candidats massa antics
+        primer = index - len(self.finestra) + 1
+        if self.minims[0][0] < primer:
+            self.minims.popleft()
+        if self.maxims[0][0] < primer:
+            self.maxims.popleft()
+
+    def mitjana(self):
+        return self.suma / len(self.finestra)
+
+    def canvi_per_hora(self):
+        # Pendent entre la primera i l'última lectura de la finestra
+        (t0, v0), (t1, v1) = self.finestra[0], self.finestra[-1]
+        if t1 <= t0:
+            return None
+        return (v1 - v0) / (t1 - t0) * 3600
+
+
+class Avaluador:
+    def __init__(self, finestra=ESTAT_FINESTRA, humitat_min=ALERTA_HUMITAT_MIN,
+                 histeresi=ALERTA_HISTERESI, silenci=ALERTA_SILENCI):
+        self.finestra = finestra
+        self.humitat_min = humitat_min
+        self.histeresi = histeresi
+        self.silenci = silenci
+        self._sensors = {}
+        # Índex de cada lectura per sensor (per saber quan surt de la finestra)
+        self._index = {}
+        self._alertes = deque(maxlen=ALERTES_MAX)
+        self._tasca = None
+
+        self._lectures = 0
+        self._fora_ordre = 0
+
+    def _alerta(self, tipus, sensor_id, valor=None):
+        alerta = {"tipus": tipus, "sensor_id": sensor_id, "moment": datetime.now(), "valor": valor}
+        self._alertes.append(alerta)
+        logger.warning("%s: sensor %s%s", tipus, sensor_id, f" ({valor:.1f})" if valor is not None else "")
+
+    def registrar(self, files):
+        # files: (sensor_id, valor, timestamp) acabades de desar
+        ara = time.monotonic()
+        for sensor_id, valor, ts in files:
+            estat = self._sensors.get(sensor_id)
+            if estat is None:
+                estat = self._sensors[sensor_id] = EstatSensor(self.finestra)
+                self._index[sensor_id] = 0
+            segons = ts.timestamp()
+            estat.ultima_arribada = ara
+            estat.silencios = False
+            # Una lectura més antiga que l'última de la finestra no hi entra (seria O(n))
+            if estat.finestra and segons < estat.finestra[-1][0]:
+                self._fora_ordre += 1
+                continue
+            self._index[sensor_id] += 1
+            estat.afegir(segons, float(valor), self._index[sensor_id])
+            self._lectures += 1
+
+            mitjana = estat.mitjana()
+            if not estat.necessita_aigua and mitjana < self.humitat_min:
+                estat.necessita_aigua = True
+                self._alerta(NECESSITA_AIGUA, sensor_id, mitjana)
+            elif estat.necessita_aigua and mitjana >= self.humitat_min + self.histeresi:
+                estat.necessita_aigua = False
+
+    def comprovar_silencis(self):
+        ara = time.monotonic()
+        for sensor_id, estat in self._sensors.items():
+            if not estat.silencios and ara - estat.ultima_arribada > self.silenci:
+                estat.silencios = True
+                self._alerta(SENSOR_SILENCIOS, sensor_id)
+
+    def estat(self, sensor_id):
+        estat = self._sensors.get(sensor_id)
+        if estat is None or not estat.finestra:
+            return None
+        ts, valor = estat.finestra[-1]
+        return {
+            "sensor_id": sensor_id,
+            "lectures": len(estat.finestra),
+            "ultim_valor": valor,
+            "ultim_timestamp": datetime.fromtimestamp(ts),
+            "mitjana": estat.mitjana(),
+            "min": estat.minims[0][1],
+            "max": estat.maxims[0][1],
+            "canvi_per_hora": estat.canvi_per_hora(),
+            "segons_des_de_ultima": time.monotonic() - estat.ultima_arribada,
+            "necessita_aigua": estat.necessita_aigua,
+            "silencios": estat.silencios,
+        }
+
+    def alertes(self, sensor_id=None, limit=100):
+        # Les més recents primer
+        alertes = (a for a in reversed(self._alertes) if sensor_id is None or a["sensor_id"] == sensor_id)
+        return [a for _, a in zip(range(limit), alertes)]
+
+    async def _bucle(self):
+        while True:
+            await asyncio.sleep(ALERTES_INTERVAL)
+            self.comprovar_silencis()
+
+    async def iniciar(self):
+        if self._tasca is None:
+            self._tasca = asyncio.create_task(self._bucle())
+
+    async def aturar(self):
+        if self._tasca is not None:
+            self._tasca.cancel()
+            try:
+                await self._tasca
+            except asyncio.CancelledError:
+                pass
+            self._tasca = None
+
+    def stats(self) -> dict:
+        return {
+            "sensors": len(self._sensors),
+            "finestra": self.finestra,
+            "lectures": self._lectures,
+            "fora_ordre": self._fora_ordre,
+            "necessiten_aigua": sum(1 for e in self._sensors.values() if e.necessita_aigua),
+            "silenciosos": sum(1 for e in self._sensors.values() if e.silencios),
+            "alertes": len(self._alertes),
+        }
+
+
+avaluador = Avaluador()
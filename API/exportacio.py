@@ -0,0 +1,67 @@
+# Exportació en streaming de humitat_sol (CSV / NDJSON)
+import json
+import zlib
+
+import aiomysql
+
+from client_async import db_client_async
+
+EXPORT_FILES_LOT = 1000
+
+CAPCALERA_CSV = "id,sensor_id,valor,timestamp\n"
+
+
+def _csv(files):
+    return "".join(f"{id},{sensor_id},{valor},{ts.isoformat()}\n" for id, sensor_id, valor, ts in files)
+
+
+def _ndjson(files):
+    return "".join(
+        json.dumps({"id": id, "sensor_id": sensor_id, "valor": valor, "timestamp": ts.isoformat()}) + "\n"
+        for id, sensor_id, valor, ts in files
+    )
+
+
+FORMATS = {
+    "csv": (_csv, "text/csv; charset=utf-8", CAPCALERA_CSV),
+    "ndjson": (_ndjson, "application/x-ndjson", ""),
+}
+
+
+async def _files_exportacio(query, params):
+    # SSCursor no porta el resultat sencer a memòria: les files arriben a lots
+    async with db_client_async() as db:
+        cursor = await db.cursor(aiomysql.SSCursor)
+        complet = False
+        try:
+            await cursor.execute(query, params)
+            while True:
+                files = await cursor.fetchmany(EXPORT_FILES_LOT)
+                if not files:
+                    break
+                yield files
+            complet = True
+        finally:
+            if complet:
+                await cursor.close()
+            else:
+                # Client desconnectat: tancar la connexió evita llegir la resta del resultat
+                db.close()
+
+
+async def exportar_lectures(query, params, format, comprimir):
+    formatar, _, capcalera = FORMATS[format]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+
+    def sortida(text):
+        dades = text.encode()
+        return compressor.compress(dades) if compressor else dades
+
+    if capcalera:
+        yield sortida(capcalera)
+    async for files in _files_exportacio(query, params):
+        bloc = sortida(formatar(files))
+        if bloc:
+            yield bloc
+    if compressor:
+        yield compressor.flush()
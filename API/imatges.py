@@ -0,0 +1,146 @@
+# Variants de les fotos de plantes (miniatura i mitjana) amb noms per hash de contingut
+#
+# Es generen en arrencar l'API (només les que falten) o a mà en desplegar:
+#
+#   cd API && python imatges.py
+#
+# Com que el nom del fitxer canvia quan canvia el contingut, es poden servir amb
+# Cache-Control immutable i el mòbil no les torna a descarregar mai. El manifest canvia,
+# per això no és a static/v (que es serveix com a immutable) sinó fora de static.
+#
+# Tots els workers de uvicorn ho fan en arrencar: un bloqueig de fitxer fa que només un
+# generi les variants i la resta, en entrar, ja les trobi fetes.
+import hashlib
+import io
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sense bloqueig, els fitxers temporals ja són únics
+    fcntl = None
+
+from PIL import Image, ImageOps
+from fastapi.staticfiles import StaticFiles
+
+DIR_ORIGINALS = os.path.join("static", "plantas")
+DIR_VARIANTS = os.path.join("static", "v")
+MANIFEST = "variants.json"
+BLOQUEIG = "variants.lock"
+# Manifest antic, dins del directori públic
+_MANIFEST_ANTIC = os.path.join(DIR_VARIANTS, "manifest.json")
+
+# Costat màxim en píxels; None = imatge original sense redimensionar
+MIDES = {
+    "thumb": 200,
+    "medium": 640,
+    "original": None,
+}
+
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+
+_manifest = {}
+
+
+class StaticImmutable(StaticFiles):
+    def file_response(self, *args, **kwargs):
+        resposta = super().file_response(*args, **kwargs)
+        resposta.headers["Cache-Control"] = CACHE_IMMUTABLE
+        return resposta
+
+
+def _escriure(desti, contingut, mode="wb"):
+    # Fitxer temporal únic al mateix directori i os.replace: mai es veu mig escrit
+    with tempfile.NamedTemporaryFile(mode, dir=os.path.dirname(desti) or ".", suffix=".tmp", delete=False) as f:
+        f.write(contingut)
+    try:
+        # NamedTemporaryFile els crea amb 0600
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, desti)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
+@contextmanager
+def _bloqueig():
+    with open(BLOQUEIG, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _variant(dades, costat):
+    if costat is None:
+        return dades
+    with Image.open(io.BytesIO(dades)) as imatge:
+        imatge = ImageOps.exif_transpose(imatge).convert("RGB")
+        imatge.thumbnail((costat, costat), Image.LANCZOS)
+        sortida = io.BytesIO()
+        imatge.save(sortida, "JPEG", quality=80, optimize=True, progressive=True)
+        return sortida.getvalue()
+
+
+def generar_variants(nom_fitxer, manifest):
+    # Torna True si s'ha hagut de generar alguna variant
+    with open(os.path.join(DIR_ORIGINALS, nom_fitxer), "rb") as f:
+        dades = f.read()
+    hash_original = hashlib.sha256(dades).hexdigest()
+    nom = os.path.splitext(nom_fitxer)[0]
+
+    actual = manifest.get(nom)
+    if actual and actual["original_sha256"] == hash_original and all(
+        mida in actual["variants"] and os.path.isfile(os.path.join(DIR_VARIANTS, actual["variants"][mida]))
+        for mida in MIDES
+    ):
+        return False
+
+    variants = {}
+    for mida, costat in MIDES.items():
+        contingut = _variant(dades, costat)
+        extensio = os.path.splitext(nom_fitxer)[1].lower() if costat is None else ".jpg"
+        fitxer = f"{nom}.{mida}.{hashlib.sha256(contingut).hexdigest()[:12]}{extensio}"
+        desti = os.path.join(DIR_VARIANTS, fitxer)
+        if not os.path.exists(desti):
+            _escriure(desti, contingut)
+        variants[mida] = fitxer
+    manifest[nom] = {"original_sha256": hash_original, "variants": variants}
+    return True
+
+
+def preparar_variants():
+    global _manifest
+    os.makedirs(DIR_VARIANTS, exist_ok=True)
+    with _bloqueig():
+        manifest = {}
+        if os.path.exists(MANIFEST):
+            with open(MANIFEST) as f:
+                manifest = json.load(f)
+
+        canvis = False
+        for nom_fitxer in sorted(os.listdir(DIR_ORIGINALS)):
+            if nom_fitxer.lower().endswith((".jpg", ".jpeg", ".png")):
+                canvis |= generar_variants(nom_fitxer, manifest)
+
+        if canvis:
+            _escriure(MANIFEST, json.dumps(manifest, indent=2, sort_keys=True), "w")
+        if os.path.exists(_MANIFEST_ANTIC):
+            os.remove(_MANIFEST_ANTIC)
+    _manifest = manifest
+    return manifest
+
+
+def url_imatge(base_url, nom, mida=None):
+    # Sense mida (o si no hi ha variant per aquesta planta) es manté la URL de sempre
+    if mida:
+        entrada = _manifest.get(nom)
+        if entrada and mida in entrada["variants"]:
+            return f"{base_url}/static/v/{entrada['variants'][mida]}"
+    return f"{base_url}/static/plantas/{nom}.jpg"
+
+
+if __name__ == "__main__":
+    for nom, entrada in preparar_variants().items():
+        print(nom, " ".join(entrada["variants"].values()))
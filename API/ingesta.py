@@ -0,0 +1,317 @@
+# Ingesta de lectures de humitat_sol
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta
+
+import aiomysql
+import pymysql
+
+import referencia
+import repositori
+from client_async import db_client_async
+from coherencia import coherencia
+from directe import directe
+from estadistiques import avaluador
+from prediccio import memoria_prediccions
+from lectures_recents import recents
+from rollups import actualitzar_rollups
+
+logger = logging.getLogger("ecosense.ingesta")
+
+LECTURES_BATCH_MAX = 10000
+
+BUFFER_MIDA_FLUSH = int(os.environ.get("ECOSENSE_INGESTA_MIDA_FLUSH", "500"))
+BUFFER_INTERVAL_FLUSH = float(os.environ.get("ECOSENSE_INGESTA_INTERVAL_FLUSH", "1.0"))
+BUFFER_CAPACITAT = int(os.environ.get("ECOSENSE_INGESTA_CAPACITAT", "20000"))
+BUFFER_ESPERA = float(os.environ.get("ECOSENSE_INGESTA_ESPERA", "0.5"))
+BUFFER_REINTENTS = 3
+
+# Files per INSERT multi-fila. Ha de quedar per sota de max_stmt_length d'aiomysql (1 MB),
+# que si no parteix l'INSERT i lastrowid només és el del darrer tros.
+INSERT_FILES = 5000
+
+
+def _sensor_id(valor):
+    if isinstance(valor, bool):
+        raise ValueError("sensor_id ha de ser un enter")
+    if isinstance(valor, int):
+        return valor
+    if isinstance(valor, str) and valor.strip().isdigit():
+        return int(valor)
+    raise ValueError("sensor_id ha de ser un enter")
+
+
+def _valor(valor):
+    if isinstance(valor, bool) or not isinstance(valor, (int, float, str)):
+        raise ValueError("valor ha de ser numèric")
+    try:
+        valor = float(valor)
+    except ValueError:
+        raise ValueError("valor ha de ser numèric")
+    if not math.isfinite(valor):
+        raise ValueError("valor ha de ser finit")
+    return valor
+
+
+def _al_segon(ts):
+    # humitat_sol.timestamp és DATETIME sense fraccions i MySQL arrodoneix al segon:
+    # el ring, el directe i les estadístiques han de veure el mateix valor que la taula
+    if ts.microsecond >= 500000:
+        ts += timedelta(seconds=1)
+    return ts.replace(microsecond=0)
+
+
+def _timestamp(valor, ara):
+    if valor is None:
+        return ara
+    if isinstance(valor, datetime):
+        ts = valor
+    elif isinstance(valor, str):
+        try:
+            ts = datetime.fromisoformat(valor)
+        except ValueError:
+            raise ValueError("timestamp no té format ISO 8601")
+    else:
+        raise ValueError("timestamp no té format ISO 8601")
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return _al_segon(ts)
+
+
+def validar_lectures(items, sensors_existents, limitades=()):
+    # Una sola passada: retorna les files a inserir i el resultat per item.
+    # limitades: índexs que el control d'admissió ha rebutjat (admissio.py)
+    ara = _al_segon(datetime.now())
+    files = []
+    resultats = []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("cada lectura ha de ser un objecte")
+            if index in limitades:
+                raise ValueError("massa lectures del sensor")
+            sensor_id = _sensor_id(item.get("sensor_id"))
+            if sensor_id not in sensors_existents:
+                raise ValueError("sensor no existeix")
+            fila = (sensor_id, _valor(item.get("valor")), _timestamp(item.get("timestamp"), ara))
+        except ValueError as e:
+            resultats.append({"index": index, "acceptada": False, "error": str(e)})
+            continue
+        files.append(fila)
+        resultats.append({"index": index, "acceptada": True, "error": None})
+    return files, resultats
+
+
+def sensor_id_item(item):
+    # sensor_id d'una lectura sense validar, o None
+    if isinstance(item, dict):
+        try:
+            return _sensor_id(item.get("sensor_id"))
+        except ValueError:
+            pass
+    return None
+
+
+def sensor_ids_candidats(items):
+    return {sensor_id for sensor_id in map(sensor_id_item, items) if sensor_id is not None}
+
+
+async def sensors_existents(db, ids):
+    if not ids:
+        return set()
+    # Els sensors en memòria no es consulten; la resta (p. ex. creats per un altre worker) sí
+    coneguts = await referencia.sensors.per_id()
+    existents = {sensor_id for sensor_id in ids if sensor_id in coneguts}
+    desconeguts = [sensor_id for sensor_id in ids if sensor_id not in coneguts]
+    if not desconeguts:
+        return existents
+    cursor = await db.cursor(aiomysql.Cursor)
+    try:
+        marcadors = ", ".join(["%s"] * len(desconeguts))
+        await cursor.execute(f"SELECT sensor_id FROM sensors WHERE sensor_id IN ({marcadors})", tuple(desconeguts))
+        return existents | {fila[0] for fila in await cursor.fetchall()}
+    finally:
+        await cursor.close()
+
+
+async def sensor_existeix(sensor_id):
+    # POST /lectures/: sense connexió si el sensor és a la memòria de referència
+    if sensor_id in await referencia.sensors.per_id():
+        return True
+    async with db_client_async() as db:
+        return bool(await sensors_existents(db, {sensor_id}))
+
+
+async def desar_lectures(db, files):
+    # executemany reescriu l'INSERT com a INSERT multi-fila; tot en una transacció
+    if not files:
+        return 0
+    cursor = await db.cursor(aiomysql.Cursor)
+    try:
+        for inici in range(0, len(files), INSERT_FILES):
+            tros = files[inici:inici + INSERT_FILES]
+            await cursor.executemany(repositori.INSERIR_LECTURA.sql, tros)
+            # Un INSERT multi-fila rep ids consecutius, també amb innodb_autoinc_lock_mode=2
+            # (només els "bulk inserts" com INSERT ... SELECT poden tenir forats). Abans del
+            # commit: els altres workers les veuran, aquest no les ha de tornar a aplicar.
+            coherencia.propies(cursor.lastrowid, len(tros))
+        await actualitzar_rollups(cursor, files)
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+    finally:
+        await cursor.close()
+    recents.registrar(files)
+    avaluador.registrar(files)
+    memoria_prediccions.invalidar(files)
+    directe.publicar(files)
+    return len(files)
+
+
+class BufferPle(Exception):
+    pass
+
+
+class BufferIngesta:
+    # Write-behind: les lectures individuals s'acumulen i es desen en lots
+    def __init__(self, mida_flush=BUFFER_MIDA_FLUSH, interval_flush=BUFFER_INTERVAL_FLUSH,
+                 capacitat=BUFFER_CAPACITAT, espera=BUFFER_ESPERA):
+        self.mida_flush = mida_flush
+        self.interval_flush = interval_flush
+        self.capacitat = capacitat
+        self.espera = espera
+        self._cua = None
+        self._tasca = None
+        self._aturant = False
+
+        self._rebudes = 0
+        self._rebutjades_ple = 0
+        self._desades = 0
+        self._invalides = 0
+        self._sense_sensor = 0
+        self._perdudes = 0
+        self._flushes = 0
+        self._ultim_lot = 0
+        self._lot_max = 0
+        self._flush_total = 0.0
+        self._flush_max = 0.0
+        self._ultim_flush = 0.0
+
+    async def iniciar(self):
+        self._cua = asyncio.Queue(maxsize=self.capacitat)
+        self._aturant = False
+        self._tasca = asyncio.create_task(self._bucle())
+
+    async def aturar(self):
+        # Deixa d'acceptar lectures i buida el que quedi a la cua
+        if self._tasca is None:
+            return
+        self._aturant = True
+        await self._tasca
+        self._tasca = None
+
+    async def afegir(self, lectura: dict):
+        if self._tasca is None or self._tasca.done() or self._aturant:
+            raise BufferPle("El buffer d'ingesta no està actiu")
+        try:
+            await asyncio.wait_for(self._cua.put(lectura), timeout=self.espera)
+        except asyncio.TimeoutError:
+            self._rebutjades_ple += 1
+            raise BufferPle("El buffer d'ingesta és ple")
+        self._rebudes += 1
+
+    async def _seguent_lot(self):
+        try:
+            primera = await asyncio.wait_for(self._cua.get(), timeout=self.interval_flush)
+        except asyncio.TimeoutError:
+            return []
+        lot = [primera]
+        limit = time.monotonic() + self.interval_flush
+        while len(lot) < self.mida_flush:
+            if not self._cua.empty():
+                lot.append(self._cua.get_nowait())
+                continue
+            restant = limit - time.monotonic()
+            if restant <= 0 or self._aturant:
+                break
+            try:
+                lot.append(await asyncio.wait_for(self._cua.get(), timeout=restant))
+            except asyncio.TimeoutError:
+                break
+        return lot
+
+    async def _bucle(self):
+        while not (self._aturant and self._cua.empty()):
+            lot = await self._seguent_lot()
+            if not lot:
+                continue
+            try:
+                await self._flush(lot)
+            except Exception:
+                # P. ex. PoolExhaurit: es perd el lot però el buffer segueix buidant-se
+                logger.exception("Flush de %d lectures fallit", len(lot))
+                self._perdudes += len(lot)
+
+    async def _flush(self, lot):
+        inici = time.perf_counter()
+        for intent in range(1, BUFFER_REINTENTS + 1):
+            try:
+                async with db_client_async() as db:
+                    existents = await sensors_existents(db, sensor_ids_candidats(lot))
+                    files, resultats = validar_lectures(lot, existents)
+                    await desar_lectures(db, files)
+                break
+            except (pymysql.err.MySQLError, OSError) as e:
+                logger.warning("Flush de %d lectures fallit (intent %d): %s", len(lot), intent, e)
+                if intent == BUFFER_REINTENTS:
+                    self._perdudes += len(lot)
+                    return
+                await asyncio.sleep(0.2 * intent)
+
+        # POST /lectures/ ja ha comprovat el sensor: si no hi és, s'ha esborrat mentrestant
+        sense_sensor = [lot[r["index"]]["sensor_id"] for r in resultats if r["error"] == "sensor no existeix"]
+        if sense_sensor:
+            logger.warning("Descartades %d lectures de sensors que ja no existeixen: %s",
+                           len(sense_sensor), sorted(set(sense_sensor)))
+            self._sense_sensor += len(sense_sensor)
+
+        durada = time.perf_counter() - inici
+        self._flushes += 1
+        self._desades += len(files)
+        self._invalides += len(lot) - len(files)
+        self._ultim_lot = len(lot)
+        self._lot_max = max(self._lot_max, len(lot))
+        self._ultim_flush = durada
+        self._flush_total += durada
+        self._flush_max = max(self._flush_max, durada)
+
+    def ocupacio(self):
+        # Fracció de la capacitat ocupada (0 si el buffer no està actiu)
+        return self._cua.qsize() / self.capacitat if self._cua else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "actiu": self._tasca is not None and not self._aturant,
+            "pendents": self._cua.qsize() if self._cua else 0,
+            "capacitat": self.capacitat,
+            "rebudes": self._rebudes,
+            "rebutjades_ple": self._rebutjades_ple,
+            "desades": self._desades,
+            "invalides": self._invalides,
+            "sense_sensor": self._sense_sensor,
+            "perdudes": self._perdudes,
+            "flushes": self._flushes,
+            "lot_ultim": self._ultim_lot,
+            "lot_mitja": (self._desades + self._invalides) / self._flushes if self._flushes else 0.0,
+            "lot_max": self._lot_max,
+            "flush_ultim_ms": self._ultim_flush * 1000,
+            "flush_mitja_ms": (self._flush_total / self._flushes * 1000) if self._flushes else 0.0,
+            "flush_max_ms": self._flush_max * 1000,
+        }
+
+
+buffer_ingesta = BufferIngesta()
@@ -0,0 +1,257 @@
+# Últimes lectures de cada sensor en memòria (ring buffer per sensor)
+import os
+import threading
+import time
+from array import array
+from bisect import insort
+from collections import OrderedDict
+from datetime import datetime
+
+import aiomysql
+
+import repositori
+from client_async import db_client_async
+
+RECENTS_N = int(os.environ.get("ECOSENSE_RECENTS_N", "10"))
+RECENTS_MAX_BYTES = int(os.environ.get("ECOSENSE_RECENTS_MAX_BYTES", str(16 * 1024 * 1024)))
+RECENTS_INACTIU = float(os.environ.get("ECOSENSE_RECENTS_INACTIU", "3600"))
+RECENTS_INTERVAL_NETEJA = 60
+# Sensors per consulta en escalfar
+RECENTS_LOT = 500
+
+# Les últimes n de cada sensor del lot en una consulta (MySQL 8 i SQLite 3.25)
+QUERY_RECENTS_LOT = """
+SELECT sensor_id, valor, timestamp FROM (
+    SELECT sensor_id, valor, timestamp,
+           ROW_NUMBER() OVER (PARTITION BY sensor_id ORDER BY timestamp DESC) AS ordre
+    FROM humitat_sol
+    WHERE sensor_id IN ({})
+) recents
+WHERE ordre <= %s
+ORDER BY sensor_id, timestamp DESC
+"""
+
+
+class RingBuffer:
+    # Dos arrays de doubles (valor, timestamp epoch) i un índex circular
+    __slots__ = ("valors", "temps", "inici", "mida", "capacitat")
+
+    def __init__(self, capacitat):
+        self.valors = array("d", bytes(8 * capacitat))
+        self.temps = array("d", bytes(8 * capacitat))
+        self.inici = 0
+        self.mida = 0
+        self.capacitat = capacitat
+
+    def _push(self, ts, valor):
+        pos = (self.inici + self.mida) % self.capacitat
+        self.valors[pos] = valor
+        self.temps[pos] = ts
+        if self.mida < self.capacitat:
+            self.mida += 1
+        else:
+            self.inici = (self.inici + 1) % self.capacitat
+
+    def afegir(self, ts, valor):
+        if self.mida == 0 or ts >= self.temps[(self.inici + self.mida - 1) % self.capacitat]:
+            self._push(ts, valor)
+            return
+        # Lectura fora d'ordre: es reconstrueix ordenada (cas poc freqüent)
+        if self.mida == self.capacitat and ts < self.temps[self.inici]:
+            return
+        ordenades = self.ordenades()
+        insort(ordenades, (ts, valor))
+        self.inici = 0
+        self.mida = 0
+        for t, v in ordenades[-self.capacitat:]:
+            self._push(t, v)
+
+    def ordenades(self):
+        # De la més antiga a la més recent
+        return [
+            (self.temps[(self.inici + i) % self.capacitat], self.valors[(self.inici + i) % self.capacitat])
+            for i in range(self.mida)
+        ]
+
+    def ultimes(self, n=None):
+        # De la més recent a la més antiga, com ORDER BY timestamp DESC
+        n = self.mida if n is None else min(n, self.mida)
+        resultat = []
+        for i in range(1, n + 1):
+            pos = (self.inici + self.mida - i) % self.capacitat
+            resultat.append({"valor": self.valors[pos], "timestamp": datetime.fromtimestamp(self.temps[pos])})
+        return resultat
+
+    @staticmethod
+    def bytes_per_sensor(capacitat):
+        return 2 * (64 + 8 * capacitat) + 120
+
+
+class LecturesRecents:
+    def __init__(self, n=RECENTS_N, max_bytes=RECENTS_MAX_BYTES, inactiu=RECENTS_INACTIU):
+        self.n = n
+        self.inactiu = inactiu
+        self.max_sensors = max(1, max_bytes // RingBuffer.bytes_per_sensor(n))
+        self._buffers = OrderedDict()
+        self._ultim_us = {}
+        # Sensors que s'estan carregant: lectures desades mentre es consulta la base de dades
+        self._pendents = {}
+        self._lock = threading.Lock()
+        self._ultima_neteja = time.monotonic()
+
+        self._encerts = 0
+        self._errades = 0
+        self._expulsats = 0
+
+    def _tocar(self, sensor_id, ara):
+        self._buffers.move_to_end(sensor_id)
+        self._ultim_us[sensor_id] = ara
+
+    def _netejar_inactius(self, ara):
+        if ara - self._ultima_neteja < RECENTS_INTERVAL_NETEJA:
+            return
+        self._ultima_neteja = ara
+        # L'OrderedDict està ordenat per ús: els inactius són al principi
+        while self._buffers:
+            sensor_id = next(iter(self._buffers))
+            if ara - self._ultim_us[sensor_id] <= self.inactiu:
+                break
+            self._expulsar(sensor_id)
+
+    def _expulsar(self, sensor_id):
+        self._buffers.pop(sensor_id, None)
+        self._ultim_us.pop(sensor_id, None)
+        self._expulsats += 1
+
+    def reservar(self, sensor_ids):
+        # Abans de consultar l'historial: el que es desi mentrestant es guarda per a carregar
+        with self._lock:
+            for sensor_id in sensor_ids:
+                if sensor_id not in self._buffers:
+                    self._pendents.setdefault(sensor_id, [])
+
+    def abandonar(self, sensor_ids):
+        with self._lock:
+            for sensor_id in sensor_ids:
+                self._pendents.pop(sensor_id, None)
+
+    def carregar(self, sensor_id, files):
+        # files: (valor, timestamp) en ordre ORDER BY timestamp DESC, com surten de repositori.LECTURES_RECENTS
+        ara = time.monotonic()
+        with self._lock:
+            pendents = self._pendents.pop(sensor_id, ())
+            if sensor_id in self._buffers:
+                # Carregat per una altra petició, que ja rep les lectures noves
+                self._tocar(sensor_id, ara)
+                return
+            ring = RingBuffer(self.n)
+            vistes = set()
+            for valor, ts in reversed(files):
+                lectura = (ts.timestamp(), float(valor))
+                vistes.add(lectura)
+                ring.afegir(*lectura)
+            # Les desades després de reservar que la consulta no ha vist (o ja hi són)
+            for lectura in pendents:
+                if lectura not in vistes:
+                    ring.afegir(*lectura)
+            self._buffers[sensor_id] = ring
+            self._tocar(sensor_id, ara)
+            while len(self._buffers) > self.max_sensors:
+                self._expulsar(next(iter(self._buffers)))
+
+    def lectures(self, sensor_id, n=None):
+        # None si el sensor no és en memòria (cal anar a la base de dades)
+        ara = time.monotonic()
+        with self._lock:
+            self._netejar_inactius(ara)
+            ring = self._buffers.get(sensor_id)
+            if ring is None:
+                self._errades += 1
+                return None
+            self._encerts += 1
+            self._tocar(sensor_id, ara)
+            return ring.ultimes(n)
+
+    def registrar(self, files):
+        # files: (sensor_id, valor, timestamp) acabades de desar a humitat_sol.
+        # Només s'actualitzen els sensors que ja són en memòria amb l'historial complet
+        # i els que s'estan carregant.
+        ara = time.monotonic()
+        with self._lock:
+            for sensor_id, valor, ts in files:
+                ring = self._buffers.get(sensor_id)
+                if ring is not None:
+                    ring.afegir(ts.timestamp(), float(valor))
+                    self._tocar(sensor_id, ara)
+                elif sensor_id in self._pendents:
+                    self._pendents[sensor_id].append((ts.timestamp(), float(valor)))
+
+    def descartar(self, sensor_id):
+        with self._lock:
+            self._buffers.pop(sensor_id, None)
+            self._ultim_us.pop(sensor_id, None)
+
+    def conservar(self, sensor_ids):
+        # Descarta els sensors que ja no existeixen (eliminats des d'un altre worker)
+        with self._lock:
+            for sensor_id in [s for s in self._buffers if s not in sensor_ids]:
+                self._buffers.pop(sensor_id, None)
+                self._ultim_us.pop(sensor_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sensors": len(self._buffers),
+                "max_sensors": self.max_sensors,
+                "lectures_per_sensor": self.n,
+                "bytes_aprox": len(self._buffers) * RingBuffer.bytes_per_sensor(self.n),
+                "encerts": self._encerts,
+                "errades": self._errades,
+                "expulsats": self._expulsats,
+            }
+
+
+recents = LecturesRecents()
+
+
+async def _carregar_lot(cursor, sensor_ids):
+    await cursor.execute(QUERY_RECENTS_LOT.format(", ".join(["%s"] * len(sensor_ids))), (*sensor_ids, recents.n))
+    per_sensor = {sensor_id: [] for sensor_id in sensor_ids}
+    for sensor_id, valor, ts in await cursor.fetchall():
+        per_sensor[sensor_id].append((valor, ts))
+    for sensor_id, files in per_sensor.items():
+        recents.carregar(sensor_id, files)
+
+
+async def escalfar_recents():
+    async with db_client_async() as db:
+        sensor_ids = [sensor_id for (sensor_id,) in await repositori.consultar(
+            db, repositori.IDS_SENSORS, (recents.max_sensors,))]
+        cursor = await db.cursor(aiomysql.Cursor)
+        try:
+            for inici in range(0, len(sensor_ids), RECENTS_LOT):
+                lot = sensor_ids[inici:inici + RECENTS_LOT]
+                recents.reservar(lot)
+                try:
+                    await _carregar_lot(cursor, lot)
+                finally:
+                    recents.abandonar(lot)
+        finally:
+            await cursor.close()
+
+
+async def obtenir_recents(sensor_id, n=None):
+    # Llista de lectures (més recent primer) o None si el sensor no existeix
+    lectures = recents.lectures(sensor_id, n)
+    if lectures is not None:
+        return lectures
+    # Es reserva abans de la primera consulta, que fixa la instantània de la transacció
+    recents.reservar([sensor_id])
+    try:
+        async with db_client_async() as db:
+            if not await repositori.consultar_una(db, repositori.SENSOR_EXISTEIX, (sensor_id,)):
+                return None
+            recents.carregar(sensor_id, await repositori.consultar(db, repositori.LECTURES_RECENTS, (sensor_id, recents.n)))
+    finally:
+        recents.abandonar([sensor_id])
+    return recents.lectures(sensor_id, n)
@@ -1,23 +1,90 @@
-from typing import List, Optional, Dict
+from arrencada import arrencada
+from typing import Any, List, Optional, Dict
 from collections import defaultdict
-from fastapi import FastAPI, HTTPException
-import mysql.connector
+from fastapi import Body, FastAPI, HTTPException, Query, Request, Response, WebSocket
+from fastapi.responses import JSONResponse, StreamingResponse
+import pymysql
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
-from client import db_client
+from client import pool_stats, PoolExhaurit
+from client_async import db_client_async, escalfar_pool, obrir_pool, preparar_esquema, tancar_pool, pool_async_stats
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from starlette.concurrency import run_in_threadpool
+from exportacio import FORMATS, exportar_lectures
+from rollups import obtenir_agregats
+from metriques import MetriquesMiddleware, metriques, registrar_estat
+import versions
+import referencia
+import repositori
+from preparades import preparades_stats
+from serialitzacio import resposta_llista
+from imatges import DIR_VARIANTS, MIDES, StaticImmutable, preparar_variants, url_imatge
+from contrasenyes import ContrasenyesOcupat, aturar_contrasenyes, contrasenyes_stats, escalfar_contrasenyes, hash_contrasenya, iniciar_contrasenyes, verificar_contrasenya
+from paginacio import LECTURES_LIMIT_MAX, CursorInvalid, codificar_cursor, decodificar_cursor
+from lectures_recents import escalfar_recents, obtenir_recents, recents
+from estadistiques import ALERTA_HUMITAT_MIN, avaluador
+from prediccio import calcular_previsio, memoria_prediccions
+from directe import MassaSubscriptors, directe, events_sse, missatge_lectura, servir_websocket
+from admissio import LimitIngesta, admissio
+from coherencia import coherencia
+from ingesta import LECTURES_BATCH_MAX, BufferPle, buffer_ingesta, desar_lectures, sensor_existeix, sensor_ids_candidats, sensors_existents, validar_lectures
 from fastapi.staticfiles import StaticFiles
+from starlette.routing import Mount
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr, field_validator
 import re
-
-app = FastAPI()
+import os
+
+async def escalfar_static():
+    # StaticFiles comprova el directori amb la primera petició; aquí es fa abans i es
+    # recorren els fitxers perquè el sistema ja en tingui les entrades a memòria
+    for ruta in app.routes:
+        if isinstance(ruta, Mount) and isinstance(ruta.app, StaticFiles):
+            await ruta.app.check_config()
+            ruta.app.config_checked = True
+            await run_in_threadpool(lambda directori: sum(len(fitxers) for _, _, fitxers in os.walk(directori)),
+                                    ruta.app.directory)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with arrencada.mesurar("contrasenyes"):
+        iniciar_contrasenyes()
+    with arrencada.mesurar("variants"):
+        await run_in_threadpool(preparar_variants)
+    await buffer_ingesta.iniciar()
+    await avaluador.iniciar()
+    coherencia.iniciar()
+    # La resta en segon pla: /ready torna 503 fins que acaba. Primer el que no necessita
+    # la base de dades, que pot no respondre encara (les fases es reintenten)
+    arrencada.escalfar([
+        ("bcrypt", escalfar_contrasenyes),
+        ("static", escalfar_static),
+        ("pool", obrir_pool),
+        ("esquema", preparar_esquema),
+        ("connexions", escalfar_pool),
+        ("coherencia", coherencia.sondejar),
+        ("referencia", referencia.carregar_referencia),
+        ("recents", escalfar_recents),
+    ])
+    yield
+    await arrencada.aturar()
+    await coherencia.aturar()
+    await avaluador.aturar()
+    directe.tancar_tots()
+    await buffer_ingesta.aturar()
+    await tancar_pool()
+    aturar_contrasenyes()
+
+app = FastAPI(lifespan=lifespan)
 #BASE_URL = "http://192.168.5.206:8000"
 #BASE_URL = "http://192.168.17.240:8000
 BASE_URL = "http://18.213.199.248:8000"
+# Variants amb hash al nom: s'ha de muntar abans de /static
+os.makedirs(DIR_VARIANTS, exist_ok=True)
+app.mount("/static/v", StaticImmutable(directory=DIR_VARIANTS), name="static-variants")
 app.mount("/static", StaticFiles(directory="static"), name="static")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,7 +92,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(MetriquesMiddleware)
+
+registrar_estat({
+    "arrencada": arrencada.stats,
+    "pool_async": pool_async_stats,
+    "pool_sync": pool_stats,
+    "preparades": preparades_stats,
+    "contrasenyes": contrasenyes_stats,
+    "recents": lambda: recents.stats(),
+    "ingesta": lambda: buffer_ingesta.stats(),
+    "directe": lambda: directe.stats(),
+    "estadistiques": lambda: avaluador.stats(),
+    "prediccions": lambda: memoria_prediccions.stats(),
+    "coherencia": lambda: coherencia.stats(),
+    "admissio": lambda: admissio.stats(per_estat=False),
+})
+
+@app.exception_handler(PoolExhaurit)
+def pool_exhaurit_handler(request: Request, exc: PoolExhaurit):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(ContrasenyesOcupat)
+def contrasenyes_ocupat_handler(request: Request, exc: ContrasenyesOcupat):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(MassaSubscriptors)
+def massa_subscriptors_handler(request: Request, exc: MassaSubscriptors):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+@app.exception_handler(BufferPle)
+def buffer_ple_handler(request: Request, exc: BufferPle):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(LimitIngesta)
+def limit_ingesta_handler(request: Request, exc: LimitIngesta):
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(exc.reintent)})
+
+# Mida de la imatge de les plantes: thumb, medium o original (sense paràmetre, la URL de sempre)
+MIDA_IMATGE = Query(None, pattern="^(" + "|".join(MIDES) + ")$")
 
 # Models
 class Usuari(BaseModel):
@@ -101,7 +208,25 @@ class PlantaCreate(BaseModel):
 class LecturaCreate(BaseModel):
     sensor_id: int
     valor: float
+    timestamp: Optional[datetime] = None
+
+class LecturaBatchResultat(BaseModel):
+    index: int
+    acceptada: bool
+    error: Optional[str] = None
+
+class LecturaBatchResponse(BaseModel):
+    acceptades: int
+    rebutjades: int
+    resultats: List[LecturaBatchResultat]
     
+class Agregat(BaseModel):
+    inici: datetime
+    min: float
+    max: float
+    avg: float
+    count: int
+
 class HumitatResponse(BaseModel):
     id: Optional[int] = None
     valor: Optional[float] = None
@@ -127,495 +252,702 @@ class LoginResponse(BaseModel):
 
 # Endpoints
 @app.get("/")
-def read_root():
+async def read_root():
     return {"ECOSENSE API"}
 
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    # Per al balancejador: 503 mentre el worker s'escalfa o s'atura
+    return JSONResponse(arrencada.stats(), status_code=200 if arrencada.preparat else 503)
+
+@app.get("/estat/pool")
+async def estat_pool():
+    return {"async": pool_async_stats(), "sync": pool_stats(), "preparades": preparades_stats()}
+
+@app.get("/estat/contrasenyes")
+async def estat_contrasenyes():
+    return contrasenyes_stats()
+
+@app.get("/estat/recents")
+async def estat_recents():
+    return recents.stats()
+
+@app.get("/estat/ingesta")
+async def estat_ingesta():
+    return buffer_ingesta.stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    cos, content_type = metriques()
+    return Response(content=cos, media_type=content_type)
+
+@app.get("/estat/directe")
+async def estat_directe():
+    return directe.stats()
+
+@app.get("/estat/estadistiques")
+async def estat_estadistiques():
+    return avaluador.stats()
+
+@app.get("/estat/admissio")
+async def estat_admissio():
+    return admissio.stats()
+
+@app.get("/estat/coherencia")
+async def estat_coherencia():
+    # Amb el pid: cada worker respon per la seva memòria
+    return {"pid": os.getpid(), **coherencia.stats()}
+
 # Usuarios Endpoints
 
 @app.get("/usuaris/", response_model=List[Usuari])
-def listar_usuaris():
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT id, nom, cognom, email FROM usuaris")
-        return cursor.fetchall()
-    finally:
-        cursor.close()
-        db.close()
+async def listar_usuaris(request: Request, response: Response):
+    if (no_modificat := versions.condicional(request, response, "usuaris")) is not None:
+        return no_modificat
+    async with db_client_async() as db:
+        return await repositori.consultar(db, repositori.USUARIS)
 
 @app.get("/usuaris/{usuari_id}", response_model=Usuari)
-def obtenir_usuari(usuari_id: int):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT id, nom, cognom, email FROM usuaris WHERE id = %s", (usuari_id,))
-        usuari = cursor.fetchone()
-        if not usuari:
+async def obtenir_usuari(usuari_id: int):
+    async with db_client_async() as db:
+        usuari = await repositori.consultar_una(db, repositori.USUARI_PER_ID, (usuari_id,))
+    if not usuari:
+        raise HTTPException(status_code=404, detail="Usuari no trobat")
+    return usuari
+
+class PlantaDashboard(Planta):
+    sensor_estat: Optional[str] = None
+    humitat_valor: Optional[float] = None
+    humitat_timestamp: Optional[datetime] = None
+
+class ZonaDashboard(BaseModel):
+    zona: str
+    plantas: List[PlantaDashboard]
+
+class DashboardResponse(BaseModel):
+    usuari_id: int
+    zones: List[ZonaDashboard]
+
+@app.get("/usuaris/{usuari_id}/dashboard", response_model=DashboardResponse)
+async def obtenir_dashboard(usuari_id: int, mida: Optional[str] = MIDA_IMATGE):
+    # Tot el que mostra la pantalla d'inici en una petició: plantes per zones, estat del
+    # sensor i última humitat. Consultes per conjunts, no una per planta.
+    async with db_client_async() as db:
+        if not await repositori.consultar_una(db, repositori.USUARI_EXISTEIX, (usuari_id,)):
             raise HTTPException(status_code=404, detail="Usuari no trobat")
-        return usuari
-    finally:
-        cursor.close()
-        db.close()
+
+        plantas = await repositori.consultar(db, repositori.PLANTES_DASHBOARD, (usuari_id,))
+
+        # Última humitat: del ring buffer, i la resta en una sola consulta
+        ultimes = {}
+        pendents = set()
+        for planta in plantas:
+            if planta.sensor_estat is None:
+                continue
+            lectures = recents.lectures(planta.sensor_id, 1)
+            if lectures is None:
+                pendents.add(planta.sensor_id)
+            elif lectures:
+                ultimes[planta.sensor_id] = lectures[0]
+
+        if pendents:
+            marcadors = ", ".join(["%s"] * len(pendents))
+            files = await repositori.consultar_sql(db, f"""
+                SELECT h.sensor_id, h.valor, h.timestamp
+                FROM humitat_sol h
+                JOIN (
+                    SELECT sensor_id, MAX(timestamp) AS timestamp
+                    FROM humitat_sol
+                    WHERE sensor_id IN ({marcadors})
+                    GROUP BY sensor_id
+                ) u ON h.sensor_id = u.sensor_id AND h.timestamp = u.timestamp
+            """, tuple(pendents), repositori.FilaUltimaLectura)
+            for fila in files:
+                ultimes[fila.sensor_id] = {"valor": fila.valor, "timestamp": fila.timestamp}
+
+    plantas_por_zona = defaultdict(list)
+    for planta in plantas:
+        if not planta.imagen_url:
+            planta.imagen_url = url_imatge(BASE_URL, planta.nom, mida)
+        ultima = ultimes.get(planta.sensor_id)
+        planta.humitat_valor = ultima['valor'] if ultima else None
+        planta.humitat_timestamp = ultima['timestamp'] if ultima else None
+        plantas_por_zona[planta.ubicacio].append(planta)
+
+    return {
+        "usuari_id": usuari_id,
+        "zones": [{"zona": zona, "plantas": plantas} for zona, plantas in plantas_por_zona.items()]
+    }
+
+class PrevisioPlanta(BaseModel):
+    planta_id: int
+    nom: str
+    ubicacio: str
+    sensor_id: Optional[int] = None
+    humitat_actual: Optional[float] = None
+    assecat_per_hora: Optional[float] = None
+    moment_previst: Optional[datetime] = None
+    hores_fins_llindar: Optional[float] = None
+    lectures: int = 0
+
+class PrevisioResponse(BaseModel):
+    usuari_id: int
+    llindar: float
+    calculat: datetime
+    plantes: List[PrevisioPlanta]
+
+@app.get("/usuaris/{usuari_id}/forecast", response_model=PrevisioResponse)
+async def obtenir_previsio(usuari_id: int, llindar: float = Query(ALERTA_HUMITAT_MIN, ge=0, le=100)):
+    # Quan baixarà cada planta per sota del llindar segons el ritme d'assecat recent.
+    # Es recalcula només quan arriben lectures noves dels sensors de l'usuari.
+    previsio = memoria_prediccions.obtenir(usuari_id, llindar)
+    if previsio is None:
+        async with db_client_async() as db:
+            if not await repositori.consultar_una(db, repositori.USUARI_EXISTEIX, (usuari_id,)):
+                raise HTTPException(status_code=404, detail="Usuari no trobat")
+            plantes = await repositori.consultar(db, repositori.PLANTES_PER_USUARI, (usuari_id,))
+            previsio = await calcular_previsio(db, usuari_id, plantes, llindar)
+
+    calculat, plantes = previsio
+    ara = datetime.now()
+    return {
+        "usuari_id": usuari_id,
+        "llindar": llindar,
+        "calculat": calculat,
+        "plantes": [
+            dict(p, hores_fins_llindar=max(0.0, (p["moment_previst"] - ara).total_seconds() / 3600)
+                 if p["moment_previst"] else None)
+            for p in plantes
+        ],
+    }
 
 @app.post("/usuaris/login", response_model=LoginResponse)
-def login_usuario(login_data: dict):
-    db = db_client()
-    cursor = db.cursor(dictionary=True)
+async def login_usuario(login_data: dict):
+    # La connexió només es té durant les consultes: bcrypt s'executa al pool de contrasenyes
+    email = login_data.get("email")
+    contrasenya_plana = login_data.get("contrasenya")
+
+    if not email or not contrasenya_plana:
+        return {"success": False, "message": "Email y contraseña son requeridos"}
+
     try:
-        email = login_data.get("email")
-        contrasenya_plana = login_data.get("contrasenya")
-        
-        if not email or not contrasenya_plana:
-            return {"success": False, "message": "Email y contraseña son requeridos"}
-        
-        cursor.execute("""SELECT id, nom, cognom, email, contrasenya FROM usuaris WHERE email = %s""", (email,))
-        usuario = cursor.fetchone()
-    
+        async with db_client_async() as db:
+            usuario = await repositori.consultar_una(db, repositori.USUARI_PER_EMAIL, (email,))
+
         if not usuario:
             return {"success": False, "message": "Usuario no encontrado"}
-        
+
         # Intento 1: Verificar con contraseña hasheada
         try:
-            if pwd_context.verify(contrasenya_plana, usuario['contrasenya']):
-                return {"success": True, "usuari_id": usuario['id'], "nom": usuario['nom'], "email": usuario['email'] }
+            if await verificar_contrasenya(contrasenya_plana, usuario.contrasenya):
+                return {"success": True, "usuari_id": usuario.id, "nom": usuario.nom, "email": usuario.email }
         except ValueError:
             pass
-        
+
         # Intento 2: Comparación directa para contraseñas antiguas sin hash
-        if contrasenya_plana == usuario['contrasenya']:
+        if contrasenya_plana == usuario.contrasenya:
             # Actualizar la contraseña a formato hasheado
-            hashed_password = pwd_context.hash(contrasenya_plana)
-            cursor.execute("""UPDATE usuaris SET contrasenya = %s WHERE id = %s""", (hashed_password, usuario['id']))
-            db.commit()
-            
-            return { "success": True, "usuari_id": usuario['id'], "nom": usuario['nom'], "email": usuario['email'] }
-        
+            hashed_password = await hash_contrasenya(contrasenya_plana)
+            async with db_client_async() as db:
+                await repositori.executar(db, repositori.CANVIAR_CONTRASENYA, (hashed_password, usuario.id))
+                await db.commit()
+
+            return { "success": True, "usuari_id": usuario.id, "nom": usuario.nom, "email": usuario.email }
+
         # Si ambos intentos fallan
         return { "success": False, "message": "Contrasenya incorrecta" }
-        
-    except mysql.connector.Error as err:
+
+    except pymysql.err.MySQLError as err:
         return {"success": False, "message": f"Error de base de datos: {str(err)}" }
-    finally:
-        cursor.close()
-        db.close()
 
 @app.post("/usuaris/registre", response_model=RegistreResponse)
-def registrar_usuari(usuari: UsuariCreate):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
+async def registrar_usuari(usuari: UsuariCreate):
     try:
-        cursor.execute("SELECT id FROM usuaris WHERE email = %s", (usuari.email,))
-        if cursor.fetchone():
+        async with db_client_async() as db:
+            existeix = await repositori.consultar_una(db, repositori.EMAIL_EXISTEIX, (usuari.email,))
+        if existeix:
             return {"success": False, "message": "El correu ja existeix"}
 
-        hashed_password = pwd_context.hash(usuari.contrasenya)
+        hashed_password = await hash_contrasenya(usuari.contrasenya)
+
+        async with db_client_async() as db:
+            _, user_id = await repositori.executar(
+                db, repositori.CREAR_USUARI, (usuari.nom, usuari.cognom, usuari.email, hashed_password))
+            await versions.confirmar(db, "usuaris")
 
-        query = """INSERT INTO usuaris (nom, cognom, email, contrasenya) VALUES (%s, %s, %s, %s)"""
-        cursor.execute(query, ( usuari.nom, usuari.cognom, usuari.email, hashed_password))
-        db.commit()
-        
-        user_id = cursor.lastrowid
-        
         return {"success": True, "message": "Usuari registrat amb éxit", "usuari_id": user_id, "nom": usuari.nom, "email": usuari.email }
-        
-    except mysql.connector.Error as err:
-        db.rollback()
+
+    except pymysql.err.MySQLError as err:
         return {"success": False, "message": f"Error de base de datos: {str(err)}" }
-    finally:
-        cursor.close()
-        db.close()
 
 # Sensores Endpoints
 @app.post("/sensors/", response_model=Sensor)
-def crear_sensor(sensor: SensorCreate):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
-    try:
-        query = """
-        INSERT INTO sensors (sensor_id, estat, usuari_id)
-        VALUES (%s, %s, %s)
-        """
-        cursor.execute(query, (sensor.sensor_id, sensor.estat, sensor.usuari_id))
-        db.commit()
-        cursor.execute("SELECT * FROM sensors WHERE sensor_id = %s", (sensor.sensor_id,))
-        return cursor.fetchone()
-    except mysql.connector.Error as err:
-        raise HTTPException(status_code=400, detail=str(err))
-    finally:
-        cursor.close()
-        db.close()
+async def crear_sensor(sensor: SensorCreate):
+    async with db_client_async() as db:
+        try:
+            await repositori.executar(db, repositori.CREAR_SENSOR, (sensor.sensor_id, sensor.estat, sensor.usuari_id))
+            await versions.confirmar(db, "sensors")
+            return await repositori.consultar_una(db, repositori.SENSOR_PER_ID, (sensor.sensor_id,))
+        except pymysql.err.MySQLError as err:
+            raise HTTPException(status_code=400, detail=str(err))
 
 @app.get("/sensors/{sensor_id}", response_model=Sensor)
-def get_sensor_data(sensor_id: int):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT * FROM sensors WHERE sensor_id = %s", (sensor_id,))
-        sensor = cursor.fetchone()
-        if not sensor:
-            raise HTTPException(status_code=404, detail="Sensor no encontrado")
-        return sensor
-    finally:
-        cursor.close()
-        db.close()
+async def get_sensor_data(sensor_id: int):
+    async with db_client_async() as db:
+        sensor = await repositori.consultar_una(db, repositori.SENSOR_PER_ID, (sensor_id,))
+    if not sensor:
+        raise HTTPException(status_code=404, detail="Sensor no encontrado")
+    return sensor
 
 @app.get("/sensors/")
-def get_sensors():
-    db = db_client()
-    if isinstance(db, dict):  # Si hay error
-        raise HTTPException(status_code=500, detail=db["message"])
-        
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT * FROM sensors")
-        return cursor.fetchall()
-    finally:
-        cursor.close()
-        db.close()
+async def get_sensors(request: Request, response: Response):
+    if (no_modificat := versions.condicional(request, response, "sensors")) is not None:
+        return no_modificat
+    sensors = await referencia.sensors.files()
+    return resposta_llista(sensors, response)
 
 @app.put("/sensors/{sensor_id}", response_model=Sensor)
-def actualitzar_sensor(sensor_id: int, sensor: SensorCreate):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
-    try:
-        query = """
-        UPDATE sensors 
-        SET estat = %s, usuari_id = %s 
-        WHERE sensor_id = %s
-        """
-        cursor.execute(query, (sensor.estat, sensor.usuari_id, sensor_id))
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Sensor no encontrado")
-        db.commit()
-        cursor.execute("SELECT * FROM sensors WHERE sensor_id = %s", (sensor_id,))
-        return cursor.fetchone()
-    except mysql.connector.Error as err:
-        raise HTTPException(status_code=400, detail=str(err))
-    finally:
-        cursor.close()
-        db.close()
+async def actualitzar_sensor(sensor_id: int, sensor: SensorCreate):
+    async with db_client_async() as db:
+        try:
+            afectades, _ = await repositori.executar(
+                db, repositori.ACTUALITZAR_SENSOR, (sensor.estat, sensor.usuari_id, sensor_id))
+            if afectades == 0:
+                raise HTTPException(status_code=404, detail="Sensor no encontrado")
+            await versions.confirmar(db, "sensors")
+            return await repositori.consultar_una(db, repositori.SENSOR_PER_ID, (sensor_id,))
+        except pymysql.err.MySQLError as err:
+            raise HTTPException(status_code=400, detail=str(err))
+
+# Lectures esborrades per transacció en eliminar un sensor: cap DELETE llarg bloqueja l'ingesta
+ESBORRAR_LOT = 10000
+
+async def esborrar_lectures_sensor(db, sensor_id):
+    while True:
+        ids = [fila[0] for fila in await repositori.consultar(
+            db, repositori.IDS_LECTURES_SENSOR, (sensor_id, ESBORRAR_LOT))]
+        if ids:
+            marcadors = ", ".join(["%s"] * len(ids))
+            await repositori.executar_sql(db, f"DELETE FROM humitat_sol WHERE id IN ({marcadors})", ids)
+        await db.commit()
+        if len(ids) < ESBORRAR_LOT:
+            return
 
 @app.delete("/sensors/{sensor_id}")
-def eliminar_sensor(sensor_id: int):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
+async def eliminar_sensor(sensor_id: int):
+    async with db_client_async() as db:
+        try:
+            if not await repositori.consultar_una(db, repositori.SENSOR_PER_ID, (sensor_id,)):
+                raise HTTPException(status_code=404, detail="Sensor no encontrado")
+            # Les que arribin mentrestant les esborra la FK (sense particionar) o la retenció
+            await esborrar_lectures_sensor(db, sensor_id)
+            await repositori.executar(db, repositori.ELIMINAR_ROLLUPS_SENSOR, (sensor_id,))
+            afectades, _ = await repositori.executar(db, repositori.ELIMINAR_SENSOR, (sensor_id,))
+            if afectades == 0:
+                raise HTTPException(status_code=404, detail="Sensor no encontrado")
+            await versions.confirmar(db, "sensors", "plantes")
+            recents.descartar(sensor_id)
+            return {"message": "Sensor eliminat correctament"}
+        except pymysql.err.MySQLError as err:
+            raise HTTPException(status_code=400, detail=str(err))
+
+async def lectura_inicial(sensor_id):
+    # Última lectura coneguda per enviar-la en connectar; None si el sensor no existeix
+    lectures = await obtenir_recents(sensor_id, 1)
+    if lectures is None:
+        return None
+    return missatge_lectura(sensor_id, lectures[0]["valor"], lectures[0]["timestamp"]) if lectures else ""
+
+@app.get("/sensors/{sensor_id}/live")
+async def lectures_en_directe(sensor_id: int):
+    inicial = await lectura_inicial(sensor_id)
+    if inicial is None:
+        raise HTTPException(status_code=404, detail="Sensor no encontrado")
+    directe.comprovar()
+    return StreamingResponse(
+        events_sse(sensor_id, inicial or None),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/sensors/{sensor_id}/live")
+async def lectures_en_directe_ws(websocket: WebSocket, sensor_id: int):
+    inicial = await lectura_inicial(sensor_id)
+    if inicial is None:
+        await websocket.close(code=1008)
+        return
     try:
-        cursor.execute("DELETE FROM sensors WHERE sensor_id = %s", (sensor_id,))
-        if cursor.rowcount == 0:
+        directe.comprovar()
+    except MassaSubscriptors:
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+    await servir_websocket(websocket, sensor_id, inicial or None)
+
+class EstadistiquesSensor(BaseModel):
+    sensor_id: int
+    lectures: int = 0
+    ultim_valor: Optional[float] = None
+    ultim_timestamp: Optional[datetime] = None
+    mitjana: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    canvi_per_hora: Optional[float] = None
+    segons_des_de_ultima: Optional[float] = None
+    necessita_aigua: bool = False
+    silencios: bool = False
+
+class Alerta(BaseModel):
+    tipus: str
+    sensor_id: int
+    moment: datetime
+    valor: Optional[float] = None
+
+@app.get("/sensors/{sensor_id}/estadistiques", response_model=EstadistiquesSensor)
+async def estadistiques_sensor(sensor_id: int):
+    # Estat en memòria de les últimes lectures; no consulta humitat_sol
+    estat = avaluador.estat(sensor_id)
+    if estat is not None:
+        return estat
+    async with db_client_async() as db:
+        if not await repositori.consultar_una(db, repositori.SENSOR_PER_ID, (sensor_id,)):
             raise HTTPException(status_code=404, detail="Sensor no encontrado")
-        db.commit()
-        return {"message": "Sensor eliminat correctament"}
-    except mysql.connector.Error as err:
-        raise HTTPException(status_code=400, detail=str(err))
-    finally:
-        cursor.close()
-        db.close()
+    return {"sensor_id": sensor_id}
+
+@app.get("/alertes", response_model=List[Alerta])
+async def llistar_alertes(sensor_id: Optional[int] = None, limit: int = Query(100, ge=1, le=1000)):
+    return avaluador.alertes(sensor_id, limit)
 
 # Lecturas Endpoints
 
+def data_filtre(valor, nom):
+    # Es passa com a datetime i no com a text: SQLite compara el text tal com ve
+    # ("2024-06-01T00:00" no s'ordena com el "2024-06-01 00:00:00" desat)
+    if not valor:
+        return None
+    try:
+        data = datetime.fromisoformat(valor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{nom} no té format ISO 8601")
+    if data.tzinfo is not None:
+        data = data.astimezone().replace(tzinfo=None)
+    return data
+
+def filtres_lectures(sensor_id, start_date, end_date):
+    conditions = []
+    params = []
+    start_date = data_filtre(start_date, "start_date")
+    end_date = data_filtre(end_date, "end_date")
+
+    if sensor_id is not None:
+        conditions.append("sensor_id = %s")
+        params.append(sensor_id)
+
+    if start_date:
+        conditions.append("timestamp >= %s")
+        params.append(start_date)
+
+    if end_date:
+        conditions.append("timestamp <= %s")
+        params.append(end_date)
+
+    return conditions, params
+
 @app.get("/lectures/", response_model=List[Lectura])
-def listar_lectures(
+async def listar_lectures(
+    response: Response,
+    sensor_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None
+):
+    # Paginació per (timestamp, id): la pàgina següent continua on acaba l'anterior,
+    # així que qualsevol pàgina costa el mateix que la primera
+    limit = min(limit, LECTURES_LIMIT_MAX)
+    query = "SELECT id, sensor_id, valor, timestamp FROM humitat_sol"
+    conditions, params = filtres_lectures(sensor_id, start_date, end_date)
+
+    if cursor:
+        try:
+            cursor_ts, cursor_id = decodificar_cursor(cursor)
+        except CursorInvalid as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        conditions.append("(timestamp < %s OR (timestamp = %s AND id < %s))")
+        params.extend([cursor_ts, cursor_ts, cursor_id])
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    query += " ORDER BY timestamp DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
+
+    async with db_client_async() as db:
+        lectures = await repositori.consultar_sql(db, query, tuple(params), repositori.FilaLectura)
+
+    if len(lectures) > limit:
+        lectures = lectures[:limit]
+        ultima = lectures[-1]
+        response.headers["X-Next-Cursor"] = codificar_cursor(ultima.timestamp, ultima.id)
+    return resposta_llista(lectures, response)
+
+@app.get("/lectures/export")
+async def exportar_lectures_endpoint(
     sensor_id: Optional[int] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    limit: int = 100
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False
+):
+    query = "SELECT id, sensor_id, valor, timestamp FROM humitat_sol"
+    conditions, params = filtres_lectures(sensor_id, start_date, end_date)
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY timestamp, id"
+
+    nom = f"lectures_{sensor_id}.{format}" if sensor_id is not None else f"lectures.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{nom}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        exportar_lectures(query, tuple(params), format, gzip),
+        media_type=FORMATS[format][1],
+        headers=headers
+    )
+
+@app.get("/lectures/aggregate", response_model=List[Agregat])
+async def agregar_lectures(
+    sensor_id: int,
+    bucket: str = Query("1h", pattern="^(5m|1h|1d)$"),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    limit: int = Query(288, ge=1)
 ):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
+    # Es llegeix de humitat_rollup, que s'actualitza a cada ingesta
+    start_date = data_filtre(start_date, "start_date")
+    end_date = data_filtre(end_date, "end_date")
     try:
-        query = "SELECT * FROM humitat_sol"
-        params = []
-        conditions = []
-        
-        if sensor_id:
-            conditions.append("sensor_id = %s")
-            params.append(sensor_id)
-        
-        if start_date:
-            conditions.append("timestamp >= %s")
-            params.append(start_date)
-        
-        if end_date:
-            conditions.append("timestamp <= %s")
-            params.append(end_date)
-        
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
-        
-        query += " ORDER BY timestamp DESC LIMIT %s"
-        params.append(limit)
-        
-        cursor.execute(query, tuple(params))
-        return cursor.fetchall()
-    finally:
-        cursor.close()
-        db.close()
+        return await obtenir_agregats(sensor_id, bucket, start_date, end_date, min(limit, LECTURES_LIMIT_MAX))
+    except pymysql.err.MySQLError as err:
+        raise HTTPException(status_code=500, detail=str(err))
+
+@app.post("/lectures/", status_code=202)
+async def crear_lectura(lectura: LecturaCreate):
+    # Primer l'admissió: un node que envia amb un id no registrat no pot fer una consulta per
+    # petició. Després el sensor, abans de respondre 202: el flush ja no pot avisar el client.
+    await admissio.admetre(lectura.sensor_id)
+    if not await sensor_existeix(lectura.sensor_id):
+        raise HTTPException(status_code=404, detail="Sensor no encontrado")
+    dades = lectura.model_dump()
+    if dades["timestamp"] is None:
+        # L'hora d'arribada, no la del flush (que arriba fins a un interval més tard)
+        dades["timestamp"] = datetime.now()
+    await buffer_ingesta.afegir(dades)
+    return {"message": "Lectura acceptada"}
+
+@app.post("/lectures/batch", response_model=LecturaBatchResponse)
+async def crear_lectures_batch(lectures: List[Any] = Body(...)):
+    if len(lectures) > LECTURES_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Màxim {LECTURES_BATCH_MAX} lectures per petició")
+
+    # El control d'admissió va abans d'agafar cap connexió
+    limitades, admeses = await admissio.admetre_lot(lectures)
+    if not admeses:
+        # Lot buit o sense cap sensor_id vàlid: res a desar ni a consultar
+        files, resultats = validar_lectures(lectures, set(), limitades)
+        return {"acceptades": 0, "rebutjades": len(resultats), "resultats": resultats}
+    async with admissio.escriptor(admeses), db_client_async() as db:
+        try:
+            existents = await sensors_existents(db, sensor_ids_candidats(lectures))
+            files, resultats = validar_lectures(lectures, existents, limitades)
+            await desar_lectures(db, files)
+        except pymysql.err.MySQLError as err:
+            raise HTTPException(status_code=400, detail=str(err))
+
+    return {"acceptades": len(files), "rebutjades": len(resultats) - len(files), "resultats": resultats}
 
 @app.get("/humitat/{sensor_id}", response_model=HumitatValorResponse)
-def get_humitat_actual(sensor_id: int):
-    db = db_client()
-    cursor = db.cursor(dictionary=True)
+async def get_humitat_actual(sensor_id: int):
+    # Es serveix des del ring buffer; només es consulta la base de dades si el sensor no hi és
     try:
-        # First check if sensor exists
-        cursor.execute("SELECT * FROM sensors WHERE sensor_id = %s", (sensor_id,))
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Sensor no encontrado")
-            
-        query = """
-        SELECT sensor_id, valor, timestamp 
-        FROM humitat_sol 
-        WHERE sensor_id = %s 
-        ORDER BY timestamp DESC 
-        LIMIT 1
-        """
-        cursor.execute(query, (sensor_id,))
-        result = cursor.fetchone()
-        
-        if not result:
-            # Return default values when no data exists
-            return {"valor": result["valor"]}
-            
-        return result
-    except Exception as e:
+        lectures = await obtenir_recents(sensor_id, 1)
+    except pymysql.err.MySQLError as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cursor.close()
-        db.close()
+
+    if lectures is None:
+        raise HTTPException(status_code=404, detail="Sensor no encontrado")
+    if not lectures:
+        # Return default values when no data exists
+        return {"valor": None}
+    return lectures[0]
         
 # Plantas Endpoints
 @app.get("/plantes/", response_model=List[Planta])
-def listar_plantes():
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT * FROM planta")
-        plantas = cursor.fetchall()
-        for planta in plantas:
-            if not planta.get('imagen_url'):
-                planta['imagen_url'] = f"{BASE_URL}/static/plantas/{planta['nom']}.jpg"
-        return plantas
-    finally:
-        cursor.close()
-        db.close()
+async def listar_plantes(request: Request, response: Response, mida: Optional[str] = MIDA_IMATGE):
+    if (no_modificat := versions.condicional(request, response, "plantes")) is not None:
+        return no_modificat
+    # Les files de referència són compartides: la URL de la imatge va en una còpia
+    plantas = [
+        planta if planta.imagen_url else replace(planta, imagen_url=url_imatge(BASE_URL, planta.nom, mida))
+        for planta in await referencia.plantes.files()
+    ]
+    return resposta_llista(plantas, response)
         
 @app.post("/plantes/", response_model=Planta)
-def crear_planta(planta: PlantaCreate):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT * FROM sensors WHERE sensor_id = %s", (planta.sensor_id,))
-        if not cursor.fetchone():
-            raise HTTPException(status_code=400, detail="El sensor especificado no existe")
-        
-        if planta.usuari_id:
-            cursor.execute("SELECT * FROM usuaris WHERE id = %s", (planta.usuari_id,))
-            if not cursor.fetchone():
-                raise HTTPException(status_code=400, detail="El usuario especificado no existe")
-        
-        query = """
-        INSERT INTO planta (nom, ubicacio, sensor_id, usuari_id, imagen_url)
-        VALUES (%s, %s, %s, %s, %s)
-        """
-        cursor.execute(query, (
-            planta.nom, 
-            planta.ubicacio,
-            planta.sensor_id,
-            planta.usuari_id,
-            planta.imagen_url
-        ))
-        db.commit()
-        planta_id = cursor.lastrowid
-        
-        cursor.execute("SELECT * FROM planta WHERE id = %s", (planta_id,))
-        new_planta = cursor.fetchone()
-        if not new_planta:
-            raise HTTPException(status_code=500, detail="Error al recuperar la planta creada")
+async def crear_planta(planta: PlantaCreate):
+    async with db_client_async() as db:
+        try:
+            if not await repositori.consultar_una(db, repositori.SENSOR_PER_ID, (planta.sensor_id,)):
+                raise HTTPException(status_code=400, detail="El sensor especificado no existe")
+        
+            if planta.usuari_id:
+                if not await repositori.consultar_una(db, repositori.USUARI_EXISTEIX, (planta.usuari_id,)):
+                    raise HTTPException(status_code=400, detail="El usuario especificado no existe")
+        
+            _, planta_id = await repositori.executar(db, repositori.CREAR_PLANTA, (
+                planta.nom, 
+                planta.ubicacio,
+                planta.sensor_id,
+                planta.usuari_id,
+                planta.imagen_url
+            ))
+            await versions.confirmar(db, "plantes")
+        
+            new_planta = await repositori.consultar_una(db, repositori.PLANTA_PER_ID, (planta_id,))
+            if not new_planta:
+                raise HTTPException(status_code=500, detail="Error al recuperar la planta creada")
             
-        return new_planta
-    except mysql.connector.Error as err:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(err))
-    finally:
-        cursor.close()
-        db.close()
+            return new_planta
+        except pymysql.err.MySQLError as err:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail=str(err))
         
 class PlantasPorZonaResponse(BaseModel):
     zona: str
     plantas: List[Planta]
 
 @app.get("/plantes/por-zones", response_model=List[PlantasPorZonaResponse])
-def get_plantas_agrupadas_por_zones(usuari_id: int):
-    db = db_client()
-    if isinstance(db, dict):
-        raise HTTPException(status_code=500, detail=db["message"])
-    
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("""
-            SELECT id, nom, ubicacio, sensor_id, usuari_id, imagen_url 
-            FROM planta
-            WHERE usuari_id = %s
-            ORDER BY ubicacio, nom
-        """, (usuari_id,))
-        
-        plantas = cursor.fetchall()
-        
-        for planta in plantas:
-            if not planta.get('imagen_url'):
-                planta['imagen_url'] = f"{BASE_URL}/static/plantas/{planta['nom']}.jpg"
-        
-        plantas_por_zona = defaultdict(list)
-        for planta in plantas:
-            plantas_por_zona[planta['ubicacio']].append(planta)
-            
-        return [
-            {"zona": zona, "plantas": plantas}
-            for zona, plantas in plantas_por_zona.items()
-        ]
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cursor.close()
-        db.close()
+async def get_plantas_agrupadas_por_zones(usuari_id: int, request: Request, response: Response, mida: Optional[str] = MIDA_IMATGE):
+    if (no_modificat := versions.condicional(request, response, "plantes")) is not None:
+        return no_modificat
+    async with db_client_async() as db:
+        try:
+            plantas = await repositori.consultar(db, repositori.PLANTES_PER_USUARI, (usuari_id,))
+        except pymysql.err.MySQLError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    plantas_por_zona = defaultdict(list)
+    for planta in plantas:
+        if not planta.imagen_url:
+            planta.imagen_url = url_imatge(BASE_URL, planta.nom, mida)
+        plantas_por_zona[planta.ubicacio].append(planta)
+
+    return resposta_llista([
+        {"zona": zona, "plantas": plantas}
+        for zona, plantas in plantas_por_zona.items()
+    ], response)
         
 @app.get("/plantes/{planta_id}", response_model=Planta)
-def obtenir_planta(planta_id: int):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT * FROM planta WHERE id = %s", (planta_id,))
-        planta = cursor.fetchone()
+async def obtenir_planta(planta_id: int, mida: Optional[str] = MIDA_IMATGE):
+    async with db_client_async() as db:
+        planta = await repositori.consultar_una(db, repositori.PLANTA_PER_ID, (planta_id,))
 
-        if not planta:
-            raise HTTPException(status_code=404, detail="Planta no trobada")
-        
-        if not planta.get('imagen_url'):
-            planta["imagen_url"] = f"{BASE_URL}/static/plantas/{planta['nom']}.jpg"
-        return planta
-    finally:
-        cursor.close()
-        db.close()
+    if not planta:
+        raise HTTPException(status_code=404, detail="Planta no trobada")
 
+    if not planta.imagen_url:
+        planta.imagen_url = url_imatge(BASE_URL, planta.nom, mida)
+    return planta
 
-@app.get("/plantes/complet/{planta_id}")
-def obtenir_planta_completa(planta_id: int):
-    db = db_client()
-    cursor = db.cursor(dictionary=True)
 
+@app.get("/plantes/complet/{planta_id}")
+async def obtenir_planta_completa(planta_id: int):
     try:
-        cursor.execute("""
-            SELECT 
-                p.id AS planta_id,
-                p.nom AS planta_nom,
-                p.ubicacio,
-                p.imagen_url,
-                s.sensor_id,
-                s.estat AS sensor_estat,
-                hs.id AS humitat_id,
-                hs.valor AS humitat_valor,
-                hs.timestamp AS humitat_timestamp
-            FROM planta p
-            LEFT JOIN sensors s ON p.sensor_id = s.sensor_id
-            LEFT JOIN humitat_sol hs ON s.sensor_id = hs.sensor_id
-            WHERE p.id = %s
-            ORDER BY hs.timestamp DESC
-            LIMIT 1
-        """, (planta_id,))
-
-        result = cursor.fetchone()
+        async with db_client_async() as db:
+            result = await repositori.consultar_una(db, repositori.PLANTA_COMPLETA, (planta_id,))
+
         print("RESULTAT QUERY:", result)
 
         if not result:
             raise HTTPException(status_code=404, detail=f"Planta con ID {planta_id} no encontrada")
 
+        # L'última humitat surt del ring buffer del sensor, fora de la connexió anterior
+        lectures = await obtenir_recents(result.sensor_id, 1) if result.sensor_id is not None else None
+        ultima = lectures[0] if lectures else {"valor": None, "timestamp": None}
+
         planta = Planta(
-            id=result["planta_id"],
-            nom=result["planta_nom"],
-            ubicacio=result["ubicacio"],
-            sensor_id=result["sensor_id"],
-            imagen_url=result["imagen_url"]
+            id=result.planta_id,
+            nom=result.planta_nom,
+            ubicacio=result.ubicacio,
+            sensor_id=result.sensor_id,
+            imagen_url=result.imagen_url
         )
 
         sensor = Sensor(
-            sensor_id=result["sensor_id"],
-            estat=result["sensor_estat"]
+            sensor_id=result.sensor_id,
+            estat=result.sensor_estat
         )
 
-        humitat = HumitatValorResponse(valor=result["humitat_valor"])
+        humitat = HumitatValorResponse(valor=ultima["valor"])
 
         return {
-            "id": result["planta_id"],
-            "nom": result["planta_nom"],
-            "ubicacio": result["ubicacio"],
-            "imagen_url": result["imagen_url"],
-            "sensor_id": result["sensor_id"],
-            "sensor_estat": result["sensor_estat"],
-            "humitat_valor": result["humitat_valor"],
-            "humitat_timestamp": result["humitat_timestamp"],
+            "id": result.planta_id,
+            "nom": result.planta_nom,
+            "ubicacio": result.ubicacio,
+            "imagen_url": result.imagen_url,
+            "sensor_id": result.sensor_id,
+            "sensor_estat": result.sensor_estat,
+            "humitat_valor": ultima["valor"],
+            "humitat_timestamp": ultima["timestamp"],
             "estat_planta": "actiu"
         }
 
-    except mysql.connector.Error as err:
+    except pymysql.err.MySQLError as err:
         raise HTTPException(
             status_code=500,
             detail=f"Error de base de datos: {str(err)}. Parámetros usados: {planta_id}"
         )
-
-    finally:
-        cursor.close()
-        db.close()
         
 @app.put("/plantes/{planta_id}", response_model=Planta)
-def actualitzar_planta(planta_id: int, planta: PlantaUpdate):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT * FROM planta WHERE id = %s", (planta_id,))
-        current_planta = cursor.fetchone()
-        if not current_planta: raise HTTPException(status_code=404, detail="Planta no encontrada")
-        
-        update_data = {
-            'nom': planta.nom if planta.nom is not None else current_planta['nom'],
-            'ubicacio': planta.ubicacio if planta.ubicacio is not None else current_planta['ubicacio'],
-            'sensor_id': planta.sensor_id if planta.sensor_id is not None else current_planta['sensor_id'],
-            'usuari_id': planta.usuari_id if planta.usuari_id is not None else current_planta['usuari_id'],
-            'imagen_url': planta.imagen_url if planta.imagen_url is not None else current_planta['imagen_url']
-        }
-
-        query = """UPDATE planta SET nom = %s, ubicacio = %s, sensor_id = %s, usuari_id = %s, imagen_url = %s WHERE id = %s"""
-        cursor.execute(query, (
-            update_data['nom'],
-            update_data['ubicacio'],
-            update_data['sensor_id'],
-            update_data['usuari_id'],
-            update_data['imagen_url'],
-            planta_id
-        ))
-        db.commit()
-        cursor.execute("SELECT * FROM planta WHERE id = %s", (planta_id,))
-        updated_planta = cursor.fetchone()
-        if not updated_planta.get('imagen_url'): updated_planta['imagen_url'] = f"{BASE_URL}/static/plantas/{updated_planta['nom']}.jpg"
-        return updated_planta
-    except mysql.connector.Error as err:
-        raise HTTPException(status_code=400, detail=str(err))
-    finally:
-        cursor.close()
-        db.close()
+async def actualitzar_planta(planta_id: int, planta: PlantaUpdate):
+    async with db_client_async() as db:
+        try:
+            current_planta = await repositori.consultar_una(db, repositori.PLANTA_PER_ID, (planta_id,))
+            if not current_planta: raise HTTPException(status_code=404, detail="Planta no encontrada")
+        
+            update_data = {
+                'nom': planta.nom if planta.nom is not None else current_planta.nom,
+                'ubicacio': planta.ubicacio if planta.ubicacio is not None else current_planta.ubicacio,
+                'sensor_id': planta.sensor_id if planta.sensor_id is not None else current_planta.sensor_id,
+                'usuari_id': planta.usuari_id if planta.usuari_id is not None else current_planta.usuari_id,
+                'imagen_url': planta.imagen_url if planta.imagen_url is not None else current_planta.imagen_url
+            }
+
+            await repositori.executar(db, repositori.ACTUALITZAR_PLANTA, (
+                update_data['nom'],
+                update_data['ubicacio'],
+                update_data['sensor_id'],
+                update_data['usuari_id'],
+                update_data['imagen_url'],
+                planta_id
+            ))
+            await versions.confirmar(db, "plantes")
+            updated_planta = await repositori.consultar_una(db, repositori.PLANTA_PER_ID, (planta_id,))
+            if not updated_planta.imagen_url: updated_planta.imagen_url = url_imatge(BASE_URL, updated_planta.nom)
+            return updated_planta
+        except pymysql.err.MySQLError as err:
+            raise HTTPException(status_code=400, detail=str(err))
         
 
 @app.delete("/plantes/{planta_id}")
-def eliminar_planta(planta_id: int):
-    db = db_client()    
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("DELETE FROM planta WHERE id = %s", (planta_id,))
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Planta no encontrada")
-        db.commit()
-        return {"message": "Planta eliminada correctament"}
-    except mysql.connector.Error as err:
-        raise HTTPException(status_code=400, detail=str(err))
-    finally:
-        cursor.close()
-        db.close()
\ No newline at end of file
+async def eliminar_planta(planta_id: int):
+    async with db_client_async() as db:
+        try:
+            afectades, _ = await repositori.executar(db, repositori.ELIMINAR_PLANTA, (planta_id,))
+            if afectades == 0:
+                raise HTTPException(status_code=404, detail="Planta no encontrada")
+            await versions.confirmar(db, "plantes")
+            return {"message": "Planta eliminada correctament"}
+        except pymysql.err.MySQLError as err:
+            raise HTTPException(status_code=400, detail=str(err))
\ No newline at end of file
@@ -0,0 +1,223 @@
+# Mètriques de l'API en format Prometheus (GET /metrics) i log de consultes lentes
+#
+# Per petició es mesura el temps total, el temps esperant connexió del pool i el
+# temps dins del SQL; la resta (validació, lògica i serialització) surt per diferència.
+# Cada worker de uvicorn té els seus comptadors: Prometheus ha de fer scrape de cada
+# procés o s'ha d'executar amb un sol worker.
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+
+import aiomysql
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+SLOW_QUERY_MS = float(os.environ.get("ECOSENSE_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG = os.environ.get("ECOSENSE_SLOW_QUERY_LOG")
+
+BUCKETS_HTTP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_DB = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+peticions_en_curs = Gauge(
+    "ecosense_http_requests_in_flight", "Peticions HTTP en curs")
+durada_peticio = Histogram(
+    "ecosense_http_request_duration_seconds", "Durada de les peticions HTTP",
+    ["method", "route", "status"], buckets=BUCKETS_HTTP)
+durada_peticio_db = Histogram(
+    "ecosense_http_request_db_seconds", "Temps de cada petició dins del SQL",
+    ["method", "route"], buckets=BUCKETS_HTTP)
+durada_peticio_pool = Histogram(
+    "ecosense_http_request_pool_wait_seconds", "Temps de cada petició esperant connexió",
+    ["method", "route"], buckets=BUCKETS_HTTP)
+durada_peticio_app = Histogram(
+    "ecosense_http_request_app_seconds", "Temps de cada petició fora de la BD (validació, lògica, serialització)",
+    ["method", "route"], buckets=BUCKETS_HTTP)
+espera_connexio = Histogram(
+    "ecosense_db_pool_acquire_seconds", "Temps per obtenir una connexió del pool",
+    ["pool"], buckets=BUCKETS_DB)
+durada_consulta = Histogram(
+    "ecosense_db_query_duration_seconds", "Durada de les consultes SQL",
+    ["statement"], buckets=BUCKETS_DB)
+consultes_lentes = Counter(
+    "ecosense_db_slow_queries_total", "Consultes per sobre de ECOSENSE_SLOW_QUERY_MS",
+    ["statement"])
+lectures_rebutjades = Counter(
+    "ecosense_ingesta_rebutjades_total", "Lectures rebutjades pel control d'admissió (429)",
+    ["motiu", "estat"])
+
+log_lentes = logging.getLogger("ecosense.slow_query")
+if SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    log_lentes.addHandler(_handler)
+    log_lentes.setLevel(logging.WARNING)
+
+# Temps acumulat de la petició en curs: [sql, espera de connexió]
+_temps_peticio = ContextVar("ecosense_temps_peticio", default=None)
+
+_ESPAIS = re.compile(r"\s+")
+_LLISTA_IN = re.compile(r"IN \((?:%s, ?)*%s\)", re.IGNORECASE)
+_VALUES = re.compile(r"VALUES \((?:%s, ?)*%s\)(?:, ?\((?:%s, ?)*%s\))+", re.IGNORECASE)
+_etiquetes = {}
+
+
+def etiqueta_sql(sql):
+    # Els paràmetres van a part, però les llistes IN (%s, ...) i els VALUES de
+    # diverses files canvien de llargada: es normalitzen perquè no creixin les etiquetes
+    etiqueta = _etiquetes.get(sql)
+    if etiqueta is None:
+        etiqueta = _ESPAIS.sub(" ", sql).strip()
+        etiqueta = _LLISTA_IN.sub("IN (...)", etiqueta)
+        etiqueta = _VALUES.sub("VALUES (...)", etiqueta)
+        if len(_etiquetes) < 1000:
+            _etiquetes[sql] = etiqueta
+    return etiqueta
+
+
+def anomenar_sql(sql, nom):
+    # Les sentències de repositori.py surten amb el seu nom en lloc del text
+    _etiquetes[sql] = nom
+
+
+def registrar_consulta(sql, durada):
+    etiqueta = etiqueta_sql(sql)
+    durada_consulta.labels(etiqueta).observe(durada)
+    temps = _temps_peticio.get()
+    if temps is not None:
+        temps[0] += durada
+    if durada * 1000 >= SLOW_QUERY_MS:
+        consultes_lentes.labels(etiqueta).inc()
+        log_lentes.warning("%.1f ms %s", durada * 1000, etiqueta)
+
+
+def registrar_espera(pool, durada):
+    espera_connexio.labels(pool).observe(durada)
+    temps = _temps_peticio.get()
+    if temps is not None:
+        temps[1] += durada
+
+
+class CursorMesurat(aiomysql.Cursor):
+    # executemany acaba cridant execute amb el SQL expandit: només es mesura el de fora
+    _dins_executemany = False
+
+    async def execute(self, query, args=None):
+        if self._dins_executemany:
+            return await super().execute(query, args)
+        inici = time.perf_counter()
+        try:
+            return await super().execute(query, args)
+        finally:
+            registrar_consulta(query, time.perf_counter() - inici)
+
+    async def executemany(self, query, args):
+        self._dins_executemany = True
+        inici = time.perf_counter()
+        try:
+            return await super().executemany(query, args)
+        finally:
+            self._dins_executemany = False
+            registrar_consulta(query, time.perf_counter() - inici)
+
+
+_classes_mesurades = {}
+
+
+def _classe_mesurada(classe):
+    mesurada = _classes_mesurades.get(classe)
+    if mesurada is None:
+        mesurada = type(classe.__name__ + "Mesurat", (CursorMesurat, classe), {})
+        _classes_mesurades[classe] = mesurada
+    return mesurada
+
+
+class ConnexioMesurada:
+    # Embolcall de la connexió aiomysql: els cursors que obre mesuren cada consulta
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    @property
+    def crua(self):
+        # La connexió aiomysql, per a les sentències preparades (preparades.py)
+        return self._conn
+
+    def __getattr__(self, nom):
+        return getattr(self._conn, nom)
+
+    def cursor(self, *classes):
+        return self._conn.cursor(_classe_mesurada(classes[0] if classes else aiomysql.Cursor))
+
+
+def _ruta(scope):
+    ruta = scope.get("route")
+    if ruta is not None:
+        return getattr(ruta, "path", "desconeguda")
+    # Sense ruta (404 o fitxers estàtics): no s'usa el path per no crear una sèrie per URL
+    return "/static" if scope["path"].startswith("/static/") else "sense_ruta"
+
+
+class MetriquesMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        estat = 500
+        temps = [0.0, 0.0]
+
+        async def send_mesurat(missatge):
+            nonlocal estat
+            if missatge["type"] == "http.response.start":
+                estat = missatge["status"]
+            await send(missatge)
+
+        token = _temps_peticio.set(temps)
+        peticions_en_curs.inc()
+        inici = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_mesurat)
+        finally:
+            durada = time.perf_counter() - inici
+            peticions_en_curs.dec()
+            _temps_peticio.reset(token)
+            metode, ruta = scope["method"], _ruta(scope)
+            durada_peticio.labels(metode, ruta, str(estat)).observe(durada)
+            durada_peticio_db.labels(metode, ruta).observe(temps[0])
+            durada_peticio_pool.labels(metode, ruta).observe(temps[1])
+            durada_peticio_app.labels(metode, ruta).observe(max(0.0, durada - temps[0] - temps[1]))
+
+
+class EstatCollector:
+    # Exporta com a gauges els valors numèrics dels /estat/* en el moment del scrape
+    def __init__(self, fonts):
+        self.fonts = fonts
+
+    def collect(self):
+        for prefix, font in self.fonts.items():
+            for clau, valor in _aplanar(font()):
+                if isinstance(valor, bool):
+                    valor = int(valor)
+                if isinstance(valor, (int, float)):
+                    yield GaugeMetricFamily(f"ecosense_{prefix}_{clau}", f"{prefix}: {clau}", value=valor)
+
+
+def _aplanar(dades, prefix=""):
+    for clau, valor in dades.items():
+        if isinstance(valor, dict):
+            yield from _aplanar(valor, f"{prefix}{clau}_")
+        else:
+            yield f"{prefix}{clau}", valor
+
+
+def registrar_estat(fonts):
+    REGISTRY.register(EstatCollector(fonts))
+
+
+def metriques():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
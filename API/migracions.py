@@ -0,0 +1,177 @@
+# Migracions de l'esquema de la base de dades
+#
+#   cd API && python migracions.py migrate   # aplica les migracions pendents
+#   cd API && python migracions.py status    # mostra les migracions aplicades
+#   cd API && python migracions.py check     # EXPLAIN de les consultes calentes; falla si alguna fa full scan
+import argparse
+import sys
+from datetime import datetime
+
+import mysql.connector
+
+from client import db_client
+
+# (versió, nom, sentències). Mai es modifica una migració ja publicada: se n'afegeix una de nova.
+MIGRACIONS = [
+    (1, "humitat_rollup", [
+        """
+        CREATE TABLE IF NOT EXISTS humitat_rollup (
+            sensor_id INT NOT NULL,
+            bucket CHAR(2) NOT NULL,
+            inici DATETIME NOT NULL,
+            n INT NOT NULL,
+            suma DOUBLE NOT NULL,
+            minim DOUBLE NOT NULL,
+            maxim DOUBLE NOT NULL,
+            PRIMARY KEY (sensor_id, bucket, inici)
+        )
+        """,
+    ]),
+    (2, "index_consultes_calentes", [
+        # Lectures per sensor en ordre cronològic (i paginació per cursor)
+        "CREATE INDEX idx_humitat_sensor_ts ON humitat_sol (sensor_id, timestamp, id)",
+        # /lectures/ i exportació sense filtre de sensor
+        "CREATE INDEX idx_humitat_ts ON humitat_sol (timestamp, id)",
+        # /plantes/por-zones
+        "CREATE INDEX idx_planta_usuari_zona ON planta (usuari_id, ubicacio, nom)",
+        # Planta d'un sensor
+        "CREATE INDEX idx_planta_sensor ON planta (sensor_id)",
+        # Login i registre
+        "CREATE INDEX idx_usuaris_email ON usuaris (email)",
+    ]),
+    (3, "canvis_versio", [
+        # Versió de cada recurs de catàleg: els workers la consulten per saber si les
+        # seves memòries estan al dia (vegeu coherencia.py)
+        """
+        CREATE TABLE IF NOT EXISTS canvis_versio (
+            recurs VARCHAR(20) PRIMARY KEY,
+            versio BIGINT NOT NULL,
+            modificat DOUBLE NOT NULL
+        )
+        """,
+        "INSERT IGNORE INTO canvis_versio (recurs, versio, modificat) "
+        "VALUES ('usuaris', 0, UNIX_TIMESTAMP()), ('sensors', 0, UNIX_TIMESTAMP()), ('plantes', 0, UNIX_TIMESTAMP())",
+    ]),
+]
+
+# Consultes dels endpoints més freqüents amb paràmetres d'exemple
+CONSULTES_CALENTES = [
+    ("lectures per sensor",
+     "SELECT id, sensor_id, valor, timestamp FROM humitat_sol WHERE sensor_id = %s "
+     "ORDER BY timestamp DESC, id DESC LIMIT 101", (1,)),
+    ("lectures per sensor amb cursor",
+     "SELECT id, sensor_id, valor, timestamp FROM humitat_sol WHERE sensor_id = %s "
+     "AND (timestamp < %s OR (timestamp = %s AND id < %s)) ORDER BY timestamp DESC, id DESC LIMIT 101",
+     (1, datetime(2100, 1, 1), datetime(2100, 1, 1), 1)),
+    ("últimes lectures",
+     "SELECT valor, timestamp FROM humitat_sol WHERE sensor_id = %s ORDER BY timestamp DESC LIMIT 10", (1,)),
+    ("plantes per zones",
+     "SELECT id, nom, ubicacio, sensor_id, usuari_id, imagen_url FROM planta WHERE usuari_id = %s "
+     "ORDER BY ubicacio, nom", (1,)),
+    ("planta d'un sensor", "SELECT id, nom, ubicacio FROM planta WHERE sensor_id = %s", (1,)),
+    ("login", "SELECT id, nom, cognom, email, contrasenya FROM usuaris WHERE email = %s", ("a@b.c",)),
+    ("agregats",
+     "SELECT inici, minim, maxim, suma / n, n FROM humitat_rollup WHERE sensor_id = %s AND bucket = %s "
+     "ORDER BY inici DESC LIMIT 288", (1, "1h")),
+]
+
+ERR_INDEX_DUPLICAT = 1061
+
+# Tipus d'accés d'EXPLAIN que llegeixen totes les files: la taula sencera (ALL) o un índex
+# sencer (index, p. ex. quan l'ORDER BY fa servir un índex però el WHERE no)
+FULL_SCANS = ("ALL", "index")
+
+
+def _preparar(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_versio (
+            versio INT PRIMARY KEY,
+            nom VARCHAR(100) NOT NULL,
+            aplicada_el DATETIME NOT NULL
+        )
+    """)
+    cursor.execute("SELECT versio FROM schema_versio")
+    return {fila[0] for fila in cursor.fetchall()}
+
+
+def migrar(verbose=False):
+    # GET_LOCK evita que dos workers apliquin la mateixa migració alhora
+    aplicades = []
+    with db_client() as db:
+        cursor = db.cursor()
+        try:
+            cursor.execute("SELECT GET_LOCK('ecosense_migracions', 60)")
+            if cursor.fetchone()[0] != 1:
+                raise RuntimeError("No s'ha pogut obtenir el lock de migracions")
+            try:
+                fetes = _preparar(cursor)
+                for versio, nom, sentencies in MIGRACIONS:
+                    if versio in fetes:
+                        continue
+                    for sql in sentencies:
+                        try:
+                            cursor.execute(sql)
+                        except mysql.connector.Error as err:
+                            # L'índex ja existia (creat a mà): es dóna per fet
+                            if err.errno != ERR_INDEX_DUPLICAT:
+                                raise
+                    cursor.execute(
+                        "INSERT INTO schema_versio (versio, nom, aplicada_el) VALUES (%s, %s, %s)",
+                        (versio, nom, datetime.now()),
+                    )
+                    db.commit()
+                    aplicades.append(versio)
+                    if verbose:
+                        print(f"Migració {versio} ({nom}) aplicada")
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK('ecosense_migracions')")
+                cursor.fetchone()
+        finally:
+            cursor.close()
+    return aplicades
+
+
+def estat():
+    with db_client() as db:
+        cursor = db.cursor()
+        try:
+            fetes = _preparar(cursor)
+        finally:
+            cursor.close()
+    return [(versio, nom, versio in fetes) for versio, nom, _ in MIGRACIONS]
+
+
+def comprovar_plans():
+    # Retorna (nom, taula, tipus, índex) de cada consulta que fa full scan de taula o d'índex
+    errors = []
+    with db_client() as db:
+        cursor = db.cursor(dictionary=True)
+        try:
+            for nom, sql, params in CONSULTES_CALENTES:
+                cursor.execute("EXPLAIN " + sql, params)
+                for fila in cursor.fetchall():
+                    if fila["type"] in FULL_SCANS:
+                        errors.append((nom, fila["table"], fila["type"], fila["key"]))
+        finally:
+            cursor.close()
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migracions de l'esquema d'Ecosense")
+    parser.add_argument("ordre", choices=["migrate", "status", "check"])
+    args = parser.parse_args()
+
+    if args.ordre == "migrate":
+        if not migrar(verbose=True):
+            print("L'esquema ja està al dia")
+    elif args.ordre == "status":
+        for versio, nom, feta in estat():
+            print(f"{versio:3} {'aplicada' if feta else 'pendent ':8} {nom}")
+    else:
+        errors = comprovar_plans()
+        for nom, taula, tipus, key in errors:
+            print(f"FULL SCAN: {nom} (taula {taula}, type={tipus}, key={key})")
+        if errors:
+            sys.exit(1)
+        print(f"{len(CONSULTES_CALENTES)} consultes comprovades, cap full scan")
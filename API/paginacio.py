@@ -0,0 +1,23 @@
+# Paginació per cursor (keyset) sobre (timestamp, id)
+import base64
+import json
+from datetime import datetime
+
+LECTURES_LIMIT_MAX = 1000
+
+
+class CursorInvalid(ValueError):
+    pass
+
+
+def codificar_cursor(timestamp: datetime, id: int) -> str:
+    dades = json.dumps({"t": timestamp.isoformat(), "i": id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(dades.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str):
+    try:
+        dades = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(dades["t"]), int(dades["i"])
+    except (ValueError, KeyError, TypeError):
+        raise CursorInvalid("Cursor de paginació invàlid")
@@ -0,0 +1,170 @@
+# Previsió de reg: quan baixarà la humitat de cada planta per sota del llindar
+#
+# Les lectures de les últimes ECOSENSE_PREDICCIO_HORES de tots els sensors de l'usuari
+# es carreguen amb una sola consulta a arrays de NumPy i s'ajusta una recta (mínims
+# quadrats) per sensor, tots alhora amb bincount. Només es fa servir el tram des de
+# l'últim reg (la pujada més recent de més de ECOSENSE_PREDICCIO_SALT punts).
+#
+# El resultat es guarda per usuari fins que arriba alguna lectura nova d'un dels seus
+# sensors (també les desades per altres workers, vegeu coherencia.py), canvien les
+# plantes o els sensors, o passa ECOSENSE_PREDICCIO_TTL segons.
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import versions
+from estadistiques import ALERTA_HUMITAT_MIN
+
+PREDICCIO_HORES = float(os.environ.get("ECOSENSE_PREDICCIO_HORES", "72"))
+PREDICCIO_SALT = float(os.environ.get("ECOSENSE_PREDICCIO_SALT", "10"))
+PREDICCIO_MIN_LECTURES = int(os.environ.get("ECOSENSE_PREDICCIO_MIN_LECTURES", "3"))
+PREDICCIO_TTL = float(os.environ.get("ECOSENSE_PREDICCIO_TTL", "900"))
+PREDICCIO_MAX_USUARIS = 1000
+
+# Segons des de `desde` en lloc de datetime: NumPy rep números directament i no depèn
+# de la zona horària de la sessió
+QUERY_LECTURES = """
+SELECT sensor_id, TIMESTAMPDIFF(SECOND, %s, timestamp), valor
+FROM humitat_sol
+WHERE sensor_id IN ({marcadors}) AND timestamp >= %s
+ORDER BY sensor_id, timestamp
+"""
+
+
+def ajustar(grups, hores, valors, n_grups, ara, salt=PREDICCIO_SALT, min_lectures=PREDICCIO_MIN_LECTURES):
+    # grups: índex del sensor de cada lectura (ordenat); hores: temps de cada lectura.
+    # Torna per grup (pendent per hora, valor estimat a `ara`, lectures usades); NaN sense prou dades.
+    files = np.arange(len(grups))
+    inici = np.searchsorted(grups, np.arange(n_grups))
+
+    # Inici de l'últim tram d'assecat de cada sensor: després de la pujada més recent
+    canvi = np.diff(valors)
+    mateix_sensor = grups[1:] == grups[:-1]
+    salts = np.nonzero(mateix_sensor & (canvi > salt))[0] + 1
+    inici_tram = inici.copy()
+    np.maximum.at(inici_tram, grups[salts], salts)
+    tram = files >= inici_tram[grups]
+
+    g, t, v = grups[tram], hores[tram], valors[tram]
+    n = np.bincount(g, minlength=n_grups).astype(float)
+    st = np.bincount(g, t, n_grups)
+    sv = np.bincount(g, v, n_grups)
+    stt = np.bincount(g, t * t, n_grups)
+    stv = np.bincount(g, t * v, n_grups)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denominador = n * stt - st * st
+        pendent = np.where((n >= min_lectures) & (denominador > 0), (n * stv - st * sv) / denominador, np.nan)
+        origen = (sv - pendent * st) / n
+    return pendent, origen + pendent * ara, n.astype(int)
+
+
+def prediccions(sensor_ids, files, desde, ara, llindar):
+    # files: (sensor_id, segons des de `desde`, valor) ordenades per sensor i temps.
+    # Torna {sensor_id: dict de previsió}
+    if not sensor_ids:
+        return {}
+    ids = np.array(sorted(sensor_ids))
+    buit = {"humitat_actual": None, "assecat_per_hora": None, "moment_previst": None, "lectures": 0}
+    if not files:
+        return {int(s): dict(buit) for s in ids}
+
+    dades = np.array(files, dtype=float)
+    grups = np.searchsorted(ids, dades[:, 0].astype(ids.dtype))
+    hores = dades[:, 1] / 3600
+    hores_ara = (ara - desde).total_seconds() / 3600
+    pendent, actual, lectures = ajustar(grups, hores, dades[:, 2], len(ids), hores_ara)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fins_llindar = np.where(pendent < 0, np.maximum(actual - llindar, 0) / -pendent, np.nan)
+
+    resultat = {}
+    for i, sensor_id in enumerate(ids.tolist()):
+        if np.isnan(pendent[i]):
+            resultat[sensor_id] = dict(buit, lectures=int(lectures[i]))
+            continue
+        resultat[sensor_id] = {
+            "humitat_actual": float(actual[i]),
+            "assecat_per_hora": float(-pendent[i]),
+            "moment_previst": ara + timedelta(hours=float(fins_llindar[i])) if not np.isnan(fins_llindar[i]) else None,
+            "lectures": int(lectures[i]),
+        }
+    return resultat
+
+
+class MemoriaPrediccions:
+    def __init__(self, ttl=PREDICCIO_TTL, max_usuaris=PREDICCIO_MAX_USUARIS):
+        self.ttl = ttl
+        self.max_usuaris = max_usuaris
+        self._entrades = OrderedDict()
+        # Comptador de lectures noves per sensor
+        self._generacions = {}
+        self._encerts = 0
+        self._errades = 0
+
+    def invalidar(self, files):
+        for sensor_id in {fila[0] for fila in files}:
+            self._generacions[sensor_id] = self._generacions.get(sensor_id, 0) + 1
+
+    def _clau(self, sensor_ids):
+        return versions.etag("plantes", "sensors"), tuple(self._generacions.get(s, 0) for s in sensor_ids)
+
+    def obtenir(self, usuari_id, llindar):
+        entrada = self._entrades.get((usuari_id, llindar))
+        if entrada is not None:
+            clau, creada, sensor_ids, valor = entrada
+            if time.monotonic() - creada < self.ttl and clau == self._clau(sensor_ids):
+                self._entrades.move_to_end((usuari_id, llindar))
+                self._encerts += 1
+                return valor
+        self._errades += 1
+        return None
+
+    def guardar(self, usuari_id, llindar, sensor_ids, clau, valor):
+        # `clau` s'ha de calcular abans de consultar, perquè una lectura que arribi
+        # mentrestant invalidi el resultat
+        self._entrades[(usuari_id, llindar)] = (clau, time.monotonic(), sensor_ids, valor)
+        self._entrades.move_to_end((usuari_id, llindar))
+        while len(self._entrades) > self.max_usuaris:
+            self._entrades.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "usuaris": len(self._entrades),
+            "encerts": self._encerts,
+            "errades": self._errades,
+        }
+
+
+memoria_prediccions = MemoriaPrediccions()
+
+
+async def calcular_previsio(db, usuari_id, plantes, llindar=ALERTA_HUMITAT_MIN):
+    # plantes: files de planta de l'usuari (FilaPlanta). Torna (calculat, [previsió per planta])
+    sensor_ids = tuple(sorted({p.sensor_id for p in plantes if p.sensor_id is not None}))
+    clau = memoria_prediccions._clau(sensor_ids)
+    ara = datetime.now().replace(microsecond=0)
+    desde = ara - timedelta(hours=PREDICCIO_HORES)
+
+    files = []
+    if sensor_ids:
+        cursor = await db.cursor()
+        try:
+            await cursor.execute(
+                QUERY_LECTURES.format(marcadors=", ".join(["%s"] * len(sensor_ids))),
+                (desde, *sensor_ids, desde),
+            )
+            files = await cursor.fetchall()
+        finally:
+            await cursor.close()
+
+    per_sensor = prediccions(sensor_ids, files, desde, ara, llindar)
+    resultat = (ara, [
+        {"planta_id": p.id, "nom": p.nom, "ubicacio": p.ubicacio, "sensor_id": p.sensor_id, **per_sensor.get(p.sensor_id, {})}
+        for p in plantes
+    ])
+    memoria_prediccions.guardar(usuari_id, llindar, sensor_ids, clau, resultat)
+    return resultat
@@ -0,0 +1,233 @@
+# Sentències preparades de MySQL amb el protocol binari (COM_STMT_PREPARE / COM_STMT_EXECUTE)
+#
+# aiomysql només parla el protocol de text. Aquí s'envien les ordres binàries per la mateixa
+# connexió (_execute_command i _read_packet d'aiomysql, els que fa servir el seu cursor), així
+# que comparteixen transacció i estat amb la resta de consultes. Cada connexió del pool
+# prepara una sentència el primer cop que la fa servir i després només n'envia l'id i els
+# paràmetres: el servidor no torna a analitzar ni planificar el SQL.
+#
+# SQLite no en té cap necessitat: ja guarda les sentències compilades a cada connexió.
+import os
+import struct
+import weakref
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pymysql
+from pymysql.constants import COMMAND, FIELD_TYPE, FLAG
+from pymysql.protocol import EOFPacketWrapper, FieldDescriptorPacket, OKPacketWrapper
+
+from client import DB_BACKEND
+
+SENTENCIES_PREPARADES = DB_BACKEND == "mysql" and os.environ.get("ECOSENSE_SENTENCIES_PREPARADES", "1") != "0"
+
+ER_UNKNOWN_STMT_HANDLER = 1243
+CHARSET_BINARY = 63
+
+_ENTERS = {
+    FIELD_TYPE.TINY: ("<b", "<B", 1),
+    FIELD_TYPE.SHORT: ("<h", "<H", 2),
+    FIELD_TYPE.YEAR: ("<h", "<H", 2),
+    FIELD_TYPE.LONG: ("<i", "<I", 4),
+    FIELD_TYPE.INT24: ("<i", "<I", 4),
+    FIELD_TYPE.LONGLONG: ("<q", "<Q", 8),
+}
+_DATES = (FIELD_TYPE.DATE, FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP)
+_DECIMALS = (FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL)
+
+
+class Preparada:
+    __slots__ = ("id", "n_params")
+
+    def __init__(self, id_sentencia, n_params):
+        self.id = id_sentencia
+        self.n_params = n_params
+
+
+# Per connexió: sql -> Preparada. Les sentències desapareixen amb la connexió (també al servidor)
+_preparades = weakref.WeakKeyDictionary()
+_stats = {"preparacions": 0, "execucions": 0, "repreparades": 0}
+
+
+def _lenenc(n):
+    if n < 251:
+        return struct.pack("<B", n)
+    if n < 1 << 16:
+        return b"\xfc" + struct.pack("<H", n)
+    if n < 1 << 24:
+        return b"\xfd" + struct.pack("<I", n)[:3]
+    return b"\xfe" + struct.pack("<Q", n)
+
+
+def _parametre(valor, encoding):
+    # (tipus, flag unsigned, valor codificat) per a COM_STMT_EXECUTE
+    if isinstance(valor, (bool, int)):
+        if valor > 0x7FFFFFFFFFFFFFFF:
+            return FIELD_TYPE.LONGLONG, 0x80, struct.pack("<Q", valor)
+        return FIELD_TYPE.LONGLONG, 0, struct.pack("<q", valor)
+    if isinstance(valor, float):
+        return FIELD_TYPE.DOUBLE, 0, struct.pack("<d", valor)
+    if isinstance(valor, datetime):
+        dades = struct.pack("<HBBBBB", valor.year, valor.month, valor.day, valor.hour, valor.minute, valor.second)
+        if valor.microsecond:
+            dades += struct.pack("<I", valor.microsecond)
+        return FIELD_TYPE.DATETIME, 0, _lenenc(len(dades)) + dades
+    if isinstance(valor, date):
+        return FIELD_TYPE.DATE, 0, b"\x04" + struct.pack("<HBB", valor.year, valor.month, valor.day)
+    if isinstance(valor, (bytes, bytearray)):
+        return FIELD_TYPE.BLOB, 0, _lenenc(len(valor)) + bytes(valor)
+    # str, Decimal i la resta: com a text, el servidor el converteix al tipus de la columna
+    dades = str(valor).encode(encoding)
+    return FIELD_TYPE.VAR_STRING, 0, _lenenc(len(dades)) + dades
+
+
+def _execute(preparada, params, encoding):
+    dades = struct.pack("<IBI", preparada.id, 0, 1)
+    if not preparada.n_params:
+        return dades
+    if len(params) != preparada.n_params:
+        raise pymysql.err.ProgrammingError(f"La sentència espera {preparada.n_params} paràmetres, no {len(params)}")
+    nuls = bytearray((preparada.n_params + 7) // 8)
+    tipus, valors = [], []
+    for i, valor in enumerate(params):
+        if valor is None:
+            nuls[i // 8] |= 1 << (i % 8)
+            tipus.append(struct.pack("<BB", FIELD_TYPE.NULL, 0))
+            continue
+        codi, flag, codificat = _parametre(valor, encoding)
+        tipus.append(struct.pack("<BB", codi, flag))
+        valors.append(codificat)
+    return dades + bytes(nuls) + b"\x01" + b"".join(tipus) + b"".join(valors)
+
+
+def _float32(valor):
+    # Com el text de MySQL: la representació més curta que torna el mateix FLOAT
+    for digits in range(6, 10):
+        curt = float(f"{valor:.{digits}g}")
+        if struct.unpack("<f", struct.pack("<f", curt))[0] == valor:
+            return curt
+    return valor
+
+
+def _data(paquet, tipus):
+    mida = paquet.read_uint8()
+    if mida == 0:
+        return None
+    any_, mes, dia = struct.unpack("<HBB", paquet.read(4))
+    if tipus == FIELD_TYPE.DATE:
+        return date(any_, mes, dia)
+    hora = minut = segon = micro = 0
+    if mida >= 7:
+        hora, minut, segon = struct.unpack("<BBB", paquet.read(3))
+    if mida == 11:
+        micro = paquet.read_uint32()
+    return datetime(any_, mes, dia, hora, minut, segon, micro)
+
+
+def _temps(paquet):
+    mida = paquet.read_uint8()
+    if mida == 0:
+        return timedelta(0)
+    negatiu, dies, hores, minuts, segons = struct.unpack("<BIBBB", paquet.read(8))
+    micro = paquet.read_uint32() if mida == 12 else 0
+    durada = timedelta(days=dies, hours=hores, minutes=minuts, seconds=segons, microseconds=micro)
+    return -durada if negatiu else durada
+
+
+def _valor(paquet, camp, encoding):
+    tipus = camp.type_code
+    if tipus in _ENTERS:
+        signat, sense_signe, mida = _ENTERS[tipus]
+        return struct.unpack(sense_signe if camp.flags & FLAG.UNSIGNED else signat, paquet.read(mida))[0]
+    if tipus == FIELD_TYPE.DOUBLE:
+        return struct.unpack("<d", paquet.read(8))[0]
+    if tipus == FIELD_TYPE.FLOAT:
+        return _float32(struct.unpack("<f", paquet.read(4))[0])
+    if tipus in _DATES:
+        return _data(paquet, tipus)
+    if tipus == FIELD_TYPE.TIME:
+        return _temps(paquet)
+    dades = paquet.read_length_coded_string()
+    if tipus in _DECIMALS:
+        return Decimal(dades.decode("ascii"))
+    if camp.charsetnr == CHARSET_BINARY and tipus != FIELD_TYPE.JSON:
+        return dades
+    return dades.decode(encoding)
+
+
+def _fila(paquet, camps, encoding):
+    paquet.advance(1)
+    nuls = paquet.read((len(camps) + 9) // 8)
+    fila = []
+    for i, camp in enumerate(camps):
+        bit = i + 2
+        if nuls[bit // 8] & (1 << (bit % 8)):
+            fila.append(None)
+        else:
+            fila.append(_valor(paquet, camp, encoding))
+    return tuple(fila)
+
+
+async def _llegir_definicions(conn, n):
+    camps = [await conn._read_packet(FieldDescriptorPacket) for _ in range(n)]
+    if n:
+        await conn._read_packet()  # EOF (la connexió no demana CLIENT_DEPRECATE_EOF)
+    return camps
+
+
+async def _preparar(conn, sql):
+    await conn._execute_command(COMMAND.COM_STMT_PREPARE, sql.replace("%s", "?"))
+    paquet = await conn._read_packet()
+    paquet.advance(1)
+    id_sentencia = paquet.read_uint32()
+    n_columnes = paquet.read_uint16()
+    n_params = paquet.read_uint16()
+    await _llegir_definicions(conn, n_params)
+    await _llegir_definicions(conn, n_columnes)
+    _stats["preparacions"] += 1
+    return Preparada(id_sentencia, n_params)
+
+
+async def _executar(conn, preparada, params):
+    await conn._execute_command(COMMAND.COM_STMT_EXECUTE, _execute(preparada, params, conn.encoding))
+    paquet = await conn._read_packet()
+    _stats["execucions"] += 1
+    if paquet.is_ok_packet():
+        ok = OKPacketWrapper(paquet)
+        conn.server_status = ok.server_status
+        return [], ok.affected_rows, ok.insert_id
+    camps = await _llegir_definicions(conn, paquet.read_length_encoded_integer())
+    files = []
+    while True:
+        paquet = await conn._read_packet()
+        if paquet.is_eof_packet():
+            conn.server_status = EOFPacketWrapper(paquet).server_status
+            break
+        files.append(_fila(paquet, camps, conn.encoding))
+    return files, len(files), 0
+
+
+async def executar_preparada(conn, sql, params=()):
+    # conn: la connexió aiomysql, sense embolcall. Torna (files, files afectades, id generat)
+    per_sql = _preparades.setdefault(conn, {})
+    preparada = per_sql.get(sql)
+    if preparada is None:
+        preparada = per_sql[sql] = await _preparar(conn, sql)
+    try:
+        return await _executar(conn, preparada, params)
+    except pymysql.err.MySQLError as err:
+        # El servidor ha perdut la sentència (p. ex. després d'un COM_RESET_CONNECTION)
+        if not err.args or err.args[0] != ER_UNKNOWN_STMT_HANDLER:
+            raise
+        _stats["repreparades"] += 1
+        preparada = per_sql[sql] = await _preparar(conn, sql)
+        return await _executar(conn, preparada, params)
+
+
+def preparades_stats() -> dict:
+    return {
+        "actives": SENTENCIES_PREPARADES,
+        "connexions": len(_preparades),
+        "sentencies": sum(len(per_sql) for per_sql in list(_preparades.values())),
+        **_stats,
+    }
@@ -0,0 +1,75 @@
+# Dades de referència en memòria: les taules sensors i planta senceres
+#
+# Es carreguen a l'escalfament de l'arrencada i es tornen a llegir, el primer cop que
+# es necessiten, després de qualsevol escriptura del recurs en aquest o en un altre worker
+# (versions.confirmar i coherencia.py). GET /sensors/, GET /plantes/ i la comprovació de sensors de
+# l'ingesta les llegeixen d'aquí en lloc de consultar la base de dades.
+import asyncio
+import time
+
+import repositori
+import versions
+from client_async import db_client_async
+
+
+class TaulaReferencia:
+    def __init__(self, recurs, sentencia, clau):
+        self.recurs = recurs
+        self.sentencia = sentencia
+        self.clau = clau
+        self._files = None
+        self._per_id = {}
+        self._versio = None
+        self._lock = asyncio.Lock()
+
+        self._carregues = 0
+        self._ultima_carrega = 0.0
+
+    def vigent(self):
+        return self._files is not None and self._versio == versions.etag(self.recurs)
+
+    async def carregar(self):
+        async with self._lock:
+            if self.vigent():
+                return
+            # La versió abans de consultar: una escriptura mentrestant força una altra càrrega
+            versio = versions.etag(self.recurs)
+            inici = time.perf_counter()
+            async with db_client_async() as db:
+                files = await repositori.consultar(db, self.sentencia)
+            self._files = files
+            self._per_id = {getattr(fila, self.clau): fila for fila in files}
+            self._versio = versio
+            self._carregues += 1
+            self._ultima_carrega = time.perf_counter() - inici
+
+    async def files(self):
+        # Les files són compartides: qui les hagi de modificar n'ha de fer una còpia
+        if not self.vigent():
+            await self.carregar()
+        return self._files
+
+    async def per_id(self):
+        if not self.vigent():
+            await self.carregar()
+        return self._per_id
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._files) if self._files is not None else 0,
+            "vigent": self.vigent(),
+            "carregues": self._carregues,
+            "ultima_carrega_ms": self._ultima_carrega * 1000,
+        }
+
+
+sensors = TaulaReferencia("sensors", repositori.SENSORS, "sensor_id")
+plantes = TaulaReferencia("plantes", repositori.PLANTES, "id")
+
+
+async def carregar_referencia():
+    await asyncio.gather(sensors.carregar(), plantes.carregar())
+
+
+def referencia_stats() -> dict:
+    return {"sensors": sensors.stats(), "plantes": plantes.stats()}
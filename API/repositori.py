@@ -0,0 +1,258 @@
+# Accés a dades compartit pels endpoints
+#
+# Cada consulta es defineix una sola vegada com a Sentencia, amb el tipus de fila que
+# torna i un nom, que és l'etiqueta de la consulta a /metrics i al log de consultes
+# lentes. Amb ECOSENSE_SENTENCIES_PREPARADES=1 (per defecte, només MySQL) cada connexió del
+# pool la prepara amb el protocol binari el primer cop que la fa servir i després només
+# l'executa (vegeu preparades.py): MySQL no torna a analitzar el SQL a cada petició.
+#
+# Les consultes amb SQL variable (filtres opcionals, llistes IN) passen per consultar_sql
+# i es queden on es fan: el dashboard, GET /lectures/ i l'exportació, l'esborrat de
+# lectures per lots, sensors_existents (ingesta.py), l'escalfament per lots de
+# lectures_recents.py, obtenir_agregats i backfill (rollups.py) i prediccio.py. També
+# retencio.py i migracions.py, que són manteniment amb pymysql i DDL.
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import preparades
+from metriques import anomenar_sql, registrar_consulta
+
+
+# Files tipades. L'ordre dels camps és el de les columnes del SELECT.
+@dataclass(slots=True)
+class FilaUsuari:
+    id: int
+    nom: str
+    cognom: str
+    email: str
+
+
+@dataclass(slots=True)
+class FilaUsuariLogin:
+    id: int
+    nom: str
+    cognom: str
+    email: str
+    contrasenya: Optional[str]
+
+
+@dataclass(slots=True)
+class FilaSensor:
+    sensor_id: int
+    estat: str
+    usuari_id: Optional[int]
+
+
+@dataclass(slots=True)
+class FilaPlanta:
+    id: int
+    nom: str
+    ubicacio: str
+    sensor_id: int
+    usuari_id: Optional[int]
+    imagen_url: Optional[str]
+
+
+@dataclass(slots=True)
+class FilaPlantaDashboard:
+    id: int
+    nom: str
+    ubicacio: str
+    sensor_id: int
+    usuari_id: Optional[int]
+    imagen_url: Optional[str]
+    sensor_estat: Optional[str]
+    humitat_valor: Optional[float] = None
+    humitat_timestamp: Optional[datetime] = None
+
+
+@dataclass(slots=True)
+class FilaPlantaCompleta:
+    planta_id: int
+    planta_nom: str
+    ubicacio: str
+    imagen_url: Optional[str]
+    sensor_id: Optional[int]
+    sensor_estat: Optional[str]
+
+
+@dataclass(slots=True)
+class FilaLectura:
+    id: int
+    sensor_id: int
+    valor: float
+    timestamp: datetime
+
+
+@dataclass(slots=True)
+class FilaUltimaLectura:
+    sensor_id: int
+    valor: float
+    timestamp: datetime
+
+
+@dataclass(slots=True)
+class FilaVersio:
+    recurs: str
+    versio: int
+    modificat: float
+
+
+class Sentencia:
+    __slots__ = ("nom", "sql", "tipus")
+
+    def __init__(self, nom, sql, tipus=None):
+        self.nom = nom
+        self.sql = " ".join(sql.split())
+        self.tipus = tipus
+        anomenar_sql(self.sql, nom)
+
+
+# Usuaris
+USUARIS = Sentencia("usuaris", "SELECT id, nom, cognom, email FROM usuaris", FilaUsuari)
+USUARI_PER_ID = Sentencia("usuari_per_id", "SELECT id, nom, cognom, email FROM usuaris WHERE id = %s", FilaUsuari)
+USUARI_PER_EMAIL = Sentencia(
+    "usuari_per_email", "SELECT id, nom, cognom, email, contrasenya FROM usuaris WHERE email = %s", FilaUsuariLogin)
+USUARI_EXISTEIX = Sentencia("usuari_existeix", "SELECT id FROM usuaris WHERE id = %s")
+EMAIL_EXISTEIX = Sentencia("email_existeix", "SELECT id FROM usuaris WHERE email = %s")
+CREAR_USUARI = Sentencia(
+    "crear_usuari", "INSERT INTO usuaris (nom, cognom, email, contrasenya) VALUES (%s, %s, %s, %s)")
+CANVIAR_CONTRASENYA = Sentencia("canviar_contrasenya", "UPDATE usuaris SET contrasenya = %s WHERE id = %s")
+
+# Sensors
+SENSORS = Sentencia("sensors", "SELECT sensor_id, estat, usuari_id FROM sensors", FilaSensor)
+SENSOR_PER_ID = Sentencia(
+    "sensor_per_id", "SELECT sensor_id, estat, usuari_id FROM sensors WHERE sensor_id = %s", FilaSensor)
+CREAR_SENSOR = Sentencia("crear_sensor", "INSERT INTO sensors (sensor_id, estat, usuari_id) VALUES (%s, %s, %s)")
+ACTUALITZAR_SENSOR = Sentencia(
+    "actualitzar_sensor", "UPDATE sensors SET estat = %s, usuari_id = %s WHERE sensor_id = %s")
+ELIMINAR_SENSOR = Sentencia("eliminar_sensor", "DELETE FROM sensors WHERE sensor_id = %s")
+SENSOR_EXISTEIX = Sentencia("sensor_existeix", "SELECT sensor_id FROM sensors WHERE sensor_id = %s")
+IDS_SENSORS = Sentencia("ids_sensors", "SELECT sensor_id FROM sensors ORDER BY sensor_id LIMIT %s")
+# Amb humitat_sol particionada no hi ha FK amb ON DELETE CASCADE (vegeu retencio.py):
+# les lectures s'esborren per lots, cada un en la seva transacció
+IDS_LECTURES_SENSOR = Sentencia("ids_lectures_sensor", "SELECT id FROM humitat_sol WHERE sensor_id = %s LIMIT %s")
+ELIMINAR_ROLLUPS_SENSOR = Sentencia("eliminar_rollups_sensor", "DELETE FROM humitat_rollup WHERE sensor_id = %s")
+
+# Lectures. INSERIR_LECTURA i UPSERT_ROLLUP van amb executemany, que les reescriu com a
+# INSERT multi-fila (vegeu ingesta.py i rollups.py): es fan servir amb .sql
+INSERIR_LECTURA = Sentencia(
+    "inserir_lectura", "INSERT INTO humitat_sol (sensor_id, valor, timestamp) VALUES (%s, %s, %s)")
+UPSERT_ROLLUP = Sentencia("upsert_rollup", """
+    INSERT INTO humitat_rollup (sensor_id, bucket, inici, n, suma, minim, maxim)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        n = n + VALUES(n),
+        suma = suma + VALUES(suma),
+        minim = LEAST(minim, VALUES(minim)),
+        maxim = GREATEST(maxim, VALUES(maxim))
+""")
+LECTURES_RECENTS = Sentencia("lectures_recents", """
+    SELECT valor, timestamp
+    FROM humitat_sol
+    WHERE sensor_id = %s
+    ORDER BY timestamp DESC
+    LIMIT %s
+""")
+# Seguiment de les lectures dels altres workers (coherencia.py)
+ULTIM_ID_LECTURA = Sentencia("ultim_id_lectura", "SELECT MAX(id) FROM humitat_sol")
+LECTURES_NOVES = Sentencia(
+    "lectures_noves", "SELECT id, sensor_id, valor, timestamp FROM humitat_sol WHERE id > %s ORDER BY id LIMIT %s")
+LECTURES_FORAT = Sentencia(
+    "lectures_forat", "SELECT id, sensor_id, valor, timestamp FROM humitat_sol WHERE id BETWEEN %s AND %s")
+
+# Plantes
+PLANTES = Sentencia("plantes", "SELECT id, nom, ubicacio, sensor_id, usuari_id, imagen_url FROM planta", FilaPlanta)
+PLANTA_PER_ID = Sentencia(
+    "planta_per_id", "SELECT id, nom, ubicacio, sensor_id, usuari_id, imagen_url FROM planta WHERE id = %s",
+    FilaPlanta)
+PLANTES_PER_USUARI = Sentencia("plantes_per_usuari", """
+    SELECT id, nom, ubicacio, sensor_id, usuari_id, imagen_url
+    FROM planta
+    WHERE usuari_id = %s
+    ORDER BY ubicacio, nom
+""", FilaPlanta)
+PLANTES_DASHBOARD = Sentencia("plantes_dashboard", """
+    SELECT p.id, p.nom, p.ubicacio, p.sensor_id, p.usuari_id, p.imagen_url, s.estat AS sensor_estat
+    FROM planta p
+    LEFT JOIN sensors s ON p.sensor_id = s.sensor_id
+    WHERE p.usuari_id = %s
+    ORDER BY p.ubicacio, p.nom
+""", FilaPlantaDashboard)
+PLANTA_COMPLETA = Sentencia("planta_completa", """
+    SELECT p.id AS planta_id, p.nom AS planta_nom, p.ubicacio, p.imagen_url,
+           s.sensor_id, s.estat AS sensor_estat
+    FROM planta p
+    LEFT JOIN sensors s ON p.sensor_id = s.sensor_id
+    WHERE p.id = %s
+""", FilaPlantaCompleta)
+CREAR_PLANTA = Sentencia(
+    "crear_planta", "INSERT INTO planta (nom, ubicacio, sensor_id, usuari_id, imagen_url) VALUES (%s, %s, %s, %s, %s)")
+ACTUALITZAR_PLANTA = Sentencia(
+    "actualitzar_planta",
+    "UPDATE planta SET nom = %s, ubicacio = %s, sensor_id = %s, usuari_id = %s, imagen_url = %s WHERE id = %s")
+ELIMINAR_PLANTA = Sentencia("eliminar_planta", "DELETE FROM planta WHERE id = %s")
+
+# Versions dels recursos (vegeu versions.py i coherencia.py)
+VERSIONS = Sentencia("versions", "SELECT recurs, versio, modificat FROM canvis_versio", FilaVersio)
+INCREMENTAR_VERSIO = Sentencia(
+    "incrementar_versio", "UPDATE canvis_versio SET versio = versio + 1, modificat = %s WHERE recurs = %s")
+
+async def _executar(db, sentencia, params):
+    if preparades.SENTENCIES_PREPARADES:
+        # Sense el cursor mesurat: el temps es registra aquí
+        inici = time.perf_counter()
+        try:
+            return await preparades.executar_preparada(db.crua, sentencia.sql, params)
+        finally:
+            registrar_consulta(sentencia.sql, time.perf_counter() - inici)
+    cursor = await db.cursor()
+    try:
+        await cursor.execute(sentencia.sql, params)
+        files = await cursor.fetchall()
+        return files, cursor.rowcount, cursor.lastrowid
+    finally:
+        await cursor.close()
+
+
+def _tipar(files, tipus):
+    if tipus is None:
+        return list(files)
+    return [tipus(*fila) for fila in files]
+
+
+async def consultar(db, sentencia, params=()):
+    files, _, _ = await _executar(db, sentencia, params)
+    return _tipar(files, sentencia.tipus)
+
+
+async def consultar_una(db, sentencia, params=()):
+    files = await consultar(db, sentencia, params)
+    return files[0] if files else None
+
+
+async def executar(db, sentencia, params=()):
+    # Torna (files afectades, id generat)
+    _, afectades, id_generat = await _executar(db, sentencia, params)
+    return afectades, id_generat
+
+
+async def executar_sql(db, sql, params=()):
+    # Com consultar_sql, per a escriptures amb SQL variable; torna les files afectades
+    cursor = await db.cursor()
+    try:
+        return await cursor.execute(sql, params)
+    finally:
+        await cursor.close()
+
+
+async def consultar_sql(db, sql, params=(), tipus=None):
+    # SQL que canvia d'una petició a l'altra: es fa amb text, sense preparar
+    cursor = await db.cursor()
+    try:
+        await cursor.execute(sql, params)
+        return _tipar(await cursor.fetchall(), tipus)
+    finally:
+        await cursor.close()
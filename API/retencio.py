@@ -0,0 +1,226 @@
+# Retenció de humitat_sol: les lectures crues es guarden ECOSENSE_RETENCIO_DIES dies;
+# les més antigues només queden com a agregats horaris i diaris (humitat_rollup).
+#
+#   cd API && python retencio.py particionar [--dry-run]   # un cop: particions mensuals
+#   cd API && python retencio.py executar [--dry-run]      # periòdicament (cron diari)
+#   cd API && python retencio.py estat                     # particions i files aproximades
+#
+# Amb la taula particionada per mesos, esborrar un mes és un DROP PARTITION (instantani)
+# en lloc d'un DELETE de milions de files. Sense particionar, executar esborra per lots.
+import argparse
+import os
+import time
+from datetime import date, timedelta
+
+from client import db_client
+from rollups import backfill
+
+RETENCIO_DIES = int(os.environ.get("ECOSENSE_RETENCIO_DIES", "90"))
+# Particions que es creen per endavant (ingesta de lectures futures sense caure a pfutur)
+RETENCIO_MESOS_ENDAVANT = int(os.environ.get("ECOSENSE_RETENCIO_MESOS_ENDAVANT", "3"))
+RETENCIO_LOT = 10000
+
+# Franges que es conserven quan s'esborren les lectures crues
+BUCKETS_COMPACTATS = ("1h", "1d")
+
+
+def _inici_mes(dia):
+    return date(dia.year, dia.month, 1)
+
+
+def _mes_seguent(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def _mesos(desde, fins):
+    mes = _inici_mes(desde)
+    while mes <= fins:
+        yield mes
+        mes = _mes_seguent(mes)
+
+
+def _definicio_particio(mes):
+    return f"PARTITION p{mes:%Y%m} VALUES LESS THAN ('{_mes_seguent(mes).isoformat()}')"
+
+
+def _particions(cursor):
+    # [(nom, fins (date) o None per MAXVALUE, files aproximades)]
+    cursor.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'humitat_sol' AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """)
+    particions = []
+    for nom, descripcio, files in cursor.fetchall():
+        fins = None if descripcio == "MAXVALUE" else date.fromisoformat(descripcio.strip("'")[:10])
+        particions.append((nom, fins, files or 0))
+    return particions
+
+
+def _executar(cursor, sql, dry_run, params=()):
+    print(("[dry-run] " if dry_run else "") + " ".join(sql.split()))
+    if dry_run:
+        return
+    inici = time.monotonic()
+    cursor.execute(sql, params)
+    print(f"  fet en {time.monotonic() - inici:.1f} s")
+
+
+def _bloquejar(cursor):
+    cursor.execute("SELECT GET_LOCK('ecosense_retencio', 0)")
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("Ja hi ha un altre procés de retenció en marxa")
+
+
+def _desbloquejar(cursor):
+    cursor.execute("SELECT RELEASE_LOCK('ecosense_retencio')")
+    cursor.fetchone()
+
+
+def particionar(dry_run=False):
+    # La clau de partició ha de formar part de la clau primària, i InnoDB no admet
+    # claus foranes en taules particionades: la PK passa a (id, timestamp) i es treu la FK
+    # a sensors (eliminar_sensor ja esborra les lectures del sensor explícitament).
+    # Amb el mateix bloqueig que executar: dos processos no poden fer l'ALTER alhora.
+    with db_client() as db:
+        cursor = db.cursor()
+        try:
+            _bloquejar(cursor)
+            try:
+                if _particions(cursor):
+                    print("humitat_sol ja està particionada")
+                    return False
+                cursor.execute("""
+                    SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+                    WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = 'humitat_sol'
+                """)
+                claus_foranes = [fila[0] for fila in cursor.fetchall()]
+                cursor.execute("SELECT MIN(timestamp) FROM humitat_sol")
+                primera = cursor.fetchone()[0]
+
+                avui = date.today()
+                mesos = list(_mesos((primera.date() if primera else avui), avui + timedelta(days=31 * RETENCIO_MESOS_ENDAVANT)))
+                sentencies = [f"ALTER TABLE humitat_sol DROP FOREIGN KEY `{nom}`" for nom in claus_foranes]
+                sentencies.append("ALTER TABLE humitat_sol DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)")
+                sentencies.append(
+                    "ALTER TABLE humitat_sol PARTITION BY RANGE COLUMNS(timestamp) ("
+                    + ", ".join(_definicio_particio(mes) for mes in mesos)
+                    + ", PARTITION pfutur VALUES LESS THAN (MAXVALUE))"
+                )
+                for i, sql in enumerate(sentencies, 1):
+                    print(f"[{i}/{len(sentencies)}]", end=" ")
+                    _executar(cursor, sql, dry_run)
+            finally:
+                _desbloquejar(cursor)
+        finally:
+            cursor.close()
+    return True
+
+
+def _crear_particions_futures(cursor, particions, dry_run):
+    existents = {nom for nom, _, _ in particions}
+    limit = date.today() + timedelta(days=31 * RETENCIO_MESOS_ENDAVANT)
+    ultima = max((fins for _, fins, _ in particions if fins is not None), default=_inici_mes(date.today()))
+    noves = [mes for mes in _mesos(ultima, limit) if f"p{mes:%Y%m}" not in existents]
+    if noves:
+        _executar(cursor, "ALTER TABLE humitat_sol REORGANIZE PARTITION pfutur INTO ("
+                  + ", ".join(_definicio_particio(mes) for mes in noves)
+                  + ", PARTITION pfutur VALUES LESS THAN (MAXVALUE))", dry_run)
+
+
+def _esborrar_per_lots(db, cursor, sql, params, dry_run, descripcio):
+    if dry_run:
+        print(f"[dry-run] {' '.join(sql.split())} (per lots de {RETENCIO_LOT})")
+        return
+    total = 0
+    while True:
+        cursor.execute(sql + f" LIMIT {RETENCIO_LOT}", params)
+        db.commit()
+        total += cursor.rowcount
+        print(f"  {descripcio}: {total} files esborrades", end="\r", flush=True)
+        if cursor.rowcount < RETENCIO_LOT:
+            break
+    print()
+
+
+def executar(dies=RETENCIO_DIES, dry_run=False):
+    limit = date.today() - timedelta(days=dies)
+    with db_client() as db:
+        cursor = db.cursor()
+        try:
+            _bloquejar(cursor)
+            try:
+                particions = _particions(cursor)
+                if particions:
+                    _crear_particions_futures(cursor, particions, dry_run)
+                    # Només mesos sencers anteriors al límit
+                    esborrar = [(nom, fins, files) for nom, fins, files in particions
+                                if fins is not None and fins <= limit]
+                    fins = max((f for _, f, _ in esborrar), default=None)
+                else:
+                    fins = limit
+
+                cursor.execute("SELECT MIN(timestamp) FROM humitat_sol WHERE timestamp < %s", (fins or limit,))
+                primera = cursor.fetchone()[0]
+                if fins is None or primera is None:
+                    print(f"No hi ha lectures anteriors a {limit.isoformat()} per esborrar")
+                    return
+
+                # 1. Agregats horaris i diaris complets de tot el que s'esborrarà
+                dies_compactar = (fins - primera.date()).days
+                print(f"Compactant {dies_compactar} dies ({primera.date().isoformat()} - {fins.isoformat()}) a {', '.join(BUCKETS_COMPACTATS)}")
+                if not dry_run:
+                    # La primera data pot ser d'un dia a mig esborrar per una execució interrompuda:
+                    # les franges que ja en tenen més lectures no es toquen
+                    backfill(primera.date(), fins, buckets=BUCKETS_COMPACTATS, conservar=True)
+
+                # 2. Els agregats de 5 minuts segueixen la mateixa retenció que les lectures
+                _esborrar_per_lots(db, cursor, "DELETE FROM humitat_rollup WHERE bucket = '5m' AND inici < %s",
+                                   (fins,), dry_run, "humitat_rollup (5m)")
+
+                # 3. Les lectures crues
+                if particions:
+                    total = sum(files for _, _, files in esborrar)
+                    print(f"Esborrant {len(esborrar)} particions (~{total} files)")
+                    _executar(cursor, "ALTER TABLE humitat_sol DROP PARTITION "
+                              + ", ".join(nom for nom, _, _ in esborrar), dry_run)
+                else:
+                    _esborrar_per_lots(db, cursor, "DELETE FROM humitat_sol WHERE timestamp < %s ORDER BY timestamp",
+                                       (fins,), dry_run, "humitat_sol")
+            finally:
+                _desbloquejar(cursor)
+        finally:
+            cursor.close()
+
+
+def estat():
+    with db_client() as db:
+        cursor = db.cursor()
+        try:
+            return _particions(cursor)
+        finally:
+            cursor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retenció de les lectures de humitat_sol")
+    sub = parser.add_subparsers(dest="ordre", required=True)
+    p = sub.add_parser("particionar", help="Particiona humitat_sol per mesos (un sol cop)")
+    p.add_argument("--dry-run", action="store_true", help="Mostra les sentències sense executar-les")
+    p = sub.add_parser("executar", help="Compacta i esborra les lectures fora de la finestra de retenció")
+    p.add_argument("--dies", type=int, default=RETENCIO_DIES)
+    p.add_argument("--dry-run", action="store_true", help="Mostra què es faria sense canviar res")
+    sub.add_parser("estat", help="Mostra les particions de humitat_sol")
+    args = parser.parse_args()
+
+    if args.ordre == "particionar":
+        particionar(args.dry_run)
+    elif args.ordre == "executar":
+        executar(args.dies, args.dry_run)
+    else:
+        particions = estat()
+        if not particions:
+            print("humitat_sol no està particionada")
+        for nom, fins, files in particions:
+            print(f"{nom:10} fins {fins.isoformat() if fins else 'MAXVALUE':10} ~{files} files")
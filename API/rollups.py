@@ -0,0 +1,139 @@
+# Agregats per franges de temps (5m, 1h, 1d) de humitat_sol
+#
+# La taula humitat_rollup la crea migracions.py i s'actualitza a cada ingesta.
+# Per construir els agregats a partir de l'historial:
+#
+#   cd API && python rollups.py backfill --desde 2024-01-01
+import argparse
+from datetime import date, datetime, timedelta
+
+import aiomysql
+
+import repositori
+from client import db_client
+from client_async import db_client_async
+from migracions import migrar
+
+# Inici de la franja, en Python (ingesta) i en SQL (backfill); han de coincidir
+BUCKETS = {
+    "5m": (
+        lambda ts: ts.replace(minute=ts.minute - ts.minute % 5, second=0, microsecond=0),
+        "TIMESTAMP(DATE(timestamp), MAKETIME(HOUR(timestamp), MINUTE(timestamp) DIV 5 * 5, 0))",
+    ),
+    "1h": (
+        lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+        "TIMESTAMP(DATE(timestamp), MAKETIME(HOUR(timestamp), 0, 0))",
+    ),
+    "1d": (
+        lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0),
+        "TIMESTAMP(DATE(timestamp))",
+    ),
+}
+
+
+def agregar(files):
+    # files: (sensor_id, valor, timestamp) -> files per repositori.UPSERT_ROLLUP, ordenades per clau
+    agregats = {}
+    for sensor_id, valor, ts in files:
+        for bucket, (inici_de, _) in BUCKETS.items():
+            clau = (sensor_id, bucket, inici_de(ts))
+            actual = agregats.get(clau)
+            if actual is None:
+                agregats[clau] = [1, valor, valor, valor]
+            else:
+                actual[0] += 1
+                actual[1] += valor
+                if valor < actual[2]:
+                    actual[2] = valor
+                if valor > actual[3]:
+                    actual[3] = valor
+    # Ordre fix per evitar deadlocks entre ingestes concurrents
+    return [(*clau, *valors) for clau, valors in sorted(agregats.items())]
+
+
+async def actualitzar_rollups(cursor, files):
+    if files:
+        await cursor.executemany(repositori.UPSERT_ROLLUP.sql, agregar(files))
+
+
+async def obtenir_agregats(sensor_id, bucket, start_date, end_date, limit):
+    # Les últimes `limit` franges dins l'interval, en ordre cronològic
+    query = """
+        SELECT inici, minim AS min, maxim AS max, suma / n AS avg, n AS count
+        FROM humitat_rollup
+        WHERE sensor_id = %s AND bucket = %s
+    """
+    params = [sensor_id, bucket]
+    if start_date:
+        query += " AND inici >= %s"
+        params.append(start_date)
+    if end_date:
+        query += " AND inici <= %s"
+        params.append(end_date)
+    query += " ORDER BY inici DESC LIMIT %s"
+    params.append(limit)
+
+    async with db_client_async() as db:
+        cursor = await db.cursor(aiomysql.DictCursor)
+        try:
+            await cursor.execute(query, tuple(params))
+            agregats = await cursor.fetchall()
+        finally:
+            await cursor.close()
+    agregats.reverse()
+    return agregats
+
+
+# Substitueix la franja existent
+ACTUALITZAR_FRANJA = "n = VALUES(n), suma = VALUES(suma), minim = VALUES(minim), maxim = VALUES(maxim)"
+# Només si el recàlcul té més lectures: una franja de la qual ja s'han esborrat lectures
+# crues (p. ex. un DELETE per lots de retencio.py interromput) conserva l'agregat complet.
+# n va l'última: MySQL aplica les assignacions en ordre i les altres comparen amb l'antic.
+CONSERVAR_FRANJA = (
+    "suma = IF(VALUES(n) >= n, VALUES(suma), suma), "
+    "minim = IF(VALUES(n) >= n, VALUES(minim), minim), "
+    "maxim = IF(VALUES(n) >= n, VALUES(maxim), maxim), "
+    "n = GREATEST(n, VALUES(n))"
+)
+
+
+def backfill(desde: date, fins: date, sensor_id=None, buckets=None, conservar=False):
+    # Recalcula les franges dia a dia a partir de humitat_sol (substitueix els agregats
+    # existents; amb conservar, només els que el recàlcul no deixaria amb menys lectures)
+    buckets = buckets or tuple(BUCKETS)
+    filtre_sensor = " AND sensor_id = %s" if sensor_id is not None else ""
+    actualitzar = CONSERVAR_FRANJA if conservar else ACTUALITZAR_FRANJA
+    dies = (fins - desde).days
+    migrar()
+    with db_client() as db:
+        cursor = db.cursor()
+        try:
+            for i in range(dies):
+                dia = desde + timedelta(days=i)
+                inici, final = datetime.combine(dia, datetime.min.time()), datetime.combine(dia + timedelta(days=1), datetime.min.time())
+                params = (inici, final) + ((sensor_id,) if sensor_id is not None else ())
+                for bucket in buckets:
+                    expressio = BUCKETS[bucket][1]
+                    cursor.execute(f"""
+                        INSERT INTO humitat_rollup (sensor_id, bucket, inici, n, suma, minim, maxim)
+                        SELECT sensor_id, '{bucket}', {expressio}, COUNT(*), SUM(valor), MIN(valor), MAX(valor)
+                        FROM humitat_sol
+                        WHERE timestamp >= %s AND timestamp < %s{filtre_sensor}
+                        GROUP BY sensor_id, 3
+                        ON DUPLICATE KEY UPDATE {actualitzar}
+                    """, params)
+                db.commit()
+                print(f"[{i + 1}/{dies}] {dia.isoformat()} fet")
+        finally:
+            cursor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agregats de humitat_sol")
+    sub = parser.add_subparsers(dest="ordre", required=True)
+    p = sub.add_parser("backfill", help="Construeix els agregats a partir de l'historial")
+    p.add_argument("--desde", type=date.fromisoformat, required=True)
+    p.add_argument("--fins", type=date.fromisoformat, default=date.today() + timedelta(days=1))
+    p.add_argument("--sensor", type=int)
+    args = parser.parse_args()
+    backfill(args.desde, args.fins, args.sensor)
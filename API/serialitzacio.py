@@ -0,0 +1,33 @@
+# Resposta JSON ràpida per a llistes llargues (opcional, ECOSENSE_RESPOSTA_RAPIDA=1)
+#
+# Les files ja venen tipades de la base de dades (int, float, datetime), així que es
+# poden serialitzar directament amb orjson sense validar-les una a una amb pydantic.
+# orjson escriu els datetime en C amb el mateix format ISO que isoformat().
+import os
+from decimal import Decimal
+
+import orjson
+from fastapi import Response
+
+RESPOSTA_RAPIDA = os.environ.get("ECOSENSE_RESPOSTA_RAPIDA", "0") == "1"
+
+
+def _per_defecte(valor):
+    if isinstance(valor, Decimal):
+        return float(valor)
+    raise TypeError
+
+
+class RespostaRapida(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_per_defecte)
+
+
+def resposta_llista(files, response: Response):
+    # Sense l'opció activa es retornen les files i FastAPI aplica el response_model
+    if not RESPOSTA_RAPIDA:
+        return files
+    capcaleres = {k: v for k, v in response.headers.items() if k not in ("content-length", "content-type")}
+    return RespostaRapida(files, headers=capcaleres)
@@ -0,0 +1,83 @@
+# Versions dels recursos de catàleg per a GET condicionals (ETag / Last-Modified)
+#
+# La versió de cada recurs és a la taula canvis_versio, compartida per tots els workers:
+# les escriptures la incrementen a la mateixa transacció (confirmar) i coherencia.py la
+# torna a llegir periòdicament. Un cop sincronitzat, tots els workers donen el mateix ETag
+# per a les mateixes dades.
+import os
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+import repositori
+
+# Diferent a cada arrencada: abans de llegir canvis_versio, un ETag d'abans d'un reinici
+# no pot donar un 304 fals
+_ARRENCADA = f"{os.getpid():x}{int(time.time()):x}"
+
+RECURSOS = ("usuaris", "sensors", "plantes")
+
+_versions = {recurs: 0 for recurs in RECURSOS}
+_modificat = {recurs: time.time() for recurs in RECURSOS}
+_sincronitzat = False
+
+
+def sincronitzar(files):
+    # files: FilaVersio de canvis_versio. Torna els recursos que han canviat.
+    global _sincronitzat
+    canviats = []
+    for fila in files:
+        if fila.recurs not in _versions:
+            continue
+        # Les versions només pugen: una lectura antiga no desfà un confirmar més recent
+        if not _sincronitzat or fila.versio > _versions[fila.recurs]:
+            if fila.versio != _versions[fila.recurs]:
+                canviats.append(fila.recurs)
+            _versions[fila.recurs] = fila.versio
+            _modificat[fila.recurs] = float(fila.modificat)
+    _sincronitzat = True
+    return canviats
+
+
+async def confirmar(db, *recursos):
+    # Commit d'una escriptura sobre els recursos. La versió s'incrementa abans del commit,
+    # així els altres workers no poden veure les dades noves amb la versió antiga.
+    ara = time.time()
+    for recurs in sorted(recursos):
+        await repositori.executar(db, repositori.INCREMENTAR_VERSIO, (ara, recurs))
+    files = await repositori.consultar(db, repositori.VERSIONS)
+    await db.commit()
+    sincronitzar(files)
+
+
+def etag(*recursos):
+    versions = "-".join(f"{recurs}{_versions[recurs]}.{int(_modificat[recurs])}" for recurs in recursos)
+    return f'W/"{versions}"' if _sincronitzat else f'W/"{_ARRENCADA}-{versions}"'
+
+
+def condicional(request: Request, response: Response, *recursos):
+    # Posa ETag i Last-Modified a la resposta; si el client ja té la versió actual
+    # retorna un 304 sense tocar la base de dades
+    valor_etag = etag(*recursos)
+    modificat = int(max(_modificat[recurs] for recurs in recursos))
+    capcaleres = {"ETag": valor_etag, "Cache-Control": "no-cache"}
+    # Last-Modified només té resolució de segons: si el recurs ha canviat en aquest mateix
+    # segon, una altra escriptura abans que acabi tindria el mateix valor i un
+    # If-Modified-Since donaria un 304 amb dades antigues. Llavors no s'envia.
+    if int(time.time()) > modificat:
+        capcaleres["Last-Modified"] = formatdate(modificat, usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if valor_etag in [e.strip() for e in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=capcaleres)
+    elif (if_modified_since := request.headers.get("if-modified-since")):
+        try:
+            if parsedate_to_datetime(if_modified_since).timestamp() >= modificat:
+                return Response(status_code=304, headers=capcaleres)
+        except (TypeError, ValueError):
+            pass
+
+    response.headers.update(capcaleres)
+    return None